@@ -0,0 +1,538 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from extraction_cache import DEEPREAD_DATA_DIR
+from scheduler import SchedulerOverloaded
+from shared_state import SHARED_STATE_ENABLED, connect_sqlite
+
+# --- 批量导入任务配置 (均可通过环境变量覆盖) ---
+BATCH_JOB_WORKERS = int(os.getenv("BATCH_JOB_WORKERS", "4"))  # 同时处理的文档数
+BATCH_JOB_DB_PATH = os.getenv("BATCH_JOB_DB_PATH", os.path.join(DEEPREAD_DATA_DIR, "batch_jobs.sqlite3"))
+BATCH_UPLOAD_DIR = os.getenv("BATCH_UPLOAD_DIR", os.path.join(DEEPREAD_DATA_DIR, "batch_uploads"))  # 上传文件落盘位置，任务中断后可继续
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "1000"))  # 单个任务最多包含的文件数
+BATCH_HEARTBEAT_SECONDS = float(os.getenv("BATCH_HEARTBEAT_SECONDS", "10"))  # 各进程登记心跳并接手无主文件的周期
+BATCH_WORKER_TIMEOUT_SECONDS = float(os.getenv("BATCH_WORKER_TIMEOUT_SECONDS", "60"))  # 心跳超时即视为该进程已退出
+BATCH_EVENTS_POLL_SECONDS = float(os.getenv("BATCH_EVENTS_POLL_SECONDS", "1"))  # 多 worker 时轮询其他进程处理进度的周期
+# 目录导入只能读取这些根目录 (以 os.pathsep 分隔) 下的 PDF；未配置时禁用目录导入
+BATCH_DIRECTORY_ROOTS = [
+    os.path.realpath(os.path.expanduser(root.strip()))
+    for root in os.getenv("BATCH_DIRECTORY_ROOTS", "").split(os.pathsep) if root.strip()
+]
+
+# 任务状态 (jobs.state)：active 正常处理；paused 等待调用 resume (重启后缺少用户 API Key)；cancelled 已取消
+# 文件状态 (items.status)：pending → running → done / failed / cancelled
+# 多 worker 部署时所有进程共享同一个数据库：文件以原子更新认领 (items.owner)，进程登记心跳 (workers 表)，
+# 心跳超时进程的 running 文件由其他进程重置为 pending 继续处理
+ITEM_FINAL_STATUSES = ("done", "failed", "cancelled")
+
+# processor(item, options, api_key, on_stage) -> 写回 items 表的字段 (doc_id、page_count 等)
+ItemProcessor = Callable[[dict, dict, Optional[str], Callable[[str], Awaitable[None]]], Awaitable[dict]]
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def job_upload_dir(job_id: str) -> str:
+    return os.path.join(BATCH_UPLOAD_DIR, job_id)
+
+
+def _is_within(path: str, root: str) -> bool:
+    try:
+        return os.path.commonpath([path, root]) == root
+    except ValueError:  # Windows 上不同盘符
+        return False
+
+
+def resolve_batch_directory(directory: str, roots: Optional[list[str]] = None) -> str:
+    """把目录解析为真实路径 (展开 .. 与符号链接)，不在允许的根目录下时抛出 PermissionError"""
+    roots = BATCH_DIRECTORY_ROOTS if roots is None else roots
+    if not roots:
+        raise PermissionError("Directory import is disabled (set BATCH_DIRECTORY_ROOTS to enable it).")
+    resolved = os.path.realpath(os.path.expanduser(directory))
+    if not any(_is_within(resolved, root) for root in roots):
+        raise PermissionError(f"Directory is outside the allowed roots: {directory}")
+    return resolved
+
+
+def list_pdf_files(directory: str, recursive: bool = False, roots: Optional[list[str]] = None) -> list[str]:
+    """
+    列出目录下的 PDF 文件 (按路径排序，保证同一目录总是得到相同的处理顺序)。
+    给出 roots 时返回真实路径，并跳过指向根目录之外的符号链接。
+    """
+    if roots is not None:
+        directory = resolve_batch_directory(directory, roots)
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f"Directory not found: {directory}")
+    if recursive:
+        paths = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(directory)
+            for name in names if name.lower().endswith(".pdf")
+        ]
+    else:
+        paths = [entry.path for entry in os.scandir(directory) if entry.is_file() and entry.name.lower().endswith(".pdf")]
+    if roots is not None:
+        paths = [path for path in map(os.path.realpath, paths) if any(_is_within(path, root) for root in roots)]
+    return sorted(paths)
+
+
+def derive_job_status(state: str, counts: dict) -> str:
+    if state != "active":
+        return state
+    if counts.get("pending") or counts.get("running"):
+        return "running"
+    return "completed"
+
+
+class BatchJobStore:
+    """
+    批量任务状态的 SQLite 持久化：任务 (jobs) 与其中每个文件 (items) 的状态在每次变化时立即落盘，
+    进程中断后重启即可从未完成的文件继续。所有方法都是阻塞 IO，异步代码中请用 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, db_path: str = BATCH_JOB_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = connect_sqlite(self.db_path, row_factory=sqlite3.Row)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " state TEXT NOT NULL,"
+                " source TEXT,"
+                " options TEXT NOT NULL,"
+                " uses_user_key INTEGER NOT NULL,"
+                " owner TEXT,"  # 持有用户 API Key (只在内存中) 的进程
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                " job_id TEXT NOT NULL,"
+                " item_index INTEGER NOT NULL,"
+                " filename TEXT NOT NULL,"
+                " path TEXT NOT NULL,"
+                " owned INTEGER NOT NULL,"  # 1 表示文件是上传后由后端保存的副本，处理完成后删除
+                " status TEXT NOT NULL,"
+                " stage TEXT,"
+                " doc_id TEXT,"
+                " page_count INTEGER,"
+                " result TEXT,"
+                " error TEXT,"
+                " owner TEXT,"  # 认领该文件的进程
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (job_id, item_index))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)")
+            for table in ("jobs", "items"):  # 旧版本创建的数据库没有 owner 列
+                columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if "owner" not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN owner TEXT")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _item_dict(row: sqlite3.Row) -> dict:
+        item = dict(row)
+        item["owned"] = bool(item["owned"])
+        item["result"] = json.loads(item["result"]) if item["result"] else None
+        return item
+
+    def create_job(self, job_id: str, items: list[tuple[str, str, bool]], options: dict,
+                   source: Optional[str] = None, uses_user_key: bool = False, owner: Optional[str] = None) -> None:
+        """items 为 (文件名, 路径, 是否为后端保存的副本) 列表"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO jobs (job_id, state, source, options, uses_user_key, owner, created_at, updated_at)"
+                " VALUES (?, 'active', ?, ?, ?, ?, ?, ?)",
+                (job_id, source, json.dumps(options), int(uses_user_key), owner, now, now),
+            )
+            conn.executemany(
+                "INSERT INTO items (job_id, item_index, filename, path, owned, status, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                [(job_id, index, filename, path, int(owned), now) for index, (filename, path, owned) in enumerate(items)],
+            )
+            conn.commit()
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        job["uses_user_key"] = bool(job["uses_user_key"])
+        job["counts"] = {status: counts.get(status, 0) for status in ("pending", "running", *ITEM_FINAL_STATUSES)}
+        job["total"] = sum(counts.values())
+        job["status"] = derive_job_status(job["state"], counts)
+        return job
+
+    def list_jobs(self) -> list[dict]:
+        with self._lock:
+            job_ids = [row[0] for row in self._connection().execute("SELECT job_id FROM jobs ORDER BY created_at DESC")]
+        return [job for job in map(self.get_job, job_ids) if job is not None]
+
+    def get_item(self, job_id: str, index: int) -> Optional[dict]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT * FROM items WHERE job_id = ? AND item_index = ?", (job_id, index)
+            ).fetchone()
+        return self._item_dict(row) if row is not None else None
+
+    def list_items(self, job_id: str) -> list[dict]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT * FROM items WHERE job_id = ? ORDER BY item_index", (job_id,)
+            ).fetchall()
+        return [self._item_dict(row) for row in rows]
+
+    def update_item(self, job_id: str, index: int, **fields) -> None:
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False) if fields["result"] else None
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(f"UPDATE items SET {assignments} WHERE job_id = ? AND item_index = ?",
+                         (*fields.values(), job_id, index))
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (fields["updated_at"], job_id))
+            conn.commit()
+
+    def set_job_state(self, job_id: str, state: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE job_id = ?", (state, time.time(), job_id))
+            if state == "cancelled":
+                conn.execute("UPDATE items SET status = 'cancelled', stage = NULL WHERE job_id = ? AND status = 'pending'",
+                             (job_id,))
+            conn.commit()
+
+    def set_job_owner(self, job_id: str, owner: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("UPDATE jobs SET owner = ? WHERE job_id = ?", (owner, job_id))
+            conn.commit()
+
+    def claim_item(self, job_id: str, index: int, owner: str) -> bool:
+        """原子地把 pending 文件置为 running 并记录认领的进程；已被其他进程认领时返回 False"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            claimed = conn.execute(
+                "UPDATE items SET status = 'running', stage = 'queued', owner = ?, updated_at = ?"
+                " WHERE job_id = ? AND item_index = ? AND status = 'pending'",
+                (owner, now, job_id, index),
+            ).rowcount
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (now, job_id))
+            conn.commit()
+        return claimed > 0
+
+    def heartbeat(self, worker_id: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO workers (worker_id, heartbeat_at) VALUES (?, ?)",
+                         (worker_id, time.time()))
+            conn.commit()
+
+    def unregister_worker(self, worker_id: str) -> None:
+        """进程正常退出时调用：正在处理的文件放回 pending，其他进程或下次启动可立即接手"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("UPDATE items SET status = 'pending', stage = NULL, owner = NULL"
+                         " WHERE status = 'running' AND owner = ?", (worker_id,))
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+            conn.commit()
+
+    def items_updated_since(self, job_id: str, since: float, exclude_owner: str) -> list[dict]:
+        """其他进程在 since 之后更新过的文件 (用于把它们的进度推送给本进程的 SSE 订阅者)"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT * FROM items WHERE job_id = ? AND updated_at > ? AND (owner IS NULL OR owner != ?)"
+                " ORDER BY updated_at", (job_id, since, exclude_owner)
+            ).fetchall()
+        return [self._item_dict(row) for row in rows]
+
+    def requeue_items(self, job_id: str, statuses: tuple[str, ...]) -> None:
+        """把指定状态的文件重新置为 pending (resume 时重试失败的文件)"""
+        placeholders = ", ".join("?" for _ in statuses)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                f"UPDATE items SET status = 'pending', stage = NULL, error = NULL"
+                f" WHERE job_id = ? AND status IN ({placeholders})",
+                (job_id, *statuses),
+            )
+            conn.commit()
+
+    def recover_interrupted(self, worker_id: str, timeout: float = BATCH_WORKER_TIMEOUT_SECONDS) -> list[dict]:
+        """
+        启动时及之后每个心跳周期调用：心跳超时的进程视为已退出，它运行中被打断的文件重置为 pending；
+        返回仍有未完成文件的 active 任务，owner_alive 表示持有该任务 API Key 的进程是否仍在运行。
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM workers WHERE heartbeat_at < ? AND worker_id != ?", (time.time() - timeout, worker_id))
+            conn.execute("UPDATE items SET status = 'pending', stage = NULL, owner = NULL WHERE status = 'running'"
+                         " AND (owner IS NULL OR owner NOT IN (SELECT worker_id FROM workers))")
+            conn.commit()
+            live_workers = {row[0] for row in conn.execute("SELECT worker_id FROM workers")}
+            job_ids = [row[0] for row in conn.execute(
+                "SELECT DISTINCT jobs.job_id FROM jobs JOIN items ON items.job_id = jobs.job_id"
+                " WHERE jobs.state = 'active' AND items.status = 'pending' ORDER BY jobs.created_at"
+            )]
+        jobs = [job for job in map(self.get_job, job_ids) if job is not None]
+        for job in jobs:
+            job["owner_alive"] = job["owner"] in live_workers
+        return jobs
+
+    def pending_indexes(self, job_id: str) -> list[int]:
+        with self._lock:
+            return [row[0] for row in self._connection().execute(
+                "SELECT item_index FROM items WHERE job_id = ? AND status = 'pending' ORDER BY item_index", (job_id,)
+            )]
+
+    def delete_job(self, job_id: str) -> bool:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM items WHERE job_id = ?", (job_id,))
+            deleted = conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,)).rowcount
+            conn.commit()
+        return deleted > 0
+
+
+class BatchJobManager:
+    """
+    批量导入任务的调度：所有任务的文件进入同一个队列，由固定数量的后台 worker 并发处理，
+    因此一次提交数百篇论文也不会占用数百个请求或无限制地并发。
+    每个文件的处理流程 (提取 → 可选的摘要/思维导图) 由 main 在 start 时注入的 processor 完成；
+    LLM 请求经过 RequestScheduler，排队已满时 worker 等待 Retry-After 后重试该文件，而不是判为失败。
+    多 worker 部署时每个进程各有一个管理器：所有进程都会把 active 任务的 pending 文件放入自己的队列，
+    由 BatchJobStore.claim_item 保证每个文件只被一个进程处理；进度变化通过轮询数据库推送给其他进程的订阅者。
+    """
+
+    def __init__(self, store: BatchJobStore, workers: int = BATCH_JOB_WORKERS):
+        self.store = store
+        self.worker_count = max(1, workers)
+        self._processor: Optional[ItemProcessor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: list[asyncio.Task] = []
+        self._api_keys: dict[str, str] = {}  # 用户 API Key 只保存在内存中，不写入磁盘
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._queued: set[tuple[str, int]] = set()  # 已在本进程队列中或正在处理的文件，避免重复入队
+        self._maintenance: Optional[asyncio.Task] = None
+        self._watched: dict[str, dict] = {}  # job_id -> 已推送给订阅者的进度 (多 worker 时轮询用)
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    async def start(self, processor: ItemProcessor) -> None:
+        """启动 worker 并继续上次未完成的任务；使用用户 API Key 的任务需要调用方重新提供 Key，标记为 paused"""
+        self._processor = processor
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        await asyncio.to_thread(self.store.heartbeat, self.worker_id)
+        # 单进程部署时不存在其他存活的进程，上次运行留下的 running 文件可以立即接手
+        await self._recover(timeout=BATCH_WORKER_TIMEOUT_SECONDS if SHARED_STATE_ENABLED else 0, verbose=True)
+        self._maintenance = asyncio.create_task(self._maintain())
+
+    async def stop(self) -> None:
+        tasks = [*self._workers, *([self._maintenance] if self._maintenance else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._maintenance = None
+        await asyncio.to_thread(self.store.unregister_worker, self.worker_id)
+
+    async def _recover(self, timeout: float = BATCH_WORKER_TIMEOUT_SECONDS, verbose: bool = False) -> None:
+        """接手已退出进程留下的文件，并把其他进程提交的任务的 pending 文件也放入本进程队列"""
+        for job in await asyncio.to_thread(self.store.recover_interrupted, self.worker_id, timeout):
+            if job["uses_user_key"] and job["job_id"] not in self._api_keys:
+                if job["owner_alive"]:
+                    continue  # API Key 只在提交任务的进程内存中，由该进程处理
+                await asyncio.to_thread(self.store.set_job_state, job["job_id"], "paused")
+                await self._publish(job["job_id"])
+                print(f"Batch job {job['job_id']} paused: resubmit the API key via /resume to continue")
+                continue
+            if verbose:
+                print(f"Resuming batch job {job['job_id']} ({job['counts']['pending']} pending files)")
+            await self._enqueue_pending(job["job_id"])
+
+    async def _maintain(self) -> None:
+        """定期登记心跳并接手无主文件；多 worker 时还要把其他进程的处理进度推送给本进程的订阅者"""
+        interval = min(BATCH_HEARTBEAT_SECONDS, BATCH_EVENTS_POLL_SECONDS) if SHARED_STATE_ENABLED else BATCH_HEARTBEAT_SECONDS
+        last_heartbeat = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if time.monotonic() - last_heartbeat >= BATCH_HEARTBEAT_SECONDS:
+                    last_heartbeat = time.monotonic()
+                    await asyncio.to_thread(self.store.heartbeat, self.worker_id)
+                    await self._recover()
+                if SHARED_STATE_ENABLED:
+                    await self._poll_subscribed_jobs()
+            except Exception as e:
+                print(f"Batch job maintenance error: {e}")
+
+    async def _poll_subscribed_jobs(self) -> None:
+        for job_id in list(self._subscribers):
+            watched = self._watched.setdefault(job_id, {"since": time.time(), "items": {}, "status": None})
+            polled_at = time.time()
+            # 与上次轮询重叠 1 秒，避免漏掉轮询期间提交的更新；重复的更新按 updated_at 去重
+            items = await asyncio.to_thread(self.store.items_updated_since, job_id, watched["since"] - 1.0,
+                                            self.worker_id)
+            watched["since"] = polled_at
+            items = [item for item in items if item["updated_at"] > watched["items"].get(item["item_index"], 0)]
+            for item in items:
+                watched["items"][item["item_index"]] = item["updated_at"]
+            job = await asyncio.to_thread(self.store.get_job, job_id)
+            if job is None:
+                continue
+            for item in items:
+                for queue in self._subscribers.get(job_id, ()):
+                    queue.put_nowait({"job": job, "item": item})
+            if not items and job["status"] != watched["status"]:
+                for queue in self._subscribers.get(job_id, ()):
+                    queue.put_nowait({"job": job, "item": None})  # 例如任务在其他进程被取消
+            watched["status"] = job["status"]
+
+    async def submit(self, items: list[tuple[str, str, bool]], options: dict, api_key: Optional[str] = None,
+                     source: Optional[str] = None, job_id: Optional[str] = None) -> dict:
+        job_id = job_id or new_job_id()
+        await asyncio.to_thread(self.store.create_job, job_id, items, options, source, bool(api_key),
+                                self.worker_id if api_key else None)
+        if api_key:
+            self._api_keys[job_id] = api_key
+        await self._enqueue_pending(job_id)
+        return await asyncio.to_thread(self.store.get_job, job_id)
+
+    async def resume(self, job_id: str, api_key: Optional[str] = None, retry_failed: bool = True) -> Optional[dict]:
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None:
+            return None
+        if api_key:
+            self._api_keys[job_id] = api_key
+            await asyncio.to_thread(self.store.set_job_owner, job_id, self.worker_id)
+        statuses = ("failed", "cancelled") if retry_failed else ("cancelled",)
+        await asyncio.to_thread(self.store.requeue_items, job_id, statuses)
+        await asyncio.to_thread(self.store.set_job_state, job_id, "active")
+        await self._enqueue_pending(job_id)
+        return await self._publish(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        """取消尚未开始的文件；正在处理的文件会处理完当前文件"""
+        if await asyncio.to_thread(self.store.get_job, job_id) is None:
+            return None
+        await asyncio.to_thread(self.store.set_job_state, job_id, "cancelled")
+        return await self._publish(job_id)
+
+    async def delete(self, job_id: str) -> bool:
+        await self.cancel(job_id)
+        self._api_keys.pop(job_id, None)
+        deleted = await asyncio.to_thread(self.store.delete_job, job_id)
+        await asyncio.to_thread(shutil.rmtree, job_upload_dir(job_id), True)
+        return deleted
+
+    async def get(self, job_id: str, include_items: bool = False) -> Optional[dict]:
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is not None and include_items:
+            job["items"] = await asyncio.to_thread(self.store.list_items, job_id)
+        return job
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+                self._watched.pop(job_id, None)
+
+    async def _enqueue_pending(self, job_id: str) -> None:
+        if self._queue is None:
+            raise RuntimeError("BatchJobManager.start() has not been called")
+        for index in await asyncio.to_thread(self.store.pending_indexes, job_id):
+            if (job_id, index) not in self._queued:
+                self._queued.add((job_id, index))
+                self._queue.put_nowait((job_id, index))
+
+    async def _publish(self, job_id: str, item: Optional[dict] = None) -> Optional[dict]:
+        """把任务的最新进度推送给所有 SSE 订阅者"""
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait({"job": job, "item": item})
+        return job
+
+    async def _update_item(self, job_id: str, index: int, **fields) -> None:
+        await asyncio.to_thread(self.store.update_item, job_id, index, **fields)
+        await self._publish(job_id, await asyncio.to_thread(self.store.get_item, job_id, index))
+
+    async def _worker(self) -> None:
+        while True:
+            job_id, index = await self._queue.get()
+            try:
+                await self._process(job_id, index)
+            except Exception as e:
+                print(f"Batch job {job_id} item {index} crashed: {e}")
+            finally:
+                self._queued.discard((job_id, index))
+                self._queue.task_done()
+
+    async def _process(self, job_id: str, index: int) -> None:
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        item = await asyncio.to_thread(self.store.get_item, job_id, index)
+        if job is None or job["state"] != "active" or item is None or item["status"] != "pending":
+            return  # 任务已取消/暂停/删除，或该文件已被其他 worker 处理
+        if not await asyncio.to_thread(self.store.claim_item, job_id, index, self.worker_id):
+            return  # 其他进程抢先认领了该文件
+
+        async def on_stage(stage: str) -> None:
+            await self._update_item(job_id, index, stage=stage)
+
+        await self._publish(job_id, await asyncio.to_thread(self.store.get_item, job_id, index))
+        while True:
+            try:
+                result = await self._processor(item, job["options"], self._api_keys.get(job_id), on_stage)
+            except SchedulerOverloaded as e:
+                await asyncio.sleep(e.retry_after)
+                job = await asyncio.to_thread(self.store.get_job, job_id)
+                if job is not None and job["state"] == "active":
+                    continue
+                await self._update_item(job_id, index, status="cancelled", stage=None)
+                return
+            except Exception as e:
+                print(f"Batch job {job_id}: failed to process {item['filename']}: {e}")
+                await self._update_item(job_id, index, status="failed", stage=None, error=str(e) or e.__class__.__name__)
+                return
+            break
+
+        await self._update_item(job_id, index, status="done", stage=None, error=None, **result)
+        if item["owned"]:
+            try:
+                os.remove(item["path"])
+            except OSError:
+                pass
+
+
+# 进程级共享的批量任务管理器
+batch_job_manager = BatchJobManager(BatchJobStore())
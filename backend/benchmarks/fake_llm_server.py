@@ -0,0 +1,153 @@
+"""
+本地的 OpenAI 兼容模拟服务，用于在不调用真实 DeepSeek API 的情况下测量后端的吞吐与延迟。
+
+用法 (在 backend 目录下)：
+    python -m benchmarks.fake_llm_server --port 9100 --ttft 0.3 --tokens-per-sec 80
+然后以 DEEPSEEK_API_BASE_URL=http://127.0.0.1:9100 启动后端。
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FILLER_WORDS = (
+    "the model attention layer results show that performance improves with scale while "
+    "the method remains simple robust and efficient across datasets"
+).split()
+
+
+@dataclass
+class FakeLLMConfig:
+    latency: float = float(os.getenv("FAKE_LLM_LATENCY", "0.05"))  # 收到请求到开始处理的固定延迟 (秒)
+    ttft: float = float(os.getenv("FAKE_LLM_TTFT", "0.3"))  # 首个 token 的延迟 (秒)
+    tokens_per_sec: float = float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "80"))
+    output_tokens: int = int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", "120"))
+    reasoning_tokens: int = int(os.getenv("FAKE_LLM_REASONING_TOKENS", "0"))  # deepseek-reasoner 的推理 token 数
+    error_rate: float = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))  # 以该概率返回 429，用于测试退避重试
+
+
+def estimate_prompt_tokens(messages: list[dict]) -> int:
+    return sum(len(str(message.get("content", ""))) for message in messages) // 4 + 1
+
+
+class PrefixCacheSimulator:
+    """模拟上下文缓存：system 消息出现过则计为命中，使用量与真实 API 的 usage 字段一致"""
+
+    def __init__(self):
+        self._seen: set[str] = set()
+
+    def usage(self, messages: list[dict], completion_tokens: int) -> dict:
+        prompt_tokens = estimate_prompt_tokens(messages)
+        prefix = messages[0].get("content", "") if messages and messages[0].get("role") == "system" else ""
+        digest = hashlib.sha256(str(prefix).encode("utf-8")).hexdigest()
+        hit = min(prompt_tokens, len(str(prefix)) // 4) if prefix and digest in self._seen else 0
+        self._seen.add(digest)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": prompt_tokens - hit,
+        }
+
+
+def create_app(config: FakeLLMConfig) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI-compatible LLM")
+    prefix_cache = PrefixCacheSimulator()
+    app.state.requests = 0
+
+    def make_words(count: int) -> list[str]:
+        return [random.choice(FILLER_WORDS) + " " for _ in range(count)]
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        model = body.get("model", "deepseek-chat")
+        messages = body.get("messages", [])
+        await asyncio.sleep(config.latency)
+        if config.error_rate and random.random() < config.error_rate:
+            return JSONResponse({"error": {"message": "rate limited (simulated)"}}, status_code=429,
+                                headers={"Retry-After": "1"})
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        words = make_words(config.output_tokens)
+        reasoning = make_words(config.reasoning_tokens) if model == "deepseek-reasoner" else []
+        usage = prefix_cache.usage(messages, len(words) + len(reasoning))
+        token_interval = 1 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0
+
+        if not body.get("stream"):
+            await asyncio.sleep(config.ttft + (len(words) + len(reasoning)) * token_interval)
+            message = {"role": "assistant", "content": "".join(words).strip()}
+            if reasoning:
+                message["reasoning_content"] = "".join(reasoning).strip()
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def chunk(delta: dict, finish_reason=None, choices=True, chunk_usage=None) -> str:
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                       "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if choices else []}
+            if chunk_usage is not None:
+                payload["usage"] = chunk_usage
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events():
+            await asyncio.sleep(config.ttft)
+            yield chunk({"role": "assistant", "content": ""})
+            for word in reasoning:
+                yield chunk({"reasoning_content": word})
+                await asyncio.sleep(token_interval)
+            for i, word in enumerate(words):
+                yield chunk({"content": word}, "stop" if i == len(words) - 1 else None)
+                await asyncio.sleep(token_interval)
+            if include_usage:
+                yield chunk({}, choices=False, chunk_usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    app.add_api_route("/chat/completions", chat_completions, methods=["POST"])
+    app.add_api_route("/v1/chat/completions", chat_completions, methods=["POST"])
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    defaults = FakeLLMConfig()
+    parser.add_argument("--latency", type=float, default=defaults.latency)
+    parser.add_argument("--ttft", type=float, default=defaults.ttft)
+    parser.add_argument("--tokens-per-sec", type=float, default=defaults.tokens_per_sec)
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens)
+    parser.add_argument("--reasoning-tokens", type=int, default=defaults.reasoning_tokens)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    args = parser.parse_args()
+
+    import uvicorn
+    config = FakeLLMConfig(latency=args.latency, ttft=args.ttft, tokens_per_sec=args.tokens_per_sec,
+                           output_tokens=args.output_tokens, reasoning_tokens=args.reasoning_tokens,
+                           error_rate=args.error_rate)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+"""
+后端负载基准测试：启动本地模拟 LLM 服务与后端进程，对各个接口施加并发负载，
+报告 p50/p95/p99 延迟、每秒请求数、PDF 提取页数/秒以及后端进程的峰值内存 (RSS)。
+
+用法 (在 backend 目录下)：
+    python -m benchmarks.run_benchmarks --requests 40 --concurrency 8 --output bench.json
+    python -m benchmarks.run_benchmarks --baseline bench.json --max-regression 0.25   # CI 中检测性能回退
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+from benchmarks.synthetic_pdf import make_synthetic_pdf
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY_HEADERS = {"X-User-API-Key": "benchmark-key"}
+
+# 基准测试关心的是后端自身的开销，默认放宽调度器的限流，避免测到的是限流参数
+DEFAULT_BACKEND_ENV = {
+    "LLM_RATE_PER_SECOND": "10000",
+    "LLM_RATE_BURST": "10000",
+    "LLM_MAX_CONCURRENT_PER_KEY": "10000",
+    "LLM_QUEUE_LIMIT_CHAT": "10000",
+    "LLM_QUEUE_LIMIT_SUMMARY": "10000",
+    "LLM_QUEUE_LIMIT_MINDMAP": "10000",
+}
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    requests: int
+    errors: int
+    duration_s: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    rps: float
+    ttft_p50_ms: Optional[float] = None  # 流式接口：收到第一个 delta 的延迟
+    pages_per_sec: Optional[float] = None  # PDF 提取：页数 / 总耗时
+    peak_rss_mb: Optional[float] = None
+    extra: dict = field(default_factory=dict)
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class RssMonitor:
+    """在后台线程中定期采样进程 (及其子进程，如 PDF 提取进程池) 的 RSS，记录峰值"""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        try:
+            import psutil
+            self._process = psutil.Process(pid)
+        except Exception:  # psutil 是可选依赖，未安装时在 Linux 上读取 /proc
+            self._process = None
+
+    def _linux_rss(self, pid: int) -> int:
+        total = 0
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            with open(f"/proc/{pid}/task/{pid}/children") as f:
+                for child in f.read().split():
+                    total += self._linux_rss(int(child))
+        except OSError:
+            pass
+        return total
+
+    def sample(self) -> int:
+        if self._process is not None:
+            try:
+                processes = [self._process] + self._process.children(recursive=True)
+                return sum(process.memory_info().rss for process in processes)
+            except Exception:
+                return 0
+        if platform.system() == "Linux":
+            return self._linux_rss(self.pid)
+        return 0
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self.sample())
+            self._stop.wait(self.interval)
+
+    def reset(self) -> None:
+        self.peak_bytes = self.sample()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def start_process(args: list[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen(args, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30) -> float:
+    """轮询直到服务可以响应，返回启动耗时"""
+    started = time.perf_counter()
+    async with httpx.AsyncClient() as client:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Process exited early: {process.stderr.read().decode(errors='replace')}")
+            try:
+                await client.get(url, timeout=1)
+                return time.perf_counter() - started
+            except httpx.HTTPError:
+                await asyncio.sleep(0.05)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+async def read_sse(response: httpx.Response, on_first_delta: Callable[[], None]) -> dict:
+    """读取 SSE 响应直到 done 事件，返回 done 的数据；遇到 error 事件时抛出异常"""
+    event = None
+    first = True
+    async for line in response.aiter_lines():
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:") and event:
+            if event == "delta" and first:
+                first = False
+                on_first_delta()
+            elif event == "error":
+                raise RuntimeError(line[5:].strip())
+            elif event == "done":
+                return json.loads(line[5:])
+    raise RuntimeError("Stream ended without a done event")
+
+
+class BenchmarkRunner:
+    def __init__(self, base_url: str, monitor: RssMonitor, requests: int, concurrency: int, pages: int):
+        self.base_url = base_url
+        self.monitor = monitor
+        self.requests = requests
+        self.concurrency = concurrency
+        self.pages = pages
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=600)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    async def run_scenario(self, name: str, request: Callable[[int], Awaitable[Optional[float]]],
+                           count: Optional[int] = None, pages_per_request: Optional[int] = None) -> ScenarioResult:
+        """并发执行 count 个请求 (最多 concurrency 个同时进行)；request 返回流式请求的首 token 延迟或 None"""
+        count = count or self.requests
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies: list[float] = []
+        first_token: list[float] = []
+        errors: list[str] = []
+
+        async def one(index: int) -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    ttft = await request(index)
+                except Exception as e:
+                    errors.append(f"{e.__class__.__name__}: {e}")
+                    return
+                latencies.append(time.perf_counter() - started)
+                if ttft is not None:
+                    first_token.append(ttft - started)
+
+        self.monitor.reset()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(count)))
+        duration = time.perf_counter() - started
+        result = ScenarioResult(
+            name=name,
+            requests=count,
+            errors=len(errors),
+            duration_s=round(duration, 3),
+            p50_ms=round(percentile(latencies, 0.50) * 1000, 1),
+            p95_ms=round(percentile(latencies, 0.95) * 1000, 1),
+            p99_ms=round(percentile(latencies, 0.99) * 1000, 1),
+            rps=round(len(latencies) / duration, 2) if duration else 0.0,
+            ttft_p50_ms=round(percentile(first_token, 0.50) * 1000, 1) if first_token else None,
+            pages_per_sec=round(len(latencies) * pages_per_request / duration, 1)
+            if pages_per_request and duration else None,
+            peak_rss_mb=round(self.monitor.peak_bytes / 2 ** 20, 1) or None,
+        )
+        if errors:
+            result.extra["first_error"] = errors[0]
+        return result
+
+    async def upload(self, pdf: bytes, filename: str = "bench.pdf") -> dict:
+        response = await self.client.post(
+            "/api/pdf/extract-text", params={"include_text": "false"},
+            files={"file": (filename, pdf, "application/pdf")},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def post_json(self, path: str, body: dict) -> dict:
+        response = await self.client.post(path, json=body, headers=API_KEY_HEADERS)
+        response.raise_for_status()
+        return response.json()
+
+    async def post_stream(self, path: str, body: dict) -> float:
+        first_delta = [None]
+
+        def mark() -> None:
+            first_delta[0] = time.perf_counter()
+
+        async with self.client.stream("POST", path, json=body, headers=API_KEY_HEADERS) as response:
+            response.raise_for_status()
+            await read_sse(response, mark)
+        return first_delta[0] or time.perf_counter()
+
+    # --- 各场景 ---
+    async def scenarios(self, selected: set[str]) -> list[ScenarioResult]:
+        results = []
+        pages = self.pages
+        # 预先准备互不相同的文档，避免相同请求被合并或命中响应缓存
+        pdfs = [make_synthetic_pdf(pages, seed=1000 + i) for i in range(self.requests)]
+        small_doc_ids: list[str] = []
+
+        async def need_small_docs() -> list[str]:
+            if not small_doc_ids:
+                for i in range(self.requests):
+                    small_doc_ids.append((await self.upload(make_synthetic_pdf(5, seed=5000 + i)))["doc_id"])
+            return small_doc_ids
+
+        if "extract_cold" in selected:
+            results.append(await self.run_scenario(
+                "extract_cold", lambda i: self._none(self.upload(pdfs[i])), pages_per_request=pages))
+        if "extract_warm" in selected:
+            warm = pdfs[0]
+            await self.upload(warm)
+            results.append(await self.run_scenario(
+                "extract_warm", lambda i: self._none(self.upload(warm)), pages_per_request=pages))
+        if "extract_stream" in selected:
+            stream_pdfs = [make_synthetic_pdf(pages, seed=9000 + i) for i in range(self.requests)]
+
+            async def extract_stream(i: int) -> None:
+                async with self.client.stream("POST", "/api/pdf/extract-text/stream",
+                                              files={"file": ("bench.pdf", stream_pdfs[i], "application/pdf")}) as r:
+                    r.raise_for_status()
+                    async for _ in r.aiter_bytes():
+                        pass
+            results.append(await self.run_scenario("extract_stream", extract_stream, pages_per_request=pages))
+
+        if selected & {"summarize", "summarize_stream", "mindmap", "chat", "chat_stream", "chat_session",
+                       "summarize_coalesced"}:
+            doc_ids = await need_small_docs()
+            if "summarize" in selected:
+                results.append(await self.run_scenario("summarize", lambda i: self._none(self.post_json(
+                    "/api/llm/summarize", {"doc_id": doc_ids[i], "bypass_cache": True}))))
+            if "summarize_stream" in selected:
+                results.append(await self.run_scenario("summarize_stream", lambda i: self.post_stream(
+                    "/api/llm/summarize/stream", {"doc_id": doc_ids[i], "bypass_cache": True})))
+            if "summarize_coalesced" in selected:
+                # 所有请求完全相同：并发时应只产生一次上游调用
+                results.append(await self.run_scenario("summarize_coalesced", lambda i: self._none(self.post_json(
+                    "/api/llm/summarize", {"doc_id": doc_ids[0], "bypass_cache": True}))))
+            if "chat" in selected:
+                results.append(await self.run_scenario("chat", lambda i: self._none(self.post_json(
+                    "/api/llm/chat_with_context", {"doc_id": doc_ids[0], "user_query": f"What is result {i}?"}))))
+            if "chat_stream" in selected:
+                results.append(await self.run_scenario("chat_stream", lambda i: self.post_stream(
+                    "/api/llm/chat_with_context/stream",
+                    {"doc_id": doc_ids[0], "user_query": f"Explain finding {i}."})))
+            if "chat_session" in selected:
+                session_id = (await self.post_json("/api/chat/sessions", {"doc_id": doc_ids[0]}))["session_id"]
+                results.append(await self.run_scenario("chat_session", lambda i: self.post_stream(
+                    f"/api/chat/sessions/{session_id}/messages/stream", {"user_query": f"Follow-up question {i}"})))
+            if "mindmap" in selected:
+                results.append(await self.run_scenario("mindmap", lambda i: self._none(self.post_json(
+                    "/api/pdf/generate_mindmap", {"doc_id": doc_ids[i], "bypass_cache": True}))))
+        return results
+
+    @staticmethod
+    async def _none(awaitable) -> None:
+        await awaitable
+        return None
+
+
+ALL_SCENARIOS = [
+    "extract_cold", "extract_warm", "extract_stream", "summarize", "summarize_stream", "summarize_coalesced",
+    "chat", "chat_stream", "chat_session", "mindmap",
+]
+
+
+def compare_with_baseline(results: list[ScenarioResult], baseline_path: str, max_regression: float) -> list[str]:
+    """p95 延迟变慢或吞吐下降超过 max_regression (比例) 的场景视为回退"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {item["name"]: item for item in json.load(f)["scenarios"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.name)
+        if not previous:
+            continue
+        if previous["p95_ms"] and result.p95_ms > previous["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{result.name}: p95 {previous['p95_ms']}ms -> {result.p95_ms}ms")
+        if previous["rps"] and result.rps < previous["rps"] * (1 - max_regression):
+            regressions.append(f"{result.name}: rps {previous['rps']} -> {result.rps}")
+    return regressions
+
+
+def print_table(results: list[ScenarioResult]) -> None:
+    header = f"{'scenario':<20}{'req':>6}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>9}" \
+             f"{'ttft ms':>9}{'pages/s':>10}{'rss MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r.name:<20}{r.requests:>6}{r.errors:>5}{r.p50_ms:>10}{r.p95_ms:>10}{r.p99_ms:>10}{r.rps:>9}"
+              f"{r.ttft_p50_ms if r.ttft_p50_ms is not None else '-':>9}"
+              f"{r.pages_per_sec if r.pages_per_sec is not None else '-':>10}"
+              f"{r.peak_rss_mb if r.peak_rss_mb is not None else '-':>9}")
+        if r.extra.get("first_error"):
+            print(f"    first error: {r.extra['first_error']}")
+
+
+async def run(args) -> int:
+    fake_port, backend_port = free_port(), free_port()
+    data_dir = tempfile.mkdtemp(prefix="deepread_bench_")
+    env = dict(os.environ)
+    env.update(DEFAULT_BACKEND_ENV)
+    env.update({
+        "DEEPSEEK_API_BASE_URL": f"http://127.0.0.1:{fake_port}",
+        "DEEPSEEK_API_KEY": "benchmark-key",
+        "DEEPREAD_DATA_DIR": data_dir,
+        "PYTHONUNBUFFERED": "1",
+    })
+    for item in args.backend_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    fake = start_process([
+        sys.executable, "-m", "benchmarks.fake_llm_server", "--port", str(fake_port),
+        "--latency", str(args.latency), "--ttft", str(args.ttft), "--tokens-per-sec", str(args.tokens_per_sec),
+        "--output-tokens", str(args.output_tokens), "--error-rate", str(args.error_rate),
+    ], env)
+    backend = start_process([
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(backend_port),
+        "--log-level", "warning",
+    ], env)
+    monitor = RssMonitor(backend.pid)
+    try:
+        await wait_until_ready(f"http://127.0.0.1:{fake_port}/stats", fake)
+        startup_s = await wait_until_ready(f"http://127.0.0.1:{backend_port}/", backend)
+        monitor.start()
+        runner = BenchmarkRunner(f"http://127.0.0.1:{backend_port}", monitor, args.requests, args.concurrency,
+                                 args.pages)
+        try:
+            results = await runner.scenarios(set(args.scenarios))
+            stats = {}
+            for path in ("/api/stats/coalescing", "/api/stats/scheduler", "/api/stats/usage"):
+                try:
+                    stats[path] = (await runner.client.get(path)).json()
+                except Exception:
+                    pass
+        finally:
+            await runner.close()
+    finally:
+        monitor.stop()
+        for process in (backend, fake):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    print_table(results)
+    print(f"\nbackend startup: {startup_s * 1000:.0f} ms, overall peak RSS: {monitor.peak_bytes / 2 ** 20:.1f} MB")
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend_startup_ms": round(startup_s * 1000, 1),
+        "overall_peak_rss_mb": round(monitor.peak_bytes / 2 ** 20, 1),
+        "scenarios": [asdict(result) for result in results],
+        "backend_stats": stats,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.output}")
+
+    exit_code = 1 if any(result.errors for result in results) and args.fail_on_errors else 0
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            exit_code = 1
+    return exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepRead AI backend benchmarks")
+    parser.add_argument("--scenarios", nargs="+", default=ALL_SCENARIOS, choices=ALL_SCENARIOS)
+    parser.add_argument("--requests", type=int, default=32, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=60, help="提取场景中每个 PDF 的页数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟 LLM 的固定延迟 (秒)")
+    parser.add_argument("--ttft", type=float, default=0.3, help="模拟 LLM 的首 token 延迟 (秒)")
+    parser.add_argument("--tokens-per-sec", type=float, default=200)
+    parser.add_argument("--output-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟 LLM 返回 429 的概率")
+    parser.add_argument("--backend-env", nargs="*", default=[], metavar="KEY=VALUE", help="额外的后端环境变量")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="与之前的 JSON 结果比较，出现回退时以非零状态退出")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    parser.add_argument("--fail-on-errors", action="store_true", help="任一请求失败时以非零状态退出")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
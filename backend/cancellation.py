@@ -0,0 +1,232 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import metrics
+
+# --- 请求取消与截止时间配置 (均可通过环境变量覆盖) ---
+# 客户端断开后取消处理 (及其上游 LLM 调用) 的接口前缀
+CANCELLABLE_PATH_PREFIXES = tuple(
+    prefix.strip() for prefix in
+    os.getenv("CANCELLABLE_PATH_PREFIXES", "/api/llm/,/api/chat/,/api/pdf/generate_mindmap").split(",")
+    if prefix.strip()
+)
+REQUEST_TIMEOUT_HEADER = "x-request-timeout"  # 客户端可接受的最长处理时间 (秒)
+REQUEST_TIMEOUT_MAX_SECONDS = float(os.getenv("REQUEST_TIMEOUT_MAX_SECONDS", "1800"))  # 超过该值的截止时间按该值处理
+
+T = TypeVar("T")
+
+# 当前请求的截止时刻 (time.monotonic())，由 CancellationMiddleware 设置；上游调用据此缩短超时
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """请求已超过客户端给出的截止时间，不再发起 (或继续等待) 上游调用"""
+
+
+def remaining_time() -> Optional[float]:
+    """当前请求距截止时间的剩余秒数；没有截止时间时返回 None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline() -> Optional[float]:
+    """返回剩余秒数，已超时则抛出 DeadlineExceeded"""
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return remaining
+
+
+async def without_deadline(call: Callable[[], Awaitable[T]]) -> T:
+    """
+    在不受当前请求截止时间约束的上下文中执行 call：用于被多个请求共享的上游调用与后台任务。
+    必须作为新任务的入口协程 (任务持有上下文的副本，这里的修改不会影响创建它的请求)。
+    """
+    _deadline.set(None)
+    return await call()
+
+
+async def wait_with_deadline(awaitable: Awaitable[T]) -> T:
+    """按当前请求自己的截止时间等待 awaitable (如合并的上游调用)，超时时取消等待并抛出 DeadlineExceeded"""
+    remaining = check_deadline()
+    if remaining is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+async def gather_or_cancel(*awaitables: Awaitable[T]) -> list[T]:
+    """
+    与 asyncio.gather 相同，按顺序返回结果；但任何一个失败 (或调用方被取消) 时立即取消其余仍在运行的任务再抛出原异常，
+    不让注定被丢弃的结果继续占用调度名额与上游 token。异常不包装为 ExceptionGroup，调用方的错误映射保持不变。
+    """
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)  # 等待取消完成，确保并发槽已经归还
+        raise
+
+
+def parse_timeout_header(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        return None
+    if seconds <= 0:
+        return None
+    return min(seconds, REQUEST_TIMEOUT_MAX_SECONDS)
+
+
+class AbortStats:
+    """被中止的请求数：cancelled 为客户端断开，timed_out 为超过截止时间"""
+
+    def __init__(self):
+        self.cancelled = 0
+        self.timed_out = 0
+        self.by_endpoint: dict[str, dict[str, int]] = {}
+
+    def record(self, endpoint: str, reason: str) -> None:
+        if reason == "client_disconnect":
+            self.cancelled += 1
+        else:
+            self.timed_out += 1
+        counts = self.by_endpoint.setdefault(endpoint, {"client_disconnect": 0, "deadline": 0})
+        counts[reason] += 1
+        metrics.REQUESTS_ABORTED.inc(endpoint=endpoint, reason=reason)
+
+    def snapshot(self) -> dict:
+        return {"cancelled": self.cancelled, "timed_out": self.timed_out, "by_endpoint": self.by_endpoint}
+
+
+# 进程级共享的中止统计
+abort_stats = AbortStats()
+
+
+class CancellationMiddleware:
+    """
+    纯 ASGI 中间件，作用于 LLM 相关接口：
+    - 请求体读完后继续监听连接，客户端断开 (关闭面板、重新提问) 时取消处理协程，
+      进而取消排队中的调度名额与上游请求 (合并的请求在所有等待者都放弃后才取消)；
+    - 请求头 X-Request-Timeout (秒) 给出截止时间：上游调用的超时不超过剩余时间，
+      到期仍未完成则取消处理并返回 504 (已开始的 SSE 流以 error 事件结束)。
+    """
+
+    def __init__(self, app, prefixes: tuple[str, ...] = CANCELLABLE_PATH_PREFIXES):
+        self.app = app
+        self.prefixes = prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        timeout = None
+        for key, value in scope["headers"]:
+            if key.lower() == REQUEST_TIMEOUT_HEADER.encode("latin-1"):
+                timeout = parse_timeout_header(value.decode("latin-1"))
+        body_received = asyncio.Event()
+        disconnected = asyncio.Event()
+        response = {"started": False, "complete": False, "status": None, "event_stream": False}
+
+        async def receive_wrapper():
+            if body_received.is_set():
+                # 请求体之后的消息 (http.disconnect) 由 watch_disconnect 读取后转发
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_received.set()
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["started"] = True
+                response["status"] = message["status"]
+                response["event_stream"] = any(
+                    key.lower() == b"content-type" and value.startswith(b"text/event-stream")
+                    for key, value in message.get("headers", [])
+                )
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response["complete"] = True
+            await send(message)
+
+        async def watch_disconnect():
+            await body_received.wait()
+            try:
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+            finally:
+                disconnected.set()
+
+        token = _deadline.set(time.monotonic() + timeout if timeout is not None else None)
+        try:
+            app_task = asyncio.ensure_future(self.app(scope, receive_wrapper, send_wrapper))  # 任务复制当前上下文
+        finally:
+            _deadline.reset(token)
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            done, _ = await asyncio.wait({app_task, watcher}, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if app_task not in done and response["complete"]:
+                await asyncio.wait({app_task})  # 响应已发送完毕 (断开只是连接的正常收尾)，等待处理结束
+                done = {app_task}
+            if app_task in done:
+                app_task.result()
+                if response["status"] == 504 and timeout is not None:
+                    self._record(scope, "deadline")
+                return
+
+            reason = "client_disconnect" if disconnected.is_set() else "deadline"
+            await self._cancel(app_task)
+            self._record(scope, reason)
+            if reason == "deadline":
+                await self._send_timeout(send, response)
+        except asyncio.CancelledError:
+            await self._cancel(app_task)
+            raise
+        finally:
+            watcher.cancel()
+
+    @staticmethod
+    async def _cancel(task: asyncio.Task) -> None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:  # 取消过程中的清理错误不影响响应
+            print(f"Error while cancelling request: {e}")
+
+    @staticmethod
+    def _record(scope, reason: str) -> None:
+        scope[metrics.ABORTED_SCOPE_KEY] = reason
+        route = scope.get("route")
+        abort_stats.record(getattr(route, "path", None) or scope["path"], reason)
+
+    @staticmethod
+    async def _send_timeout(send, response: dict) -> None:
+        detail = {"detail": "请求超过截止时间 (X-Request-Timeout)"}
+        if not response["started"]:
+            body = json.dumps(detail, ensure_ascii=False).encode("utf-8")
+            await send({"type": "http.response.start", "status": 504,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode("latin-1"))]})
+            await send({"type": "http.response.body", "body": body})
+        elif not response["complete"]:
+            body = b""
+            if response["event_stream"]:
+                body = f"event: error\ndata: {json.dumps(detail, ensure_ascii=False)}\n\n".encode("utf-8")
+            await send({"type": "http.response.body", "body": body})
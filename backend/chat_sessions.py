@@ -0,0 +1,355 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+from cancellation import without_deadline
+from retrieval import estimate_tokens
+from scheduler import Priority
+from shared_state import SHARED_STATE_DB_PATH, SHARED_STATE_ENABLED, connect_sqlite
+
+# --- 多轮对话会话配置 (均可通过环境变量覆盖) ---
+CHAT_SESSION_HISTORY_TOKENS = int(os.getenv("CHAT_SESSION_HISTORY_TOKENS", "3000"))  # 历史 (摘要 + 原文轮次) 的 token 上限
+CHAT_SESSION_KEEP_RECENT_TURNS = int(os.getenv("CHAT_SESSION_KEEP_RECENT_TURNS", "2"))  # 压缩时保留原文的最近轮数
+CHAT_SESSION_TTL_SECONDS = int(os.getenv("CHAT_SESSION_TTL_SECONDS", str(6 * 3600)))  # 闲置超过该时间的会话被清理
+CHAT_SESSION_MAX_SESSIONS = int(os.getenv("CHAT_SESSION_MAX_SESSIONS", "256"))
+CHAT_SESSION_COMPACT_MODEL = os.getenv("CHAT_SESSION_COMPACT_MODEL", "deepseek-chat")
+CHAT_SESSION_COMPACT_LEASE_SECONDS = int(os.getenv("CHAT_SESSION_COMPACT_LEASE_SECONDS", "300"))  # 共享模式下压缩占用会话的最长时间
+
+COMPACT_SYSTEM_PROMPT = (
+    "你负责压缩一段关于某篇文档的问答对话历史。请把“已有摘要”和“新增对话”合并为一份新的对话摘要："
+    "保留用户关心的问题、已经给出的关键结论、数字、术语定义以及用户表达的偏好，删除寒暄与重复内容。"
+    "使用简洁的要点列表，不超过 300 字，直接输出摘要。"
+)
+
+
+@dataclass
+class ChatTurn:
+    user: str
+    assistant: str
+
+    @property
+    def token_estimate(self) -> int:
+        return estimate_tokens(self.user) + estimate_tokens(self.assistant)
+
+
+@dataclass
+class ChatSession:
+    session_id: str
+    doc_id: str
+    summary: str = ""  # 已压缩的早期对话摘要
+    turns: list[ChatTurn] = field(default_factory=list)  # 尚未压缩的原文轮次
+    turn_count: int = 0  # 会话累计轮数 (含已压缩的)
+    compactions: int = 0
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    compacting: bool = False
+
+    def history_tokens(self) -> int:
+        return estimate_tokens(self.summary) + sum(turn.token_estimate for turn in self.turns)
+
+    def needs_compaction(self, budget: int = CHAT_SESSION_HISTORY_TOKENS) -> bool:
+        return (not self.compacting and len(self.turns) > CHAT_SESSION_KEEP_RECENT_TURNS
+                and self.history_tokens() > budget)
+
+
+class ChatSessionStore:
+    """
+    进程内的会话存储 (LRU + 闲置过期)。会话只保存问答历史，文档本身仍通过 doc_id 从文档存储读取，
+    因此客户端每轮只需发送新的问题。
+    """
+
+    def __init__(self, max_sessions: int = CHAT_SESSION_MAX_SESSIONS, ttl_seconds: int = CHAT_SESSION_TTL_SECONDS):
+        self.max_sessions = max(1, max_sessions)
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, doc_id: str) -> ChatSession:
+        session = ChatSession(session_id=uuid.uuid4().hex, doc_id=doc_id)
+        with self._lock:
+            self._expire_locked(time.time())
+            self._sessions[session.session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        with self._lock:
+            self._expire_locked(time.time())
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def remove(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def remove_document(self, doc_id: str) -> int:
+        """文档被删除时一并删除其会话"""
+        with self._lock:
+            session_ids = [sid for sid, session in self._sessions.items() if session.doc_id == doc_id]
+            for session_id in session_ids:
+                del self._sessions[session_id]
+            return len(session_ids)
+
+    def _expire_locked(self, now: float) -> None:
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.updated_at <= self.ttl_seconds:
+                break
+            del self._sessions[session_id]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    # 修改会话的操作都经过存储，共享存储据此在最新状态上原子地应用修改
+    def add_turn(self, session: ChatSession, user: str, assistant: str) -> None:
+        append_turn(session, user, assistant)
+
+    def claim_compaction(self, session: ChatSession) -> bool:
+        """占用会话进行压缩，同一时刻每个会话只有一个压缩任务"""
+        if session.compacting:
+            return False
+        session.compacting = True
+        return True
+
+    def apply_compaction(self, session: ChatSession, summary: str, compacted_turns: int) -> None:
+        session.summary = summary
+        del session.turns[:compacted_turns]
+        session.compactions += 1
+
+    def release_compaction(self, session: ChatSession) -> None:
+        session.compacting = False
+
+
+class SharedChatSessionStore(ChatSessionStore):
+    """
+    多 worker 部署使用的会话存储：会话保存在共享 SQLite 中，同一会话的相邻两轮可以落在不同 worker 上。
+    追加轮次与压缩都在事务中读取最新状态后修改，压缩期间其他 worker 追加的轮次不会被覆盖；
+    压缩占用以租约 (compacting_until) 表示，worker 中途退出后租约到期即可重新压缩。
+    闲置过期与数量上限按 updated_at 计算。
+    所有方法都是阻塞 IO，异步代码中请用 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, db_path: str = SHARED_STATE_DB_PATH, max_sessions: int = CHAT_SESSION_MAX_SESSIONS,
+                 ttl_seconds: int = CHAT_SESSION_TTL_SECONDS):
+        super().__init__(max_sessions=max_sessions, ttl_seconds=ttl_seconds)
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = connect_sqlite(self.db_path)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_sessions ("
+                " session_id TEXT PRIMARY KEY,"
+                " doc_id TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " compacting_until REAL NOT NULL DEFAULT 0,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated_at ON chat_sessions (updated_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _encode(session: ChatSession) -> str:
+        return json.dumps({
+            "summary": session.summary,
+            "turns": [[turn.user, turn.assistant] for turn in session.turns],
+            "turn_count": session.turn_count,
+            "compactions": session.compactions,
+            "created_at": session.created_at,
+        }, ensure_ascii=False)
+
+    @staticmethod
+    def _decode(session_id: str, doc_id: str, data: str, compacting_until: float, updated_at: float) -> ChatSession:
+        payload = json.loads(data)
+        return ChatSession(
+            session_id=session_id,
+            doc_id=doc_id,
+            summary=payload["summary"],
+            turns=[ChatTurn(user=user, assistant=assistant) for user, assistant in payload["turns"]],
+            turn_count=payload["turn_count"],
+            compactions=payload["compactions"],
+            created_at=payload["created_at"],
+            updated_at=updated_at,
+            compacting=compacting_until > time.time(),
+        )
+
+    def _load_locked(self, conn: sqlite3.Connection, session_id: str) -> Optional[ChatSession]:
+        row = conn.execute(
+            "SELECT doc_id, data, compacting_until, updated_at FROM chat_sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None or time.time() - row[3] > self.ttl_seconds:
+            return None
+        return self._decode(session_id, *row)
+
+    def create(self, doc_id: str) -> ChatSession:
+        session = ChatSession(session_id=uuid.uuid4().hex, doc_id=doc_id)
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+            conn.execute(
+                "INSERT INTO chat_sessions (session_id, doc_id, data, updated_at) VALUES (?, ?, ?, ?)",
+                (session.session_id, doc_id, self._encode(session), session.updated_at),
+            )
+            conn.execute(
+                "DELETE FROM chat_sessions WHERE session_id IN"
+                " (SELECT session_id FROM chat_sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,),
+            )
+            conn.commit()
+        return session
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        with self._lock:
+            return self._load_locked(self._connection(), session_id)
+
+    def remove(self, session_id: str) -> bool:
+        with self._lock:
+            conn = self._connection()
+            deleted = conn.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,)).rowcount
+            conn.commit()
+        return deleted > 0
+
+    def remove_document(self, doc_id: str) -> int:
+        with self._lock:
+            conn = self._connection()
+            deleted = conn.execute("DELETE FROM chat_sessions WHERE doc_id = ?", (doc_id,)).rowcount
+            conn.commit()
+        return deleted
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM chat_sessions WHERE updated_at >= ?", (time.time() - self.ttl_seconds,)
+            ).fetchone()[0]
+
+    def _modify(self, session: ChatSession, change) -> None:
+        """在写事务中读取最新的会话、应用 change 并写回，然后把最新状态同步到调用方持有的对象"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                latest = self._load_locked(conn, session.session_id)
+                if latest is None:  # 会话已被删除或过期，只修改调用方的对象
+                    conn.rollback()
+                    change(session)
+                    return
+                change(latest)
+                conn.execute("UPDATE chat_sessions SET data = ?, updated_at = ? WHERE session_id = ?",
+                             (self._encode(latest), latest.updated_at, session.session_id))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        for item in fields(ChatSession):
+            setattr(session, item.name, getattr(latest, item.name))
+
+    def add_turn(self, session: ChatSession, user: str, assistant: str) -> None:
+        self._modify(session, lambda latest: append_turn(latest, user, assistant))
+
+    def claim_compaction(self, session: ChatSession) -> bool:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            claimed = conn.execute(
+                "UPDATE chat_sessions SET compacting_until = ? WHERE session_id = ? AND compacting_until < ?",
+                (now + CHAT_SESSION_COMPACT_LEASE_SECONDS, session.session_id, now),
+            ).rowcount
+            conn.commit()
+        session.compacting = claimed > 0
+        return claimed > 0
+
+    def apply_compaction(self, session: ChatSession, summary: str, compacted_turns: int) -> None:
+        def change(latest: ChatSession) -> None:
+            updated_at = latest.updated_at  # 压缩不算会话活动，不延长闲置过期时间
+            super(SharedChatSessionStore, self).apply_compaction(latest, summary, compacted_turns)
+            latest.updated_at = updated_at
+
+        self._modify(session, change)
+
+    def release_compaction(self, session: ChatSession) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("UPDATE chat_sessions SET compacting_until = 0 WHERE session_id = ?", (session.session_id,))
+            conn.commit()
+        session.compacting = False
+
+
+def append_turn(session: ChatSession, user: str, assistant: str) -> None:
+    session.turns.append(ChatTurn(user=user, assistant=assistant))
+    session.turn_count += 1
+    session.updated_at = time.time()
+
+
+def history_messages(session: ChatSession) -> list[dict]:
+    """把会话历史展开为消息列表：滚动摘要 (如有) 在前，未压缩的原文轮次在后"""
+    messages = []
+    if session.summary:
+        messages.append({"role": "system", "content": f"此前对话的摘要：\n{session.summary}"})
+    for turn in session.turns:
+        messages.append({"role": "user", "content": turn.user})
+        messages.append({"role": "assistant", "content": turn.assistant})
+    return messages
+
+
+def build_compact_messages(summary: str, turns: list[ChatTurn]) -> list[dict]:
+    dialogue = "\n\n".join(f"用户：{turn.user}\n助手：{turn.assistant}" for turn in turns)
+    return [
+        {"role": "system", "content": COMPACT_SYSTEM_PROMPT},
+        {"role": "user", "content": f"已有摘要：\n{summary or '（无）'}\n\n新增对话：\n{dialogue}"},
+    ]
+
+
+async def compact_session(session: ChatSession, client, model: str = CHAT_SESSION_COMPACT_MODEL,
+                          store: Optional[ChatSessionStore] = None) -> bool:
+    """
+    把最近 CHAT_SESSION_KEEP_RECENT_TURNS 轮之前的原文轮次并入滚动摘要。
+    压缩期间到达的新轮次会追加在列表末尾，完成后只删除参与压缩的那些轮次，不会丢失。
+    """
+    store = store or chat_session_store
+    if not session.needs_compaction() or not await asyncio.to_thread(store.claim_compaction, session):
+        return False
+    try:
+        old_turns = session.turns[:len(session.turns) - CHAT_SESSION_KEEP_RECENT_TURNS]
+        response = await client.get_chat_completion(
+            messages=build_compact_messages(session.summary, old_turns), model=model, priority=Priority.BACKGROUND
+        )
+        if not response.choices or not response.choices[0].message.content:
+            raise RuntimeError("AI returned an empty history summary")
+        await asyncio.to_thread(store.apply_compaction, session, response.choices[0].message.content.strip(),
+                                len(old_turns))
+        return True
+    except Exception as e:
+        print(f"Chat Session Compaction Error: {e}")  # 压缩失败时保留原文轮次，下一轮再试
+        return False
+    finally:
+        await asyncio.to_thread(store.release_compaction, session)
+
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+def schedule_compaction(session: ChatSession, client) -> None:
+    """在后台压缩历史，不占用本轮回答的延迟"""
+    if not session.needs_compaction():
+        return
+    # 后台压缩不受触发它的请求的截止时间 (X-Request-Timeout) 约束，请求结束后仍继续
+    task = asyncio.get_running_loop().create_task(without_deadline(lambda: compact_session(session, client)))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+# 进程级共享的会话存储 (多 worker 部署时由各 worker 通过 SQLite 共享)
+chat_session_store = SharedChatSessionStore() if SHARED_STATE_ENABLED else ChatSessionStore()
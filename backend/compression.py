@@ -0,0 +1,251 @@
+import importlib.util
+import io
+import os
+import zlib
+from typing import Optional
+
+# --- 传输压缩配置 (均可通过环境变量覆盖) ---
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))  # 小于该大小的响应不压缩
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+MAX_DECOMPRESSED_BODY_BYTES = int(os.getenv("MAX_DECOMPRESSED_BODY_BYTES", str(64 * 1024 * 1024)))  # 防止压缩炸弹
+
+# zstd 需要可选依赖 zstandard，未安装时只支持 gzip
+ZSTD_AVAILABLE = importlib.util.find_spec("zstandard") is not None
+
+# SSE 必须逐条送达，压缩器的缓冲会打断实时性
+EXCLUDED_CONTENT_TYPES = ("text/event-stream",)
+
+
+class RequestBodyError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _parse_accept_encoding(value: str) -> dict[str, float]:
+    """解析 Accept-Encoding，返回 {编码: q 值}"""
+    encodings = {}
+    for item in value.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            encodings[name.strip().lower()] = q
+    return encodings
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """按客户端的 Accept-Encoding 选择响应编码：优先 zstd (压缩/解压都更快)，其次 gzip"""
+    accepted = _parse_accept_encoding(accept_encoding)
+    for encoding in (("zstd", "gzip") if ZSTD_AVAILABLE else ("gzip",)):
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class _Compressor:
+    """gzip / zstd 流式压缩器：每个分块都 flush，保证流式响应的每一段都能被客户端立即解压"""
+
+    def __init__(self, encoding: str):
+        if encoding == "zstd":
+            import zstandard
+
+            self._zstd_flush = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            self._zstd_flush = None
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31 输出 gzip 格式
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        output = self._compressor.compress(data)
+        if final:
+            return output + self._compressor.flush()
+        if self._zstd_flush is not None:
+            return output + self._compressor.flush(self._zstd_flush)
+        return output + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def decompress_body(body: bytes, encoding: str, limit: int = MAX_DECOMPRESSED_BODY_BYTES) -> bytes:
+    """解压请求体，解压后超过 limit 字节时拒绝"""
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        decompressor = zlib.decompressobj(47)  # 自动识别 gzip / zlib 头
+        try:
+            data = decompressor.decompress(body, limit + 1)
+        except zlib.error as e:
+            raise RequestBodyError(400, f"Invalid {encoding} request body: {e}")
+        if len(data) > limit or decompressor.unconsumed_tail:
+            raise RequestBodyError(413, "Decompressed request body is too large.")
+        return data
+    if encoding == "zstd" and ZSTD_AVAILABLE:
+        import zstandard
+
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+                data = reader.read(limit + 1)
+        except zstandard.ZstdError as e:
+            raise RequestBodyError(400, f"Invalid zstd request body: {e}")
+        if len(data) > limit:
+            raise RequestBodyError(413, "Decompressed request body is too large.")
+        return data
+    raise RequestBodyError(415, f"Unsupported Content-Encoding: {encoding}")
+
+
+def _header(headers: list, name: bytes) -> Optional[str]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _without(headers: list, *names: bytes) -> list:
+    return [(key, value) for key, value in headers if key.lower() not in names]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 的弱比较：忽略 W/ 前缀 (压缩后的响应会把 ETag 变为弱校验)，* 匹配任意值"""
+    if not if_none_match:
+        return False
+    target = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == target:
+            return True
+    return False
+
+
+class CompressionMiddleware:
+    """
+    纯 ASGI 的传输压缩中间件：
+    - 请求体带 Content-Encoding: gzip / zstd 时先解压再交给路由 (上传数 MB 的文档文本时有用)；
+    - 响应按 Accept-Encoding 使用 zstd 或 gzip 压缩，跳过小响应、SSE 与已编码的响应；
+      压缩后的 ETag 改为弱校验，Vary 中加入 Accept-Encoding。
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = scope["headers"]
+        content_encoding = (_header(request_headers, b"content-encoding") or "identity").strip().lower()
+        if content_encoding != "identity":
+            try:
+                scope, receive = await self._decompressed_request(scope, receive, content_encoding)
+            except RequestBodyError as e:
+                await self._send_error(send, e)
+                return
+
+        encoding = choose_encoding(_header(request_headers, b"accept-encoding") or "")
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, self._compressing_send(send, encoding))
+
+    async def _decompressed_request(self, scope, receive, encoding: str):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise RequestBodyError(400, "Client disconnected")
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_DECOMPRESSED_BODY_BYTES:
+                raise RequestBodyError(413, "Request body is too large.")
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                break
+        body = decompress_body(b"".join(chunks), encoding)
+
+        headers = _without(scope["headers"], b"content-encoding", b"content-length")
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if sent:
+                return await receive()  # 之后只会收到 http.disconnect
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        # 直接修改原 scope 而不是复制：路由会把匹配结果 (scope["route"]) 写入 scope，外层的指标中间件要能读到
+        scope["headers"] = headers
+        return scope, replay
+
+    @staticmethod
+    async def _send_error(send, error: RequestBodyError) -> None:
+        import json
+
+        body = json.dumps({"detail": error.detail}).encode("utf-8")
+        await send({"type": "http.response.start", "status": error.status_code,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode("latin-1"))]})
+        await send({"type": "http.response.body", "body": body})
+
+    def _compressing_send(self, send, encoding: str):
+        start_message = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = message.get("headers", [])
+                content_type = _header(headers, b"content-type") or ""
+                passthrough = (
+                    message["status"] in (204, 304)
+                    or _header(headers, b"content-encoding") is not None
+                    or content_type.startswith(EXCLUDED_CONTENT_TYPES)
+                )
+                if passthrough:
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True  # 小响应直接发送
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding)
+                if not more_body:
+                    compressed = compressor.compress(body, final=True)
+                    await send(self._compressed_start(start_message, encoding, len(compressed)))
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                await send(self._compressed_start(start_message, encoding, None))
+            await send({"type": "http.response.body", "body": compressor.compress(body, final=not more_body),
+                        "more_body": more_body})
+
+        return send_wrapper
+
+    @staticmethod
+    def _compressed_start(message, encoding: str, content_length: Optional[int]):
+        headers = _without(message.get("headers", []), b"content-length", b"etag", b"vary")
+        original = message.get("headers", [])
+        etag = _header(original, b"etag")
+        if etag:
+            headers.append((b"etag", ("W/" + etag.removeprefix("W/")).encode("latin-1")))
+        vary = _header(original, b"vary")
+        headers.append((b"vary", (f"{vary}, Accept-Encoding" if vary else "Accept-Encoding").encode("latin-1")))
+        headers.append((b"content-encoding", encoding.encode("latin-1")))
+        if content_length is not None:  # 流式响应不带 Content-Length，由服务器使用分块传输
+            headers.append((b"content-length", str(content_length).encode("latin-1")))
+        return dict(message, headers=headers)
@@ -1,14 +1,43 @@
+import asyncio
+import importlib.util
 import os
-from openai import OpenAI
-from dotenv import load_dotenv
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
 
-dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
-if os.path.exists(dotenv_path):
-    load_dotenv(dotenv_path)
-else:
-    print("Warning: .env file not found at expected location. API Key might not be loaded.")
+import metrics
+from cancellation import check_deadline, wait_with_deadline, without_deadline
+from scheduler import Priority, request_scheduler
+from single_flight import SingleFlight, make_flight_key
 
-DEEPSEEK_API_BASE_URL = "https://api.deepseek.com"  # 或者 "https://api.deepseek.com/v1"
+# openai (连同 httpx) 导入约需 0.3 秒，推迟到第一次创建客户端时再导入，以缩短桌面版冷启动时间；
+# .env 由 main 在导入各模块之前通过 startup.load_env_file 加载
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# 可通过环境变量指向其他 OpenAI 兼容服务 (例如 benchmarks/fake_llm_server.py)
+DEEPSEEK_API_BASE_URL = os.getenv("DEEPSEEK_API_BASE_URL", "https://api.deepseek.com")  # 或者 "https://api.deepseek.com/v1"
+
+# --- 异步客户端连接池配置 (均可通过环境变量覆盖) ---
+LLM_CLIENT_POOL_SIZE = int(os.getenv("DEEPSEEK_CLIENT_POOL_SIZE", "32"))  # 最多缓存多少个不同 API Key 的客户端
+LLM_MAX_CONNECTIONS = int(os.getenv("DEEPSEEK_MAX_CONNECTIONS", "100"))  # 每个客户端的最大连接数
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("DEEPSEEK_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("DEEPSEEK_KEEPALIVE_EXPIRY", "60"))  # 空闲连接保活秒数
+LLM_CONNECT_TIMEOUT = float(os.getenv("DEEPSEEK_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("DEEPSEEK_READ_TIMEOUT", "600"))  # deepseek-reasoner 可能需要数分钟
+LLM_MAX_RETRIES = int(os.getenv("DEEPSEEK_MAX_RETRIES", "0"))  # SDK 自带的重试，默认关闭，由 scheduler 统一退避重试
+LLM_COALESCE_REQUESTS = os.getenv("DEEPSEEK_COALESCE_REQUESTS", "1") != "0"  # 合并完全相同的并发请求
+
+# HTTP/2 需要可选依赖 h2，未安装时退回 HTTP/1.1 keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _resolve_api_key(api_key: str = None) -> str:
+    """优先使用传入的 api_key，否则读取环境变量 DEEPSEEK_API_KEY。"""
+    resolved = api_key or os.getenv("DEEPSEEK_API_KEY")
+    if not resolved:
+        raise ValueError("DeepSeek API Key not provided or found in environment variables.")
+    return resolved
 
 
 class DeepSeekClient:
@@ -17,13 +46,9 @@ class DeepSeekClient:
         初始化 DeepSeek API 客户端。
         如果未提供 api_key，则尝试从环境变量 DEEPSEEK_API_KEY 中获取。
         """
-        if api_key:
-            self.api_key = api_key
-        else:
-            self.api_key = os.getenv("DEEPSEEK_API_KEY")
+        from openai import OpenAI
 
-        if not self.api_key:
-            raise ValueError("DeepSeek API Key not provided or found in environment variables.")
+        self.api_key = _resolve_api_key(api_key)
 
         self.client = OpenAI(
             api_key=self.api_key,
@@ -59,8 +84,304 @@ class DeepSeekClient:
             raise
 
 
+class AsyncClientPool:
+    """
+    按 API Key 缓存 AsyncOpenAI 客户端的有界 LRU 池。
+    同一个 Key 的请求复用同一个 httpx 连接池 (HTTP/2 / keep-alive)，避免每次请求重新握手。
+    被淘汰的客户端在其最后一个请求结束后才会关闭，不会打断正在进行的调用。
+    """
+
+    def __init__(self, max_size: int = LLM_CLIENT_POOL_SIZE):
+        self.max_size = max(1, max_size)
+        self._clients: "OrderedDict[str, AsyncOpenAI]" = OrderedDict()
+        self._leases: dict[int, int] = {}  # id(client) -> 正在使用该客户端的请求数
+        self._evicted: dict[int, "AsyncOpenAI"] = {}
+
+    @staticmethod
+    def _create_client(api_key: str) -> "AsyncOpenAI":
+        import httpx
+        from openai import AsyncOpenAI
+
+        http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+        return AsyncOpenAI(
+            api_key=api_key,
+            base_url=DEEPSEEK_API_BASE_URL,
+            http_client=http_client,
+            max_retries=LLM_MAX_RETRIES,
+        )
+
+    def acquire(self, api_key: str) -> "AsyncOpenAI":
+        """取出 (或创建) 该 Key 对应的客户端并登记一次使用，调用方用完后必须 release。"""
+        client = self._clients.get(api_key)
+        if client is None:
+            client = self._create_client(api_key)
+            self._clients[api_key] = client
+            while len(self._clients) > self.max_size:
+                _, evicted = self._clients.popitem(last=False)
+                self._evicted[id(evicted)] = evicted
+                if not self._leases.get(id(evicted)):
+                    self._close_later(evicted)
+        else:
+            self._clients.move_to_end(api_key)
+        self._leases[id(client)] = self._leases.get(id(client), 0) + 1
+        return client
+
+    def release(self, client: "AsyncOpenAI") -> None:
+        key = id(client)
+        remaining = self._leases.get(key, 0) - 1
+        if remaining > 0:
+            self._leases[key] = remaining
+            return
+        self._leases.pop(key, None)
+        if key in self._evicted:
+            self._close_later(client)
+
+    def _close_later(self, client: "AsyncOpenAI") -> None:
+        self._evicted.pop(id(client), None)
+        try:
+            asyncio.get_running_loop().create_task(client.close())
+        except RuntimeError:  # 没有运行中的事件循环，直接丢弃即可
+            pass
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    async def aclose(self) -> None:
+        """关闭池中所有客户端 (应用关闭时调用)。"""
+        clients = list(self._clients.values()) + list(self._evicted.values())
+        self._clients.clear()
+        self._evicted.clear()
+        self._leases.clear()
+        for client in clients:
+            await client.close()
+
+
+# 进程级共享的客户端池
+async_client_pool = AsyncClientPool()
+
+
+class UsageStats:
+    """
+    按模型累计 token 用量，重点记录 DeepSeek 上下文缓存的命中情况
+    (usage 中的 prompt_cache_hit_tokens / prompt_cache_miss_tokens)，用于验证提示词前缀是否被复用。
+    """
+
+    COUNTERS = ("prompt_tokens", "completion_tokens", "prompt_cache_hit_tokens", "prompt_cache_miss_tokens")
+
+    def __init__(self):
+        self._models: dict[str, dict[str, int]] = {}
+
+    def record(self, model: str, usage) -> None:
+        if usage is None:
+            return
+        values = usage if isinstance(usage, dict) else usage.model_dump(exclude_none=True)
+        totals = self._models.setdefault(model, dict.fromkeys(("requests",) + self.COUNTERS, 0))
+        totals["requests"] += 1
+        for counter in self.COUNTERS:
+            value = values.get(counter)
+            if isinstance(value, int):
+                totals[counter] += value
+
+    def snapshot(self) -> dict:
+        models = {}
+        for model, totals in self._models.items():
+            cache_tokens = totals["prompt_cache_hit_tokens"] + totals["prompt_cache_miss_tokens"]
+            models[model] = dict(
+                totals,
+                cache_hit_rate=round(totals["prompt_cache_hit_tokens"] / cache_tokens, 4) if cache_tokens else 0.0,
+            )
+        return {"models": models}
+
+    def reset(self) -> None:
+        self._models.clear()
+
+
+def accumulate_usage(total: dict, response) -> None:
+    """把一次响应的 usage 累加到 total (分层摘要、分章节思维导图等多请求任务汇总用量)"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    for key, value in usage.model_dump(exclude_none=True).items():
+        if isinstance(value, int):
+            total[key] = total.get(key, 0) + value
+
+
+# 进程级共享的用量统计
+usage_stats = UsageStats()
+
+# 进程级共享的请求合并器：同一 API Key、模型、消息与参数的并发请求只调用一次上游
+single_flight = SingleFlight()
+
+
+class AsyncDeepSeekClient:
+    """
+    DeepSeekClient 的异步版本，基于 AsyncOpenAI，不会阻塞事件循环。
+    底层客户端从 async_client_pool 中按 API Key 复用，因此每个请求创建本对象的开销很小。
+    """
+
+    def __init__(self, api_key: str = None, pool: AsyncClientPool = None, priority: Priority = Priority.CHAT):
+        self.api_key = _resolve_api_key(api_key)
+        self.pool = pool or async_client_pool
+        self.priority = priority  # 在 request_scheduler 中排队时使用的优先级
+
+    async def get_chat_completion(self, messages: list, model: str = "deepseek-reasoner", stream: bool = False,
+                                  priority: Priority = None, **kwargs):
+        """
+        异步获取聊天模型的补全结果，参数与 DeepSeekClient.get_chat_completion 相同。
+
+        :param priority: 覆盖本客户端的默认调度优先级。
+        :return: 非流式模式下返回 ChatCompletion 对象，流式模式下返回一个异步生成器 (逐个产出 chunk)。
+        与正在进行中的完全相同的请求 (含流式请求) 会被合并，共享同一个上游调用的结果；
+        实际的上游调用经过 request_scheduler 的限流、优先级排队与退避重试，
+        队列已满时抛出 scheduler.SchedulerOverloaded。
+        """
+        priority = self.priority if priority is None else priority
+        if not LLM_COALESCE_REQUESTS:
+            return await self._create(messages, model, stream, priority, **kwargs)
+        # 合并的上游调用可能被截止时间不同的多个请求共享，因此不带截止时间执行，
+        # 由每个等待者按自己的截止时间等待 (所有等待者都放弃时上游调用才会取消)
+        key = make_flight_key(self.api_key, model, messages, stream, kwargs)
+        if stream:
+            return await wait_with_deadline(single_flight.stream(
+                key, lambda: without_deadline(lambda: self._create(messages, model, True, priority, **kwargs))
+            ))
+        return await wait_with_deadline(single_flight.do(
+            key, lambda: without_deadline(lambda: self._create(messages, model, False, priority, **kwargs))
+        ))
+
+    async def _create(self, messages: list, model: str, stream: bool, priority: Priority, **kwargs):
+        # 流式请求在整个流结束前都占用并发槽，由 UpstreamStream 释放
+        return await request_scheduler.run(
+            self.api_key, priority, lambda: self._request(messages, model, stream, **kwargs), hold=stream
+        )
+
+    async def _request(self, messages: list, model: str, stream: bool, **kwargs):
+        # 请求带有截止时间 (X-Request-Timeout) 时，上游调用的超时不超过剩余时间 (仅未合并的请求)
+        remaining = check_deadline()
+        if remaining is not None:
+            kwargs["timeout"] = min(LLM_READ_TIMEOUT, remaining)
+        client = self.pool.acquire(self.api_key)
+        metrics.PROMPT_CHARS.observe(sum(len(str(message.get("content") or "")) for message in messages),
+                                     endpoint=metrics.current_endpoint(), model=model)
+        started = time.perf_counter()
+        try:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=stream,
+                **kwargs
+            )
+        except Exception as e:
+            self.pool.release(client)
+            metrics.observe_completion(model, time.perf_counter() - started, None, None, outcome="error")
+            print(f"Error calling DeepSeek API: {e}")
+            raise
+
+        if not stream:
+            self.pool.release(client)
+            usage_stats.record(model, response.usage)
+            metrics.record_stage("upstream", started)
+            metrics.observe_completion(model, time.perf_counter() - started, None, response.usage)
+            return response
+        return UpstreamStream(self, client, response, model, started)
+
+
+class UpstreamStream:
+    """
+    上游流式响应，逐个产出 chunk。整个流期间占用连接池租约与调度器并发槽，
+    在流读完、出错、被 aclose()，或从未被迭代就被丢弃 (如客户端在开始读取前断开) 时归还，且只归还一次。
+    """
+
+    def __init__(self, owner: AsyncDeepSeekClient, client: "AsyncOpenAI", response, model: str, started: float):
+        self._owner = owner
+        self._client = client
+        self._response = response
+        self._model = model
+        self._started = started
+        self._chunks = None  # 第一次迭代时才创建内部生成器
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._chunks is None:
+            if self._released:
+                raise StopAsyncIteration
+            self._chunks = self._iterate()
+        return await self._chunks.__anext__()
+
+    async def aclose(self) -> None:
+        if self._chunks is not None:
+            await self._chunks.aclose()  # 由内部生成器的 finally 归还
+        elif not self._released:
+            self._release("cancelled", None, None)
+            await self._response.close()
+
+    def __del__(self):
+        # 已开始迭代的内部生成器由事件循环的异步生成器钩子负责关闭
+        if self._chunks is None and not self._released:
+            self._release("cancelled", None, None)
+            try:
+                asyncio.get_running_loop().create_task(self._response.close())
+            except RuntimeError:
+                pass  # 事件循环已关闭，连接随客户端一起释放
+
+    def _release(self, outcome: str, first_token_at, usage) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._owner.pool.release(self._client)
+        request_scheduler.release(self._owner.api_key)
+        finished = time.perf_counter()
+        if first_token_at is not None:
+            metrics.record_stage("upstream_generation", first_token_at, finished - first_token_at)
+        metrics.observe_completion(self._model, finished - self._started,
+                                   first_token_at - self._started if first_token_at is not None else None,
+                                   usage, outcome=outcome)
+
+    async def _iterate(self):
+        first_token_at = None
+        usage = None
+        outcome = "error"
+        try:
+            async for chunk in self._response:
+                if first_token_at is None and chunk.choices:
+                    delta = chunk.choices[0].delta
+                    if delta.content or getattr(delta, "reasoning_content", None):
+                        first_token_at = time.perf_counter()
+                        metrics.record_stage("upstream_ttft", self._started, first_token_at - self._started)
+                if getattr(chunk, "usage", None) is not None:  # 开启 include_usage 时最后一个 chunk 携带 usage
+                    usage = chunk.usage
+                    usage_stats.record(self._model, chunk.usage)
+                yield chunk
+            outcome = "ok"
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "cancelled"
+            raise
+        finally:
+            try:
+                await self._response.close()
+            finally:
+                self._release(outcome, first_token_at, usage)
+
+
 # --- 可选的测试代码 ---
 if __name__ == "__main__":
+    from startup import load_env_file
+
+    # 作为脚本单独运行时不经过 main，需要在这里加载 .env (并重新读取导入时已取过的配置)
+    load_env_file()
+    DEEPSEEK_API_BASE_URL = os.getenv("DEEPSEEK_API_BASE_URL", DEEPSEEK_API_BASE_URL)
+
     # 确保你的 .env 文件中有 DEEPSEEK_API_KEY
     # 或者在运行此脚本前设置环境变量
     # export DEEPSEEK_API_KEY="your_key" (Linux/macOS)
@@ -0,0 +1,101 @@
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+from retrieval import chunk_document, estimate_tokens, pages_for_span
+
+# 常见的章节标题形式：编号标题 (1 Introduction / 2.1 Method)、英文固定章节名、中文章节
+_NUMBERED_HEADING_RE = re.compile(r"^(\d{1,2}(?:\.\d{1,2}){0,3})\.?\s+([A-Z\u4e00-\u9fff][^\n]{1,80})$")
+_NAMED_HEADING_RE = re.compile(
+    r"^(abstract|introduction|related work|background|preliminaries|methods?|methodology|approach|"
+    r"experiments?|experimental setup|evaluation|results|discussion|limitations|conclusions?|"
+    r"future work|references|bibliography|acknowledge?ments?|appendix(?: [a-z])?)\s*:?$",
+    re.IGNORECASE,
+)
+_CHINESE_HEADING_RE = re.compile(
+    r"^(第[一二三四五六七八九十百\d]+[章节部分]\s*[^\n]{0,40}|[一二三四五六七八九十]+[、.．]\s*[^\n]{1,40}|"
+    r"摘\s*要|引\s*言|绪\s*论|结\s*论|参考文献|致\s*谢|附\s*录)$"
+)
+
+
+@dataclass
+class Section:
+    title: str
+    start: int  # 在全文中的起始字符偏移
+    end: int
+    level: int = 1  # 1 为一级章节，2.1 这类编号为二级，依此类推
+    pages: list[int] = field(default_factory=list)
+
+    def text_of(self, document_text: str) -> str:
+        return document_text[self.start:self.end].strip()
+
+
+def _heading_level(line: str) -> Optional[int]:
+    """判断一行是否像章节标题，是则返回层级，否则返回 None"""
+    if len(line) > 90 or line.endswith((".", "。", ",", "，", ";", "；")):
+        return None
+    numbered = _NUMBERED_HEADING_RE.match(line)
+    if numbered:
+        return numbered.group(1).count(".") + 1
+    if _NAMED_HEADING_RE.match(line) or _CHINESE_HEADING_RE.match(line):
+        return 1
+    return None
+
+
+def detect_sections(text: str, page_offsets: Optional[list[int]] = None, max_level: int = 1) -> list[Section]:
+    """
+    按章节标题把全文切分为若干 Section (只在层级 <= max_level 的标题处切分)。
+    第一个标题之前的内容 (通常是论文标题、作者与摘要) 作为名为 "Front Matter" 的章节；
+    没有识别到任何标题时返回覆盖全文的单个章节。
+    """
+    boundaries: list[tuple[int, str, int]] = []
+    position = 0
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped:
+            level = _heading_level(stripped)
+            if level is not None and level <= max_level:
+                boundaries.append((position, stripped, level))
+        position += len(line)
+
+    if not boundaries or boundaries[0][0] > 0:
+        boundaries.insert(0, (0, "Front Matter", 1))
+
+    sections = []
+    for i, (start, title, level) in enumerate(boundaries):
+        end = boundaries[i + 1][0] if i + 1 < len(boundaries) else len(text)
+        if text[start:end].strip():
+            sections.append(Section(title=title, start=start, end=end, level=level,
+                                    pages=pages_for_span(page_offsets or [], start, end)))
+    return sections
+
+
+def split_into_parts(text: str, page_offsets: Optional[list[int]] = None, max_tokens: int = 6000,
+                     overlap_chars: int = 0) -> list[Section]:
+    """
+    把全文切成不超过 max_tokens 的若干部分，优先在章节边界处切分：
+    相邻的短章节合并为一部分，超长章节再按段落/句子边界继续切分 (相邻分块重叠 overlap_chars 个字符)。
+    """
+    parts: list[Section] = []
+    for section in detect_sections(text, page_offsets):
+        section_text = text[section.start:section.end]
+        section_tokens = estimate_tokens(section_text)
+
+        if section_tokens > max_tokens:
+            chars_per_token = len(section_text) / max(section_tokens, 1)
+            for i, chunk in enumerate(chunk_document(section_text, chunk_chars=int(max_tokens * chars_per_token),
+                                                     overlap=overlap_chars)):
+                start, end = section.start + chunk.start, section.start + chunk.end
+                parts.append(Section(title=f"{section.title} ({i + 1})", start=start, end=end, level=section.level,
+                                     pages=pages_for_span(page_offsets or [], start, end)))
+            continue
+
+        previous = parts[-1] if parts else None
+        if previous is not None and estimate_tokens(text[previous.start:section.end]) <= max_tokens:
+            previous.end = section.end
+            previous.title = f"{previous.title.split(' – ')[0]} – {section.title}"  # 合并后标题显示为章节范围
+            previous.pages = pages_for_span(page_offsets or [], previous.start, previous.end)
+        else:
+            parts.append(Section(title=section.title, start=section.start, end=section.end, level=section.level,
+                                 pages=list(section.pages)))
+    return parts
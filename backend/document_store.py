@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from shared_state import SHARED_STATE_DB_PATH, SHARED_STATE_ENABLED, connect_sqlite
+
+# --- 文档存储配置 (均可通过环境变量覆盖) ---
+DOCUMENT_STORE_MAX_BYTES = int(os.getenv("DOCUMENT_STORE_MAX_BYTES", str(256 * 1024 * 1024)))  # 所有文档文本总大小上限
+DOCUMENT_STORE_MAX_DOCUMENTS = int(os.getenv("DOCUMENT_STORE_MAX_DOCUMENTS", "64"))
+# 多 worker 共享模式下，每个进程内存中额外缓存的文档文本总大小上限 (完整文档保存在共享 SQLite 中)
+DOCUMENT_STORE_HOT_MAX_BYTES = int(os.getenv("DOCUMENT_STORE_HOT_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def compute_doc_id(text: str) -> str:
+    """文档 ID 即文本内容的 SHA-256，相同内容总是得到相同的 doc_id"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class StoredDocument:
+    doc_id: str
+    text: str
+    filename: Optional[str] = None
+    page_offsets: list[int] = field(default_factory=list)  # 每页在 text 中的起始偏移，未知时为空
+    size_bytes: int = 0
+    created_at: float = field(default_factory=time.time)
+
+
+class DocumentStore:
+    """
+    后端文档存储：提取出的全文按内容哈希登记一次，之后 LLM 接口只需传递 doc_id。
+    超出文档数量或总字节数上限时按 LRU 淘汰最久未使用的文档。
+    """
+
+    def __init__(self, max_bytes: int = DOCUMENT_STORE_MAX_BYTES, max_documents: int = DOCUMENT_STORE_MAX_DOCUMENTS):
+        self.max_bytes = max_bytes
+        self.max_documents = max(1, max_documents)
+        self._documents: "OrderedDict[str, StoredDocument]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def add(self, text: str, filename: Optional[str] = None,
+            page_offsets: Optional[list[int]] = None) -> StoredDocument:
+        """登记文档并返回存储记录；内容相同的文档只保存一份"""
+        doc_id = compute_doc_id(text)
+        with self._lock:
+            existing = self._documents.get(doc_id)
+            if existing is not None:
+                self._documents.move_to_end(doc_id)
+                if filename:
+                    existing.filename = filename
+                if page_offsets and not existing.page_offsets:
+                    existing.page_offsets = list(page_offsets)
+                return existing
+
+            document = StoredDocument(
+                doc_id=doc_id,
+                text=text,
+                filename=filename,
+                page_offsets=list(page_offsets or []),
+                size_bytes=len(text.encode("utf-8")),
+            )
+            self._documents[doc_id] = document
+            self._total_bytes += document.size_bytes
+            self._evict_locked(keep=doc_id)
+            return document
+
+    def get(self, doc_id: str) -> Optional[StoredDocument]:
+        with self._lock:
+            document = self._documents.get(doc_id)
+            if document is not None:
+                self._documents.move_to_end(doc_id)
+            return document
+
+    def remove(self, doc_id: str) -> bool:
+        with self._lock:
+            document = self._documents.pop(doc_id, None)
+            if document is None:
+                return False
+            self._total_bytes -= document.size_bytes
+            return True
+
+    def _evict_locked(self, keep: str) -> None:
+        # 刚加入的文档即使单独超过上限也保留，否则调用方拿到的 doc_id 立即失效
+        while len(self._documents) > 1 and (
+                len(self._documents) > self.max_documents or self._total_bytes > self.max_bytes):
+            oldest_id = next(iter(self._documents))
+            if oldest_id == keep:
+                break
+            evicted = self._documents.pop(oldest_id)
+            self._total_bytes -= evicted.size_bytes
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "max_documents": self.max_documents,
+                "evictions": self.evictions,
+            }
+
+
+class SharedDocumentStore(DocumentStore):
+    """
+    多 worker 部署使用的文档存储：文档 (文本 zlib 压缩) 保存在共享 SQLite 中，任何 worker 登记的 doc_id
+    都能在其他 worker 上使用；数量与总大小上限及 LRU 淘汰作用于共享的表。
+    父类的内存 LRU 作为本进程的热缓存，由于 doc_id 就是文本哈希，缓存中的文本不会过期，
+    但每次 get 仍会查询共享表，确保其他 worker 删除或淘汰的文档在这里同样不可见。
+    所有方法都是阻塞 IO (写锁被其他 worker 占用时最多等待 busy timeout)，异步代码中请用 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, db_path: str = SHARED_STATE_DB_PATH, max_bytes: int = DOCUMENT_STORE_MAX_BYTES,
+                 max_documents: int = DOCUMENT_STORE_MAX_DOCUMENTS, hot_max_bytes: int = DOCUMENT_STORE_HOT_MAX_BYTES):
+        super().__init__(max_bytes=hot_max_bytes, max_documents=max_documents)
+        self.db_path = db_path
+        self.shared_max_bytes = max_bytes
+        self.shared_evictions = 0  # 父类的 evictions 统计的是热缓存淘汰
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = connect_sqlite(self.db_path)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " doc_id TEXT PRIMARY KEY,"
+                " filename TEXT,"
+                " page_offsets TEXT NOT NULL,"
+                " content BLOB NOT NULL,"
+                " size_bytes INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_last_access ON documents (last_access)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def add(self, text: str, filename: Optional[str] = None,
+            page_offsets: Optional[list[int]] = None) -> StoredDocument:
+        doc_id = compute_doc_id(text)
+        now = time.time()
+        with self._db_lock:
+            conn = self._connection()
+            row = conn.execute("SELECT filename, page_offsets FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO documents"
+                    " (doc_id, filename, page_offsets, content, size_bytes, created_at, last_access)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (doc_id, filename, json.dumps(list(page_offsets or [])), zlib.compress(text.encode("utf-8"), 1),
+                     len(text.encode("utf-8")), now, now),
+                )
+                self._evict_shared_locked(conn, keep=doc_id)
+            else:
+                stored_offsets = json.loads(row[1])
+                conn.execute(
+                    "UPDATE documents SET filename = ?, page_offsets = ?, last_access = ? WHERE doc_id = ?",
+                    (filename or row[0], json.dumps(stored_offsets or list(page_offsets or [])), now, doc_id),
+                )
+                filename = filename or row[0]
+                page_offsets = stored_offsets or page_offsets
+            conn.commit()
+        return super().add(text, filename=filename, page_offsets=page_offsets)
+
+    def get(self, doc_id: str) -> Optional[StoredDocument]:
+        with self._db_lock:
+            conn = self._connection()
+            row = conn.execute("SELECT filename, page_offsets FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row is None:
+                super().remove(doc_id)
+                return None
+            conn.execute("UPDATE documents SET last_access = ? WHERE doc_id = ?", (time.time(), doc_id))
+            conn.commit()
+            document = super().get(doc_id)
+            if document is not None:
+                document.filename = row[0]  # 其他 worker 可能更新了文件名
+                return document
+            content = conn.execute("SELECT content FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        if content is None:
+            return None
+        return super().add(zlib.decompress(content[0]).decode("utf-8"), filename=row[0],
+                           page_offsets=json.loads(row[1]))
+
+    def remove(self, doc_id: str) -> bool:
+        with self._db_lock:
+            conn = self._connection()
+            deleted = conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,)).rowcount
+            conn.commit()
+        return super().remove(doc_id) or deleted > 0
+
+    def _evict_shared_locked(self, conn: sqlite3.Connection, keep: str) -> None:
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM documents").fetchone()
+        if count <= self.max_documents and total <= self.shared_max_bytes:
+            return
+        for doc_id, size in conn.execute("SELECT doc_id, size_bytes FROM documents ORDER BY last_access").fetchall():
+            if count <= 1 or (count <= self.max_documents and total <= self.shared_max_bytes):
+                break
+            if doc_id == keep:
+                continue
+            conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            count -= 1
+            total -= size
+            self.shared_evictions += 1
+
+    def stats(self) -> dict:
+        with self._db_lock:
+            count, total = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM documents"
+            ).fetchone()
+        hot = super().stats()
+        return {
+            "documents": count,
+            "total_bytes": total,
+            "max_bytes": self.shared_max_bytes,
+            "max_documents": self.max_documents,
+            "evictions": self.shared_evictions,
+            "hot_documents": hot["documents"],
+            "hot_bytes": hot["total_bytes"],
+            "hot_evictions": hot["evictions"],
+            "shared": True,
+        }
+
+
+# 进程级共享的文档存储 (多 worker 部署时由各 worker 通过 SQLite 共享)
+document_store = SharedDocumentStore() if SHARED_STATE_ENABLED else DocumentStore()
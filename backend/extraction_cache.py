@@ -0,0 +1,159 @@
+import gzip
+import json
+import os
+import threading
+from typing import Optional
+
+from pdf_extractor import ExtractionResult
+
+# --- 提取结果磁盘缓存配置 (均可通过环境变量覆盖) ---
+DEEPREAD_DATA_DIR = os.getenv("DEEPREAD_DATA_DIR", os.path.join(os.path.expanduser("~"), ".deepread_ai"))
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", os.path.join(DEEPREAD_DATA_DIR, "extraction_cache"))
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+CACHE_FORMAT_VERSION = 1
+CACHE_FILE_SUFFIX = ".json.gz"
+
+
+class ExtractionCache:
+    """
+    以 PDF 字节的 SHA-256 为键的提取结果磁盘缓存。
+    每个结果 gzip 压缩后单独存为一个文件，文件的 mtime 作为最近使用时间，
+    总大小超过上限时按 LRU 删除最久未使用的条目。所有方法都是阻塞 IO，异步代码中请用 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, cache_dir: str = EXTRACTION_CACHE_DIR, max_bytes: int = EXTRACTION_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None  # 首次使用时扫描目录得到
+
+    def _path_for(self, pdf_sha256: str) -> str:
+        return os.path.join(self.cache_dir, pdf_sha256[:2], pdf_sha256 + CACHE_FILE_SUFFIX)
+
+    def _iter_entries(self):
+        """遍历所有缓存文件，产出 (路径, 大小, mtime)"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(CACHE_FILE_SUFFIX):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def _ensure_total_locked(self) -> int:
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._iter_entries())
+        return self._total_bytes
+
+    def get(self, pdf_sha256: str) -> Optional[ExtractionResult]:
+        path = self._path_for(pdf_sha256)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                payload = json.load(f)
+            if payload.get("version") != CACHE_FORMAT_VERSION:
+                raise ValueError("cache format version mismatch")
+            os.utime(path)  # 更新最近使用时间
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Warning: discarding unreadable extraction cache entry {path}: {e}")
+            self._discard(path)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return ExtractionResult(
+            text=payload["text"],
+            page_count=payload["page_count"],
+            page_offsets=payload["page_offsets"],
+        )
+
+    def put(self, pdf_sha256: str, result: ExtractionResult) -> None:
+        path = self._path_for(pdf_sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = {
+            "version": CACHE_FORMAT_VERSION,
+            "text": result.text,
+            "page_count": result.page_count,
+            "page_offsets": result.page_offsets,
+        }
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(payload, f, ensure_ascii=False)
+        new_size = os.path.getsize(tmp_path)
+
+        with self._lock:
+            total = self._ensure_total_locked()
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)  # 原子替换，避免并发读到半个文件
+            self._total_bytes = total - old_size + new_size
+            self._evict_locked(keep=path)
+
+    def _evict_locked(self, keep: str) -> None:
+        if self._total_bytes <= self.max_bytes:
+            return
+        entries = sorted(self._iter_entries(), key=lambda entry: entry[2])
+        for path, size, _ in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def _discard(self, path: str) -> None:
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                return
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def purge(self) -> int:
+        """删除所有缓存条目，返回删除的条目数"""
+        removed = 0
+        with self._lock:
+            for path, _, _ in list(self._iter_entries()):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+            self._total_bytes = 0
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._ensure_total_locked()
+            entries = sum(1 for _ in self._iter_entries())
+            lookups = self.hits + self.misses
+            return {
+                "cache_dir": self.cache_dir,
+                "entries": entries,
+                "total_bytes": total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+# 进程级共享的提取缓存
+extraction_cache = ExtractionCache()
@@ -1,22 +1,79 @@
-import io
+import asyncio
+import functools
+import hashlib
+import ipaddress
+import multiprocessing
+import os
+import shutil
+import time
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Header  # 导入 Header
+from startup import PREWARM_MODULES, StartupTimingMiddleware, load_env_file, prewarm_imports, startup_timer
+
+load_env_file()  # 必须先于其他后端模块导入：各模块在导入时读取环境变量配置
+
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Header, Query, Request  # 导入 Header
 from pydantic import BaseModel, Field
-from pypdf import PdfReader
-from deepseek_client import DeepSeekClient  # 相对导入
+from deepseek_client import AsyncDeepSeekClient, async_client_pool, single_flight, usage_stats  # 相对导入
+from document_store import StoredDocument, compute_doc_id, document_store
+from extraction_cache import extraction_cache
+from response_cache import CachedResponse, make_cache_key, response_cache
+from summarizer import HierarchicalSummarizer, join_partial_summaries, map_reduce_config, should_use_map_reduce
+from retrieval import (
+    RETRIEVAL_TOKEN_BUDGET, RETRIEVAL_TOP_K, estimate_tokens, format_passages, retrieval_index_cache
+)
+import metrics
+from compression import CompressionMiddleware, etag_matches
+from cancellation import CancellationMiddleware, DeadlineExceeded, abort_stats
+from batch_jobs import (
+    BATCH_DIRECTORY_ROOTS, BATCH_MAX_FILES, batch_job_manager, job_upload_dir, list_pdf_files, new_job_id
+)
+from scheduler import Priority, SchedulerOverloaded, request_scheduler
+from chat_sessions import (
+    ChatSession, chat_session_store, history_messages, schedule_compaction
+)
+from translation import TRANSLATE_DEFAULT_LANG, TRANSLATE_MAX_CHARS, TRANSLATE_MODEL, Translator
+from mindmap_builder import (
+    MINDMAP_SECTION_MODEL, SectionMindmapBuilder, document_title, render_mindmap, section_config
+)
+from prompts import (
+    build_chat_messages, build_mindmap_messages, build_summarize_messages, clean_mindmap_output, prompt_prefix_cache
+)
+from pdf_extractor import (
+    ExtractionResult, spool_upload, extract_pdf_file, iter_pdf_pages, join_pages, page_text, shutdown_process_pool
+)
 import json
 from typing import Optional  # 导入 Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware  # 导入 CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 
+startup_timer.mark("imports")
 
 # --------------------------
 # FastAPI 应用初始化
 # --------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动批量任务的后台 worker，并继续上次中断的任务
+    await batch_job_manager.start(process_batch_item)
+    startup_timer.report("ready")
+    # 就绪后在后台导入 openai / pypdf 等重型依赖，第一次真正使用时无需再等待导入
+    prewarm = asyncio.create_task(asyncio.to_thread(prewarm_imports)) if PREWARM_MODULES else None
+    yield
+    if prewarm is not None:
+        await prewarm
+    await batch_job_manager.stop()
+    # 关闭按 API Key 复用的 LLM 客户端连接池
+    await async_client_pool.aclose()
+    # 关闭 PDF 提取进程池
+    shutdown_process_pool()
+
+
 app = FastAPI(
     title="DeepRead AI Backend",
     description="API for DeepRead AI application, providing PDF processing and AI interaction.",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # CORS 配置
@@ -24,6 +81,15 @@ origins = [
     "http://localhost",
 ]
 
+# 请求体解压 (Content-Encoding: gzip/zstd) 与响应压缩 (按 Accept-Encoding，SSE 除外)
+app.add_middleware(CompressionMiddleware)
+# LLM 接口：客户端断开时取消处理与上游调用，并按 X-Request-Timeout 执行截止时间
+app.add_middleware(CancellationMiddleware)
+# 请求级耗时追踪与 Prometheus 指标 (/metrics)
+app.add_middleware(metrics.MetricsMiddleware)
+# 记录启动后第一个请求的完成时刻
+app.add_middleware(StartupTimingMiddleware, timer=startup_timer)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # 在开发阶段可以使用 "*"，生产中应更具体。
@@ -33,136 +99,588 @@ app.add_middleware(
 )
 
 
+# 各类请求使用的模型
+SUMMARY_MODEL = "deepseek-reasoner"
+CHAT_MODEL = "deepseek-chat"
+MINDMAP_MODEL = "deepseek-reasoner"
+
+
 # --------------------------
 # 数据模型 (Pydantic)
 # --------------------------
 class TextRequest(BaseModel):
-    text: str
+    text: Optional[str] = None
+    doc_id: Optional[str] = Field(None, description="由 /api/pdf/extract-text 返回的文档 ID，可代替 text")
+    bypass_cache: bool = Field(False, description="为 True 时忽略已缓存的结果并重新生成")
+    mode: str = Field("auto", description="'single' 一次性摘要，'map_reduce' 分块并发摘要后合并，'auto' 按长度自动选择")
 
 
 class SummaryResponse(BaseModel):
     summary: str
+    cached: bool = False
 
 
 class ChatWithContextRequest(BaseModel):
     user_query: str
-    document_context: str  # 从前端传递过来的 PDF 文本
+    document_context: Optional[str] = None  # 从前端传递过来的 PDF 文本 (旧方式)
+    doc_id: Optional[str] = None  # 推荐：只传文档 ID，由后端从文档存储中取全文
+    use_retrieval: bool = Field(True, description="为 True 时只发送与问题最相关的文档片段，而不是全文")
+    top_k: Optional[int] = Field(None, ge=1, le=50, description="最多发送的片段数")
+    context_token_budget: Optional[int] = Field(None, ge=256, description="文档片段的 token 预算")
+
+
+class SourcePassage(BaseModel):
+    chunk_id: int
+    pages: list[int]
+    score: float
 
 
 class ChatResponse(BaseModel):
     ai_response: str
+    sources: list[SourcePassage] = []
+
+
+class ChatSessionCreateRequest(BaseModel):
+    doc_id: str
+
+
+class ChatSessionMessageRequest(BaseModel):
+    user_query: str  # 只需发送本轮的新问题，历史由服务端保存
+    use_retrieval: bool = True
+    top_k: Optional[int] = Field(None, ge=1, le=50)
+    context_token_budget: Optional[int] = Field(None, ge=256)
+
+
+class ChatSessionResponse(BaseModel):
+    session_id: str
+    doc_id: str
+    turn_count: int
+    history_turns: int  # 尚未压缩、以原文保存的轮数
+    history_tokens: int
+    summary: str
+    compactions: int
+
+
+class ChatSessionReply(ChatResponse):
+    session_id: str
+    turn_count: int
+
+
+class TranslateRequest(BaseModel):
+    texts: list[str] = Field(..., min_length=1, max_length=100, description="要翻译的选中文本，多段会尽量合并为一次请求")
+    target_lang: str = Field(TRANSLATE_DEFAULT_LANG, max_length=32, description="目标语言，例如 '简体中文'、'English'")
+    bypass_cache: bool = Field(False, description="为 True 时忽略已缓存的译文并重新翻译")
+
+
+class TranslateResponse(BaseModel):
+    translations: list[str]  # 与 texts 一一对应
+    target_lang: str
+    cached: list[bool] = []  # 每段译文是否来自缓存
 
 
 class MindmapRequest(BaseModel):
-    document_text: str
+    document_text: Optional[str] = None
+    doc_id: Optional[str] = None
     output_format: str = Field("mermaid", description="Desired output format: 'mermaid' or 'json'")
+    bypass_cache: bool = Field(False, description="为 True 时忽略已缓存的结果并重新生成")
+    mode: str = Field("single", description="'single' 整篇一次生成，'sections' 按章节并发生成子树后在本地合并")
 
 
 class MindmapResponse(BaseModel):
     mindmap_data: str
     format_used: str
+    cached: bool = False
+    failed_sections: list[str] = []  # sections 模式下重试后仍无法生成子树的章节
+
+
+class BatchDirectoryRequest(BaseModel):
+    directory: str = Field(..., description="本机目录路径 (桌面版)，处理其中所有 PDF")
+    recursive: bool = False
+    summarize: bool = False
+    mindmap: bool = False
+    mindmap_format: str = "json"
+    mindmap_mode: str = "single"
+    summary_mode: str = "auto"
+
+
+class DocumentResponse(BaseModel):
+    doc_id: str
+    filename: Optional[str] = None
+    char_count: int
+    page_count: int
+    text: str
+
+
+class PageTextResponse(BaseModel):
+    doc_id: str
+    page_number: int  # 从 1 开始
+    page_count: int
+    text: str
 
 
 # --------------------------
 # 工具函数
 # --------------------------
-async def extract_pdf_text(file: UploadFile) -> str:
-    """提取PDF文件文本内容"""
-    pdf_content = await file.read()
-    pdf_file = io.BytesIO(pdf_content)
-    reader = PdfReader(pdf_file)
-
-    extracted_text = ""
-    for page in reader.pages:
-        extracted_text += page.extract_text() or ""
-
-    return extracted_text.strip()
-
-
-def build_summarize_messages(text: str) -> list[dict]:
-    """构建摘要请求的消息结构"""
-    return [
-        {
-            "role": "system",
-            "content": (
-                "You are an assistant skilled in summarizing texts accurately and concisely. "
-                "Please provide the summary in clean, simple Markdown format. "
-                "DO NOT use standard paragraph separation (one empty line). "
-                "Avoid trailing spaces at the end of lines."
-            )
-        },
-        {"role": "user", "content": f"Please summarize the following text:\n\n{text}"}
-    ]
-
-
-def build_chat_messages(document_context: str, user_query: str) -> list[dict]:
-    """构建聊天请求的消息结构"""
-    prompt_template = (
-        "你是一个智能阅读助手。请根据以下提供的文档内容来回答用户的问题。\n\n"
-        "文档内容：\n{document_context}\n\n"
-        "用户问题：{user_query}\n\n"
-        "你主要的任务有3类，请严格遵守以下指南进行回答：\n"
-        "1. **核心任务**：仅基于提供的文档内容回答问题。如果文档内容不足，请明确指出你无法从文档中找到答案，同时根据你自己的知识库推导出答案。\n"
-        "2. **回答结构**：请采用“总-分”结构。首先给出一个足够充分并且简明扼要的总体描述或回答。然后，如果需要详细解释或列举多个要点（若有必要），请遵循下面的 Markdown 格式化指南。当用户询问技术细节时，你必须讲的足够详细，做到原文的意思直接传递给用户的程度，不要任何概括。\n"
-        "3. **翻译任务**：请根据用户选定的文本，直接给出简单易理解的翻译，若用户没有指定翻译后的语言，默认为汉语，且禁止使用markdown格式。\n"
-        "\n"
-        "--- Markdown 格式化核心指南 (请务必遵守，特别是关于标题和空行的规则) ---\n"
-        "A. **简洁至上**：请使用最简单、最直接的 Markdown 语法。避免任何不必要的复杂结构或花哨的格式。\n"
-        "B. **主要分点使用正确的标题格式 (非常重要！)**：\n"
-        "   * 如果回答包含多个主要方面或章节，请使用四级 Markdown 标题，格式为 `#### <可选数字>. <标题文本>` (例如：`#### 1. 第一个方面` 或 `#### 主要发现`)。标题标记 `####` 是必需的，标题文本前可以有数字和点，也可以没有。\n"
-        "   * **严格禁止使用任何形式的列表项 (如 `1. <内容>` 或 `- <内容>`) 作为主要分点的“标题”或替代标题。所有主要分点的起始都必须是 `####`。**\n"
-        "C. **次级列表的紧凑性**：\n"
-        "   * 在每个 `####` 标题之下，如果需要列举更细致的子要点，可以使用标准的无序列表 (以 `-` 或 `*` 开头) 或有序列表 (以 `1.`、`2.` 等开头)。\n"
-        "   * 列表项内容应紧跟在列表标记和空格之后。\n"
-        "   * **为了使列表显示更加紧凑，简单的、连续的列表项之间不应包含空行。** 只有当一个列表项自身包含多个段落或需要特别分隔的复杂内容时，才考虑在该列表项与其他列表项之间使用一个空行。\n"
-        "     正确的紧凑列表示例：\n"
-        "     - 要点一，这是对要点一的简短说明。\n"
-        "     - 要点二，这是对要点二的简短说明。\n"
-        "     应避免的格式（除非列表项本身是多段落的，一般情况下请避免）：\n"
-        "     - 要点一\n\n"
-        "     - 要点二\n"
-        "D. **段落与空行的精确控制 (非常重要！)**：\n"
-        "   * 不同主题的普通段落之间使用 **且仅使用一个** 空行分隔。\n"
-        "   * **从一个普通段落结束过渡到其紧随的 `####` 标题时，它们之间也只能有 **一个** 空行。** (例如： `...段落的末尾。\n\n#### 这是新标题`)\n"
-        "   * **`####` 标题行本身独占一行。在其之后，与下面的第一行正文或第一个列表项之间，也只应有 **一个** 空行。** (例如： `#### 这是标题\n\n这是正文第一句。` 或 `#### 这是标题\n\n- 这是列表项一`)\n"
-        "   * **严格避免在文档的任何地方产生连续的两个或更多不必要的空行。目标是保持文档结构清晰且最大限度地紧凑，同时保证可读性。**\n"
-        "   * **行尾绝对禁止出现任何尾随空格。**\n"
-        "E. **数学公式**：如果需要展示数学公式，请使用标准的 LaTeX 标记，例如行内公式 `\\( E=mc^2 \\)` 或块级公式 `\\[ \\sum_{{i=1}}^n i = \\frac{{n(n+1)}}{{2}} \\]`。\n"
-        "F. **避免的操作 (再次强调)**：\n"
-        "   * 不要在列表项标记（如 `1.` 或 `-`）和其后的文本内容之间插入不必要的换行。\n"
-        "   * 绝对不要将列表项（如 `1. 标题内容`）用作主要分点的标题，必须使用 `####`。\n"
-        "\n"
-        "--- 格式示例 (请严格学习并遵循此结构和空行规则) ---\n"
-        "这是总体性的回答概览，通常是一段文字。\n\n"
-        "#### 1. 第一个主要方面解释\n\n"
-        "这是关于第一个方面的详细说明段落。它可以包含一些行内公式，例如 \\( ax^2 + bx + c = 0 \\)。段落自然换行。\n"
-        "如果需要列举（列表项之间无额外空行）：\n"
-        "- 这是第一个次级要点。\n"
-        "- 这是第二个次级要点，它可能比较长，会自动换行。\n\n"
-        "#### 2. 第二个主要方面阐述\n\n"
-        "关于第二个方面的解释。如果包含多个步骤，可以使用有序列表（列表项之间无额外空行）：\n"
-        "1. 步骤一的描述。\n"
-        "2. 步骤二的描述。\n"
-        "  这里是步骤二的补充说明，它属于步骤二这个列表项，因此需要正确缩进。\n\n"
-        "如果涉及到公式块：\n"
-        "\\[\n"
-        "\\mathbf{{F}} = m\\mathbf{{a}}\n"
-        "\\]\n\n"
-        "公式后的解释文本，这是另一个段落。\n"
-        "\n"
-        "--- 回答结束 ---\n"
-        "请再次确认，你的回答必须完全遵循上述所有格式化指南，特别是关于 **`####` 标题的使用** 以及 **空行的精确控制（通常只有一个空行用于分隔，列表项之间无空行，避免连续多空行）**，以实现清晰、紧凑且易于前端正确渲染的 Markdown。"
+async def extract_pdf_text(file: UploadFile) -> ExtractionResult:
+    """
+    提取PDF文件文本内容 (上传先落盘为临时文件，大文档按页区间并行提取)。
+    结果按 PDF 字节的 SHA-256 写入磁盘缓存，重复上传同一文件时直接命中缓存。
+    """
+    with metrics.span("spool_upload"):
+        pdf_path, pdf_sha256 = await spool_upload(file)
+    try:
+        observe_upload_size(pdf_path)
+        return await extract_pdf_path(pdf_path, pdf_sha256)
+    finally:
+        os.remove(pdf_path)
+
+
+async def extract_pdf_path(pdf_path: str, pdf_sha256: str) -> ExtractionResult:
+    """提取磁盘上的 PDF；优先使用提取结果缓存"""
+    with metrics.span("extraction_cache"):
+        cached = await asyncio.to_thread(extraction_cache.get, pdf_sha256)
+    if cached is not None:
+        metrics.PDF_PAGES.inc(cached.page_count, cache="hit")
+        metrics.set_attribute("page_count", cached.page_count)
+        return cached
+    started = time.perf_counter()
+    extraction = await extract_pdf_file(pdf_path)
+    observe_extraction(extraction.page_count, started)
+    await asyncio.to_thread(extraction_cache.put, pdf_sha256, extraction)
+    return extraction
+
+
+def observe_upload_size(pdf_path: str) -> None:
+    size = os.path.getsize(pdf_path)
+    metrics.UPLOAD_BYTES.observe(size, endpoint=metrics.current_endpoint())
+    metrics.set_attribute("upload_bytes", size)
+
+
+def observe_extraction(page_count: int, started: float) -> None:
+    """记录一次 (未命中缓存的) 提取的耗时与页数/秒"""
+    elapsed = time.perf_counter() - started
+    metrics.record_stage("extract", started, elapsed)
+    metrics.PDF_PAGES.inc(page_count, cache="miss")
+    metrics.set_attribute("page_count", page_count)
+    if page_count and elapsed > 0:
+        metrics.PDF_PAGES_PER_SECOND.observe(page_count / elapsed)
+        metrics.set_attribute("pages_per_sec", round(page_count / elapsed, 1))
+
+
+async def resolve_document(text: Optional[str], doc_id: Optional[str]) -> StoredDocument:
+    """优先按 doc_id 从文档存储取文档，否则用请求中直接携带的文本构造一个临时文档 (不登记到存储)"""
+    if doc_id:
+        document = await asyncio.to_thread(document_store.get, doc_id)
+        if document is None:
+            raise HTTPException(404, detail="Document not found or expired. Please process the PDF again.")
+        return document
+    if text is None:
+        raise HTTPException(400, detail="Either doc_id or the document text must be provided.")
+    return StoredDocument(doc_id=await asyncio.to_thread(compute_doc_id, text), text=text)
+
+
+async def resolve_document_text(text: Optional[str], doc_id: Optional[str]) -> str:
+    """优先按 doc_id 从文档存储取全文，否则使用请求中直接携带的文本"""
+    return (await resolve_document(text, doc_id)).text
+
+
+async def resolve_chat_session(session_id: str) -> ChatSession:
+    session = await asyncio.to_thread(chat_session_store.get, session_id)
+    if session is None:
+        raise HTTPException(404, detail="Chat session not found or expired.")
+    return session
+
+
+def chat_session_response(session: ChatSession) -> ChatSessionResponse:
+    return ChatSessionResponse(
+        session_id=session.session_id,
+        doc_id=session.doc_id,
+        turn_count=session.turn_count,
+        history_turns=len(session.turns),
+        history_tokens=session.history_tokens(),
+        summary=session.summary,
+        compactions=session.compactions,
     )
-    full_prompt = prompt_template.format(
-        document_context=document_context,
-        user_query=user_query
+
+
+async def prepare_chat_context(request_data: ChatWithContextRequest) -> tuple[str, list[SourcePassage], Optional[str]]:
+    """
+    准备问答用的文档上下文。文档超过 token 预算时，只选取与问题最相关的片段 (BM25 检索)，
+    并返回这些片段的页码信息；否则直接使用全文。
+    第三个返回值为可复用的提示词前缀键：使用全文时为 doc_id，检索片段随问题变化，为 None。
+    """
+    document = await resolve_document(request_data.document_context, request_data.doc_id)
+    token_budget = request_data.context_token_budget or RETRIEVAL_TOKEN_BUDGET
+    if not request_data.use_retrieval or estimate_tokens(document.text) <= token_budget:
+        return document.text, [], document.doc_id
+
+    with metrics.span("retrieval"):
+        index = await asyncio.to_thread(
+            retrieval_index_cache.get_or_build, document.doc_id, document.text, document.page_offsets
+        )
+        results = index.search(request_data.user_query, top_k=request_data.top_k or RETRIEVAL_TOP_K,
+                               token_budget=token_budget)
+    sources = [SourcePassage(chunk_id=chunk.chunk_id, pages=chunk.pages, score=round(score, 4))
+               for chunk, score in results]
+    return format_passages(results), sources, None
+
+
+# --------------------------
+# 流式输出 (Server-Sent Events)
+# --------------------------
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # 防止反向代理缓冲 SSE
+}
+
+
+def sse_event(event: str, data: dict) -> str:
+    """格式化一条 SSE 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_completion_events(chunks, on_complete=None, on_finish=None):
+    """
+    将上游的流式 chunk 转换为 SSE 事件：
+    - reasoning: 推理过程增量 (deepseek-reasoner 的 reasoning_content)
+    - delta: 正文增量
+    - done: 结束事件，携带 usage 统计；on_complete(完整正文) 返回的字段会合并进来
+    - error: 流中途出错
+    流正常结束后会 await on_finish(完整正文, usage, finish_reason) (例如写入响应缓存)。
+    """
+    content_parts = []
+    usage = None
+    finish_reason = None
+    try:
+        async for chunk in chunks:
+            if chunk.usage:
+                usage = chunk.usage.model_dump(exclude_none=True)
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            reasoning = getattr(choice.delta, "reasoning_content", None)
+            if reasoning:
+                yield sse_event("reasoning", {"delta": reasoning})
+            if choice.delta.content:
+                content_parts.append(choice.delta.content)
+                yield sse_event("delta", {"delta": choice.delta.content})
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+    except Exception as e:
+        print(f"Streaming Error: {e}")
+        yield sse_event("error", {"detail": str(e)})
+        return
+
+    content = "".join(content_parts)
+    done_payload = {"usage": usage, "finish_reason": finish_reason}
+    if on_complete:
+        done_payload.update(on_complete(content))
+    yield sse_event("done", done_payload)
+    if on_finish:
+        await on_finish(content, usage, finish_reason)
+
+
+async def cached_completion_events(cached: CachedResponse, on_complete=None):
+    """以与 stream_completion_events 相同的事件格式一次性回放缓存的结果"""
+    yield sse_event("delta", {"delta": cached.content})
+    done_payload = {"usage": cached.usage, "finish_reason": "stop", "cached": True}
+    if on_complete:
+        done_payload.update(on_complete(cached.content))
+    yield sse_event("done", done_payload)
+
+
+async def open_completion_stream(client: AsyncDeepSeekClient, messages: list[dict], on_complete=None,
+                                 on_finish=None, cached: Optional[CachedResponse] = None,
+                                 **kwargs) -> StreamingResponse:
+    """
+    发起流式请求并包装为 SSE 响应；连接阶段的错误会在返回响应前抛出，从而得到正常的 HTTP 状态码。
+    传入 cached 时不请求上游，直接回放缓存结果。
+    """
+    if cached is not None:
+        return StreamingResponse(
+            cached_completion_events(cached, on_complete),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+    chunks = await client.get_chat_completion(
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs
     )
+    return StreamingResponse(
+        stream_completion_events(chunks, on_complete, on_finish),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
 
-    return [
-        {"role": "system",
-         "content": "你是一个乐于助人的AI助手，专注于根据用户提供的上下文回答问题，并严格遵守用户指定的 Markdown 格式化输出指南。"},
-        {"role": "user", "content": full_prompt}
-    ]
+# --------------------------
+# 分层 (map-reduce) 摘要
+# --------------------------
+SUMMARY_MAP_REDUCE_KIND = "summary_map_reduce"
+
+
+def summary_cache_kind(text: str, mode: str) -> str:
+    """单次摘要与分层摘要的结果不同，分别缓存"""
+    return SUMMARY_MAP_REDUCE_KIND if should_use_map_reduce(text, mode) else "summary"
+
+
+def summary_cache_key(cache_kind: str, document: StoredDocument) -> str:
+    """
+    按 doc_id 与提示词模板 (不含正文) 计算缓存键，不在事件循环中哈希全文；
+    分层摘要的结果还取决于分块与合并参数，这些参数也计入缓存键
+    """
+    options = map_reduce_config() if cache_kind == SUMMARY_MAP_REDUCE_KIND else None
+    return make_cache_key(cache_kind, SUMMARY_MODEL, build_summarize_messages(""), options=options,
+                          doc_id=document.doc_id)
+
+
+async def map_reduce_summary_events(client: AsyncDeepSeekClient, document: StoredDocument, on_finish=None):
+    """分层摘要的 SSE 事件流：先推送 map/reduce 各阶段的 progress 事件，再流式输出最终摘要"""
+    summarizer = HierarchicalSummarizer(client)
+    queue: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(summarizer.summarize_parts(document.text, document.page_offsets, on_progress=queue.put))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while (event := await queue.get()) is not None:
+            yield sse_event("progress", event)
+        final_messages = build_summarize_messages(join_partial_summaries(task.result()))
+        chunks = await client.get_chat_completion(
+            messages=final_messages,
+            model=SUMMARY_MODEL,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+    except Exception as e:
+        print(f"Map-Reduce Summarization Error: {e}")
+        yield sse_event("error", {"detail": str(e)})
+        return
+    finally:
+        task.cancel()  # 客户端提前断开时取消尚未完成的分块请求
+
+    async for event in stream_completion_events(
+            chunks,
+            on_complete=lambda content: {"summary": content.strip(), "intermediate_usage": summarizer.usage},
+            on_finish=on_finish):
+        yield event
+
+
+async def generate_summary(client: AsyncDeepSeekClient, document: StoredDocument, mode: str = "auto",
+                           bypass_cache: bool = False) -> SummaryResponse:
+    """非流式摘要 (带响应缓存)，摘要接口与批量任务共用"""
+    messages = build_summarize_messages(document.text, doc_key=document.doc_id)
+    cache_kind = summary_cache_kind(document.text, mode)
+    cache_key = summary_cache_key(cache_kind, document)
+    cached = await lookup_cached_response(cache_key, bypass_cache)
+    if cached is not None:
+        return SummaryResponse(summary=cached.content.strip(), cached=True)
+
+    if cache_kind == SUMMARY_MAP_REDUCE_KIND:
+        partial_summaries = await HierarchicalSummarizer(client).summarize_parts(
+            document.text, document.page_offsets
+        )
+        messages = build_summarize_messages(join_partial_summaries(partial_summaries))
+    response = await client.get_chat_completion(messages=messages, model=SUMMARY_MODEL)
+
+    if response.choices and response.choices[0].message.content:
+        content = response.choices[0].message.content
+        await store_cached_response(
+            cache_key, cache_kind, SUMMARY_MODEL, content,
+            response.usage.model_dump(exclude_none=True) if response.usage else None,
+            response.choices[0].finish_reason
+        )
+        return SummaryResponse(summary=content.strip())
+
+    raise HTTPException(500, detail="Failed to get summary from AI")
+
+
+# --------------------------
+# 思维导图
+# --------------------------
+SECTIONED_MINDMAP_KIND = "mindmap_sections"
+
+
+def mindmap_cache_key(document: StoredDocument, output_format: str) -> str:
+    """与摘要相同，按 doc_id 与提示词模板计算缓存键"""
+    return make_cache_key("mindmap", MINDMAP_MODEL, build_mindmap_messages("", output_format), output_format,
+                          doc_id=document.doc_id)
+
+
+def sectioned_mindmap_cache_key(document: StoredDocument, output_format: str) -> str:
+    return make_cache_key(SECTIONED_MINDMAP_KIND, MINDMAP_SECTION_MODEL, build_mindmap_messages("", output_format),
+                          output_format, options=section_config(), doc_id=document.doc_id)
+
+
+async def build_sectioned_mindmap(client: AsyncDeepSeekClient, document: StoredDocument, output_format: str,
+                                  on_progress=None) -> tuple[str, SectionMindmapBuilder]:
+    builder = SectionMindmapBuilder(client)
+    tree = await builder.build(document.text, document.page_offsets, output_format,
+                               title=document_title(document.text, fallback=document.filename or "文档"),
+                               on_progress=on_progress)
+    return render_mindmap(tree, output_format), builder
+
+
+async def sectioned_mindmap_events(client: AsyncDeepSeekClient, document: StoredDocument, output_format: str,
+                                   on_finish=None):
+    """分章节思维导图的 SSE 事件流：每完成一个章节推送 progress 事件，最后在 done 事件中返回合并后的结果"""
+    queue: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(build_sectioned_mindmap(client, document, output_format, on_progress=queue.put))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while (event := await queue.get()) is not None:
+            yield sse_event("progress", event)
+        content, builder = task.result()
+    except Exception as e:
+        print(f"Sectioned Mindmap Error: {e}")
+        yield sse_event("error", {"detail": str(e)})
+        return
+    finally:
+        task.cancel()  # 客户端提前断开时取消尚未完成的章节请求
+
+    finish_reason = "length" if builder.failed_sections else "stop"  # 有章节失败时不写入缓存
+    yield sse_event("done", {"usage": builder.usage, "finish_reason": finish_reason, "mindmap_data": content,
+                             "format_used": output_format, "failed_sections": builder.failed_sections})
+    if on_finish:
+        await on_finish(content, builder.usage, finish_reason)
+
+
+async def generate_mindmap(client: AsyncDeepSeekClient, document: StoredDocument, output_format: str,
+                           bypass_cache: bool = False, mode: str = "single") -> MindmapResponse:
+    """非流式思维导图 (带响应缓存)，思维导图接口与批量任务共用"""
+    if mode == "sections":
+        cache_key = sectioned_mindmap_cache_key(document, output_format)
+        cached = await lookup_cached_response(cache_key, bypass_cache)
+        if cached is not None:
+            return MindmapResponse(mindmap_data=cached.content, format_used=output_format, cached=True)
+        content, builder = await build_sectioned_mindmap(client, document, output_format)
+        await store_cached_response(cache_key, SECTIONED_MINDMAP_KIND, MINDMAP_SECTION_MODEL, content, builder.usage,
+                                    "length" if builder.failed_sections else "stop")
+        return MindmapResponse(mindmap_data=content, format_used=output_format,
+                               failed_sections=builder.failed_sections)
+
+    messages = build_mindmap_messages(document.text, output_format, doc_key=document.doc_id)
+    cache_key = mindmap_cache_key(document, output_format)
+    cached = await lookup_cached_response(cache_key, bypass_cache)
+    if cached is not None:
+        return MindmapResponse(
+            mindmap_data=clean_mindmap_output(cached.content, output_format),
+            format_used=output_format,
+            cached=True,
+        )
+
+    ai_response = await client.get_chat_completion(messages=messages, model=MINDMAP_MODEL)
+
+    if ai_response.choices and ai_response.choices[0].message and ai_response.choices[0].message.content:
+        content = ai_response.choices[0].message.content
+        mindmap_data_str = clean_mindmap_output(content, output_format)
+        await store_cached_response(
+            cache_key, "mindmap", MINDMAP_MODEL, content,
+            ai_response.usage.model_dump(exclude_none=True) if ai_response.usage else None,
+            ai_response.choices[0].finish_reason
+        )
+    else:
+        print("----------- LLM Response did not contain expected content -----------")
+        if ai_response.choices and ai_response.choices[0].finish_reason:
+            print(f"LLM Finish Reason: {ai_response.choices[0].finish_reason}")
+        raise HTTPException(status_code=500, detail="AI未能生成思维导图数据")
+
+    return MindmapResponse(mindmap_data=mindmap_data_str, format_used=output_format)
+
+
+# --------------------------
+# 批量导入任务
+# --------------------------
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def process_batch_item(item: dict, options: dict, api_key: Optional[str], on_stage) -> dict:
+    """
+    批量任务中单个文件的处理流程：提取 (命中提取缓存时跳过) → 登记到文档存储 → 可选的摘要与思维导图。
+    摘要与思维导图写入响应缓存，之后以 doc_id 调用对应接口会直接命中缓存。
+    """
+    await on_stage("extracting")
+    pdf_sha256 = await asyncio.to_thread(sha256_file, item["path"])
+    extraction = await extract_pdf_path(item["path"], pdf_sha256)
+    if not extraction.text:
+        raise ValueError("No text could be extracted from the PDF.")
+    document = await asyncio.to_thread(document_store.add, extraction.text, filename=item["filename"],
+                                       page_offsets=extraction.page_offsets)
+
+    result = {}
+    if options.get("summarize") or options.get("mindmap"):
+        # 批量任务以后台优先级排队，不影响交互式请求
+        client = AsyncDeepSeekClient(api_key=api_key, priority=Priority.BACKGROUND)
+        if options.get("summarize"):
+            await on_stage("summarizing")
+            summary = await generate_summary(client, document, options.get("summary_mode", "auto"))
+            result["summary"] = summary.summary
+        if options.get("mindmap"):
+            await on_stage("mindmap")
+            output_format = options.get("mindmap_format", "json").lower()
+            mindmap = await generate_mindmap(client, document, output_format,
+                                             mode=options.get("mindmap_mode", "single"))
+            result["mindmap_data"] = mindmap.mindmap_data
+            result["mindmap_format"] = output_format
+    return {"doc_id": document.doc_id, "page_count": extraction.page_count, "result": result}
+
+
+# --------------------------
+# 上游错误映射
+# --------------------------
+def raise_for_upstream_error(error: Exception) -> None:
+    """
+    把调度器与上游模型服务的错误转换为对应的 HTTP 状态码 (503/429/502/504)，
+    已经是 HTTPException 的原样抛出；其余错误返回，由调用方按 500 处理。
+    """
+    if isinstance(error, HTTPException):
+        raise error
+    if isinstance(error, SchedulerOverloaded):
+        raise HTTPException(503, detail=f"服务繁忙，请稍后重试: {error}",
+                            headers={"Retry-After": str(error.retry_after)})
+    if isinstance(error, DeadlineExceeded):
+        raise HTTPException(504, detail="请求超过截止时间 (X-Request-Timeout)")
+    import openai  # 启动时不导入 openai；上游错误出现时它必然已经导入
+
+    if isinstance(error, openai.APIStatusError) and error.status_code == 429:
+        raise HTTPException(429, detail="上游模型服务限流，请稍后重试",
+                            headers={"Retry-After": error.response.headers.get("retry-after", "5")})
+    if isinstance(error, openai.APIStatusError) and error.status_code >= 500:
+        raise HTTPException(502, detail=f"上游模型服务暂时不可用 (HTTP {error.status_code})")
+    if isinstance(error, openai.APITimeoutError):
+        raise HTTPException(504, detail="上游模型服务响应超时")
+    if isinstance(error, openai.APIConnectionError):
+        raise HTTPException(502, detail="无法连接上游模型服务")
+
+
+# --------------------------
+# LLM 响应缓存
+# --------------------------
+async def lookup_cached_response(cache_key: str, bypass_cache: bool) -> Optional[CachedResponse]:
+    """查询响应缓存；缓存故障不影响请求本身"""
+    if bypass_cache:
+        return None
+    try:
+        return await asyncio.to_thread(response_cache.get, cache_key)
+    except Exception as e:
+        print(f"Warning: response cache lookup failed: {e}")
+        return None
+
+
+async def store_cached_response(cache_key: str, kind: str, model: str, content: str,
+                                usage: Optional[dict], finish_reason: Optional[str]) -> None:
+    """只缓存正常结束 (finish_reason 为 stop) 的完整结果，被截断的输出不写入缓存"""
+    if not content or finish_reason != "stop":
+        return
+    try:
+        await asyncio.to_thread(response_cache.put, cache_key, kind, model, content, usage)
+    except Exception as e:
+        print(f"Warning: response cache write failed: {e}")
 
 
 # --------------------------
@@ -174,18 +692,29 @@ async def root():
     return {"message": "Welcome to DeepRead AI Backend!"}
 
 
+@app.get("/healthz")
+async def healthz():
+    """就绪探针：uvicorn 在 lifespan 启动完成后才处理请求，能响应即表示已就绪 (Electron 启动时轮询)"""
+    return {"status": "ok"}
+
+
 @app.post("/api/pdf/extract-text")
-async def extract_text_from_pdf(file: UploadFile = File(...)):
+async def extract_text_from_pdf(
+        file: UploadFile = File(...),
+        include_text: bool = Query(True, description="为 False 时只返回 doc_id，不回传全文")
+):
     """
     接收PDF文件，提取文本内容
     - 只接受PDF文件
+    - 提取结果登记到文档存储，返回 doc_id，后续 LLM 请求只需携带 doc_id
     - 返回提取的文本或错误信息
     """
     if file.content_type != "application/pdf":
         raise HTTPException(400, detail="Invalid file type. Only PDF files are accepted.")
 
     try:
-        extracted_text = await extract_pdf_text(file)
+        extraction = await extract_pdf_text(file)
+        extracted_text = extraction.text
 
         if not extracted_text:
             return {
@@ -194,9 +723,14 @@ async def extract_text_from_pdf(file: UploadFile = File(...)):
                 "message": "No text could be extracted from the PDF."
             }
 
+        document = await asyncio.to_thread(document_store.add, extracted_text, filename=file.filename,
+                                           page_offsets=extraction.page_offsets)
         return {
             "filename": file.filename,
-            "extracted_text": extracted_text
+            "doc_id": document.doc_id,
+            "page_count": extraction.page_count,
+            "char_count": len(extracted_text),
+            "extracted_text": extracted_text if include_text else None
         }
     except Exception as e:
         print(f"Error processing PDF {file.filename}: {e}")
@@ -205,27 +739,285 @@ async def extract_text_from_pdf(file: UploadFile = File(...)):
         await file.close()
 
 
+@app.post("/api/pdf/extract-text/stream")
+async def extract_text_from_pdf_stream(file: UploadFile = File(...)):
+    """
+    流式提取 PDF 文本 (SSE)：每提取完一页按顺序推送 page 事件 (含进度)，
+    最后的 done 事件携带 doc_id 等信息，与 /api/pdf/extract-text 的返回一致 (不含全文)。
+    """
+    if file.content_type != "application/pdf":
+        raise HTTPException(400, detail="Invalid file type. Only PDF files are accepted.")
+
+    try:
+        with metrics.span("spool_upload"):
+            pdf_path, pdf_sha256 = await spool_upload(file)
+    finally:
+        await file.close()
+    observe_upload_size(pdf_path)
+
+    async def event_generator():
+        try:
+            extraction = await asyncio.to_thread(extraction_cache.get, pdf_sha256)
+            if extraction is not None:
+                metrics.PDF_PAGES.inc(extraction.page_count, cache="hit")
+                for page_index in range(extraction.page_count):
+                    yield sse_event("page", {
+                        "page_number": page_index + 1,
+                        "page_count": extraction.page_count,
+                        "text": page_text(extraction.text, extraction.page_offsets, page_index),
+                    })
+            else:
+                pages = []
+                started = time.perf_counter()
+                async for page_index, page_count, text in iter_pdf_pages(pdf_path):
+                    pages.append(text)
+                    yield sse_event("page", {"page_number": page_index + 1, "page_count": page_count, "text": text})
+                observe_extraction(len(pages), started)
+                extraction = join_pages(pages)
+                await asyncio.to_thread(extraction_cache.put, pdf_sha256, extraction)
+
+            done_payload = {"filename": file.filename, "page_count": extraction.page_count,
+                            "char_count": len(extraction.text), "doc_id": None}
+            if extraction.text:
+                document = await asyncio.to_thread(document_store.add, extraction.text, filename=file.filename,
+                                                   page_offsets=extraction.page_offsets)
+                done_payload["doc_id"] = document.doc_id
+            else:
+                done_payload["message"] = "No text could be extracted from the PDF."
+            yield sse_event("done", done_payload)
+        except Exception as e:
+            print(f"Error processing PDF {file.filename}: {e}")
+            yield sse_event("error", {"detail": f"Error processing PDF: {str(e)}"})
+        finally:
+            os.remove(pdf_path)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.get("/api/cache/extraction")
+async def get_extraction_cache_stats():
+    """查看 PDF 提取缓存的条目数、占用空间与命中率"""
+    return await asyncio.to_thread(extraction_cache.stats)
+
+
+@app.delete("/api/cache/extraction")
+async def purge_extraction_cache():
+    """清空 PDF 提取缓存"""
+    removed = await asyncio.to_thread(extraction_cache.purge)
+    return {"removed_entries": removed}
+
+
+@app.get("/api/cache/responses")
+async def get_response_cache_stats():
+    """查看摘要/思维导图响应缓存的统计信息"""
+    return await asyncio.to_thread(response_cache.stats)
+
+
+@app.delete("/api/cache/responses")
+async def purge_response_cache():
+    """清空摘要/思维导图响应缓存"""
+    removed = await asyncio.to_thread(response_cache.purge)
+    return {"removed_entries": removed}
+
+
+def collect_runtime_metrics() -> list[str]:
+    """导出时读取各缓存、调度器与请求合并器的当前状态"""
+    store = document_store.stats()
+    scheduler_stats = request_scheduler.stats()
+    lines = []
+    lines += metrics.gauge_lines("deepread_documents", "Documents held in the document store", store["documents"])
+    lines += metrics.gauge_lines("deepread_document_store_bytes", "Bytes held in the document store",
+                                 store["total_bytes"])
+    lines += metrics.gauge_lines("deepread_response_cache_hits", "Response cache hits since start", response_cache.hits)
+    lines += metrics.gauge_lines("deepread_response_cache_misses", "Response cache misses since start",
+                                 response_cache.misses)
+    lines += metrics.gauge_lines("deepread_extraction_cache_hits", "Extraction cache hits since start",
+                                 extraction_cache.hits)
+    lines += metrics.gauge_lines("deepread_extraction_cache_misses", "Extraction cache misses since start",
+                                 extraction_cache.misses)
+    lines += metrics.gauge_lines("deepread_llm_coalesced_calls", "Upstream calls saved by request coalescing",
+                                 single_flight.stats()["saved_calls"])
+    lines += metrics.gauge_lines("deepread_llm_active_requests", "Upstream requests holding a scheduler slot",
+                                 scheduler_stats["active"])
+    lines += metrics.gauge_lines("deepread_llm_rejected_requests", "Requests rejected by the scheduler",
+                                 scheduler_stats["rejected"])
+    lines += metrics.labeled_gauge_lines("deepread_llm_queued_requests", "Requests waiting in the scheduler",
+                                         "priority", scheduler_stats["queued"])
+    lines += metrics.labeled_gauge_lines("deepread_startup_seconds", "Seconds from backend import to each startup phase",
+                                         "phase", startup_timer.phases)
+    return lines
+
+
+metrics.registry.collectors.append(collect_runtime_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus 文本格式的指标"""
+    # 导出时会读取共享 SQLite 中的文档统计，放到线程中执行
+    return PlainTextResponse(await asyncio.to_thread(metrics.registry.render), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/stats/usage")
+async def get_usage_stats():
+    """查看各模型累计的 token 用量与 DeepSeek 上下文缓存 (提示词前缀) 命中率"""
+    return usage_stats.snapshot()
+
+
+@app.get("/api/stats/startup")
+async def get_startup_stats():
+    """启动各阶段耗时 (导入、就绪、第一个请求)，用于跟踪桌面版的冷启动时间"""
+    return startup_timer.snapshot()
+
+
+@app.get("/api/stats/coalescing")
+async def get_coalescing_stats():
+    """查看相同并发请求的合并情况 (saved_calls 为省下的上游调用数)"""
+    return single_flight.stats()
+
+
+@app.get("/api/stats/cancellations")
+async def get_cancellation_stats():
+    """查看因客户端断开而取消 (cancelled) 与超过截止时间 (timed_out) 的请求数"""
+    return abort_stats.snapshot()
+
+
+@app.get("/api/stats/scheduler")
+async def get_scheduler_stats():
+    """查看上游请求调度器的状态 (进行中/排队的请求数、被拒绝与重试的次数)"""
+    return request_scheduler.stats()
+
+
+@app.delete("/api/stats/usage")
+async def reset_usage_stats():
+    """清零用量统计"""
+    usage_stats.reset()
+    return {"reset": True}
+
+
+def document_etag(document: StoredDocument, *parts) -> str:
+    """doc_id 本身就是文本的内容哈希，再加上文件名与页码等即可唯一确定响应内容"""
+    key = "\x00".join(str(part) for part in (document.doc_id, document.filename or "", *parts))
+    return '"' + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def conditional_response(response: Response, etag: str, if_none_match: Optional[str]) -> Optional[Response]:
+    """客户端缓存仍有效时返回 304 (不再重复传输全文)，否则在响应上设置 ETag"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}  # no-cache: 可缓存但每次使用前需重新验证
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+@app.get("/api/documents/{doc_id}", response_model=DocumentResponse)
+async def get_document(doc_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    """按 doc_id 获取已登记文档的全文 (支持 If-None-Match 条件请求)"""
+    document = await asyncio.to_thread(document_store.get, doc_id)
+    if document is None:
+        raise HTTPException(404, detail="Document not found or expired.")
+    not_modified = conditional_response(response, document_etag(document), if_none_match)
+    if not_modified is not None:
+        return not_modified
+    return DocumentResponse(
+        doc_id=document.doc_id,
+        filename=document.filename,
+        char_count=len(document.text),
+        page_count=len(document.page_offsets),
+        text=document.text,
+    )
+
+
+@app.get("/api/documents/{doc_id}/pages/{page_number}", response_model=PageTextResponse)
+async def get_document_page(
+    doc_id: str, page_number: int, response: Response, if_none_match: Optional[str] = Header(None)
+):
+    """按页码 (从 1 开始) 获取文档某一页的文本 (支持 If-None-Match 条件请求)"""
+    document = await asyncio.to_thread(document_store.get, doc_id)
+    if document is None:
+        raise HTTPException(404, detail="Document not found or expired.")
+    page_count = len(document.page_offsets)
+    if not 1 <= page_number <= page_count:
+        raise HTTPException(404, detail=f"Page {page_number} out of range (1-{page_count}).")
+    not_modified = conditional_response(response, document_etag(document, "page", page_number), if_none_match)
+    if not_modified is not None:
+        return not_modified
+    return PageTextResponse(
+        doc_id=document.doc_id,
+        page_number=page_number,
+        page_count=page_count,
+        text=page_text(document.text, document.page_offsets, page_number - 1),
+    )
+
+
+@app.delete("/api/documents/{doc_id}")
+async def delete_document(doc_id: str):
+    """从文档存储中移除文档"""
+    if not await asyncio.to_thread(document_store.remove, doc_id):
+        raise HTTPException(404, detail="Document not found or expired.")
+    retrieval_index_cache.discard(doc_id)
+    prompt_prefix_cache.discard_document(doc_id)
+    await asyncio.to_thread(chat_session_store.remove_document, doc_id)
+    return {"doc_id": doc_id, "deleted": True}
+
+
 @app.post("/api/llm/summarize", response_model=SummaryResponse)
 async def summarize_text(
         request_data: TextRequest,
         x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")
 ):
-    """接收文本并返回AI生成的摘要"""
+    """接收文本 (或 doc_id) 并返回AI生成的摘要；长文档可使用分层 (map-reduce) 摘要"""
+    document = await resolve_document(request_data.text, request_data.doc_id)
     try:
-        # 如果 x_user_api_key 存在，则使用它，否则 DeepSeekClient 会尝试使用环境变量
-        client = DeepSeekClient(api_key=x_user_api_key)
-        messages = build_summarize_messages(request_data.text)
-        response = client.get_chat_completion(messages=messages)
+        # 如果 x_user_api_key 存在，则使用它，否则 AsyncDeepSeekClient 会尝试使用环境变量
+        client = AsyncDeepSeekClient(api_key=x_user_api_key, priority=Priority.SUMMARY)
+        return await generate_summary(client, document, request_data.mode, request_data.bypass_cache)
+    except ValueError as ve:  # AsyncDeepSeekClient 在 API Key 未找到时可能抛出 ValueError
+        print(f"API Key or Client Initialization Error: {ve}")
+        raise HTTPException(400, detail=str(ve))
+    except Exception as e:
+        raise_for_upstream_error(e)
+        print(f"Summarization Error: {e}")
+        raise HTTPException(500, detail="An error occurred while generating the summary.")
 
-        if response.choices and response.choices[0].message.content:
-            return SummaryResponse(summary=response.choices[0].message.content.strip())
 
-        raise HTTPException(500, detail="Failed to get summary from AI")
-    except ValueError as ve:  # DeepSeekClient 在 API Key 未找到时可能抛出 ValueError
+@app.post("/api/llm/summarize/stream")
+async def summarize_text_stream(
+        request_data: TextRequest,
+        x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")
+):
+    """
+    流式返回 AI 摘要 (SSE)，事件格式见 stream_completion_events。
+    分层摘要模式下，最终摘要开始前会先推送 progress 事件 (各分块的完成进度与部分摘要)。
+    """
+    document = await resolve_document(request_data.text, request_data.doc_id)
+    try:
+        client = AsyncDeepSeekClient(api_key=x_user_api_key, priority=Priority.SUMMARY)
+        messages = build_summarize_messages(document.text, doc_key=document.doc_id)
+        cache_kind = summary_cache_kind(document.text, request_data.mode)
+        cache_key = summary_cache_key(cache_kind, document)
+        cached = await lookup_cached_response(cache_key, request_data.bypass_cache)
+        on_finish = functools.partial(store_cached_response, cache_key, cache_kind, SUMMARY_MODEL)
+
+        if cached is None and cache_kind == SUMMARY_MAP_REDUCE_KIND:
+            return StreamingResponse(
+                map_reduce_summary_events(client, document, on_finish),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS,
+            )
+        return await open_completion_stream(
+            client, messages,
+            on_complete=lambda content: {"summary": content.strip()},
+            on_finish=on_finish,
+            cached=cached,
+            model=SUMMARY_MODEL
+        )
+    except ValueError as ve:
         print(f"API Key or Client Initialization Error: {ve}")
         raise HTTPException(400, detail=str(ve))
     except Exception as e:
-        print(f"Summarization Error: {e}")
+        raise_for_upstream_error(e)
+        print(f"Summarization Stream Error: {e}")
         raise HTTPException(500, detail="An error occurred while generating the summary.")
 
 
@@ -234,23 +1026,27 @@ async def chat_with_document_context(
         request_data: ChatWithContextRequest,
         x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")  # 新增 API Key Header
 ):
-    """基于文档上下文回答用户问题"""
+    """基于文档上下文 (或 doc_id) 回答用户问题"""
+    document_context, sources, prefix_key = await prepare_chat_context(request_data)
     try:
-        client = DeepSeekClient(api_key=x_user_api_key)
+        client = AsyncDeepSeekClient(api_key=x_user_api_key, priority=Priority.CHAT)
         messages = build_chat_messages(
-            request_data.document_context,
-            request_data.user_query
+            document_context,
+            request_data.user_query,
+            cite_pages=bool(sources),
+            doc_key=prefix_key
         )
-        response = client.get_chat_completion(messages=messages, model="deepseek-chat")
+        response = await client.get_chat_completion(messages=messages, model=CHAT_MODEL)
 
         if response.choices and response.choices[0].message.content:
-            return ChatResponse(ai_response=response.choices[0].message.content.strip())
+            return ChatResponse(ai_response=response.choices[0].message.content.strip(), sources=sources)
 
         raise HTTPException(500, detail="AI未能生成有效回复")
     except ValueError as ve:
         print(f"API Key or Client Initialization Error for Chat: {ve}")
         raise HTTPException(400, detail=str(ve))
     except Exception as e:
+        raise_for_upstream_error(e)
         print(f"Chat with Context Error: {e}")
         # from openai import AuthenticationError
         # if isinstance(e, AuthenticationError):
@@ -258,121 +1054,187 @@ async def chat_with_document_context(
         raise HTTPException(500, detail=f"处理聊天请求时发生错误: {str(e)}")
 
 
+@app.post("/api/llm/chat_with_context/stream")
+async def chat_with_document_context_stream(
+        request_data: ChatWithContextRequest,
+        x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")
+):
+    """流式版本的上下文问答 (SSE)，done 事件中的 sources 为所用片段的页码信息"""
+    document_context, sources, prefix_key = await prepare_chat_context(request_data)
+    try:
+        client = AsyncDeepSeekClient(api_key=x_user_api_key, priority=Priority.CHAT)
+        messages = build_chat_messages(
+            document_context,
+            request_data.user_query,
+            cite_pages=bool(sources),
+            doc_key=prefix_key
+        )
+        return await open_completion_stream(
+            client, messages,
+            on_complete=lambda content: {
+                "ai_response": content.strip(),
+                "sources": [source.model_dump() for source in sources],
+            },
+            model=CHAT_MODEL
+        )
+    except ValueError as ve:
+        print(f"API Key or Client Initialization Error for Chat: {ve}")
+        raise HTTPException(400, detail=str(ve))
+    except Exception as e:
+        raise_for_upstream_error(e)
+        print(f"Chat with Context Stream Error: {e}")
+        raise HTTPException(500, detail=f"处理聊天请求时发生错误: {str(e)}")
+
+
+@app.post("/api/llm/translate", response_model=TranslateResponse)
+async def translate_selection(
+        request_data: TranslateRequest,
+        x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")
+):
+    """
+    翻译选中的文本：只发送原文和一句翻译指令 (不带文档全文与 Markdown 规则)，
+    多段文本合并为尽量少的请求，译文按 (原文, 目标语言) 持久化缓存。
+    """
+    if sum(len(text) for text in request_data.texts) > TRANSLATE_MAX_CHARS:
+        raise HTTPException(413, detail=f"待翻译文本过长 (上限 {TRANSLATE_MAX_CHARS} 字符)")
+    try:
+        client = AsyncDeepSeekClient(api_key=x_user_api_key, priority=Priority.CHAT)
+        target_lang = request_data.target_lang.strip() or TRANSLATE_DEFAULT_LANG
+        translations, cached = await Translator(client, TRANSLATE_MODEL).translate(
+            request_data.texts, target_lang, request_data.bypass_cache
+        )
+        return TranslateResponse(translations=translations, target_lang=target_lang, cached=cached)
+    except ValueError as ve:
+        print(f"API Key or Client Initialization Error for Translation: {ve}")
+        raise HTTPException(400, detail=str(ve))
+    except Exception as e:
+        raise_for_upstream_error(e)
+        print(f"Translation Error: {e}")
+        raise HTTPException(500, detail=f"翻译时发生错误: {str(e)}")
+
+
+@app.post("/api/chat/sessions", response_model=ChatSessionResponse)
+async def create_chat_session(request_data: ChatSessionCreateRequest):
+    """为已登记的文档创建多轮对话会话"""
+    if await asyncio.to_thread(document_store.get, request_data.doc_id) is None:
+        raise HTTPException(404, detail="Document not found or expired. Please process the PDF again.")
+    return chat_session_response(await asyncio.to_thread(chat_session_store.create, request_data.doc_id))
+
+
+@app.get("/api/chat/sessions/{session_id}", response_model=ChatSessionResponse)
+async def get_chat_session(session_id: str):
+    return chat_session_response(await resolve_chat_session(session_id))
+
+
+@app.delete("/api/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    if not await asyncio.to_thread(chat_session_store.remove, session_id):
+        raise HTTPException(404, detail="Chat session not found or expired.")
+    return {"session_id": session_id, "deleted": True}
+
+
+async def prepare_session_messages(session: ChatSession, request_data: ChatSessionMessageRequest):
+    """按会话的文档与历史构建本轮消息：文档前缀 + 滚动摘要 + 最近的原文轮次 + 新问题"""
+    document_context, sources, prefix_key = await prepare_chat_context(ChatWithContextRequest(
+        user_query=request_data.user_query,
+        doc_id=session.doc_id,
+        use_retrieval=request_data.use_retrieval,
+        top_k=request_data.top_k,
+        context_token_budget=request_data.context_token_budget,
+    ))
+    messages = build_chat_messages(
+        document_context,
+        request_data.user_query,
+        cite_pages=bool(sources),
+        doc_key=prefix_key,
+        history=history_messages(session)
+    )
+    return messages, sources
+
+
+@app.post("/api/chat/sessions/{session_id}/messages", response_model=ChatSessionReply)
+async def send_chat_session_message(
+        session_id: str,
+        request_data: ChatSessionMessageRequest,
+        x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")
+):
+    """在会话中提问；历史超过 token 预算时，较早的轮次会在后台压缩为滚动摘要"""
+    session = await resolve_chat_session(session_id)
+    messages, sources = await prepare_session_messages(session, request_data)
+    try:
+        client = AsyncDeepSeekClient(api_key=x_user_api_key, priority=Priority.CHAT)
+        response = await client.get_chat_completion(messages=messages, model=CHAT_MODEL)
+    except ValueError as ve:
+        print(f"API Key or Client Initialization Error for Chat: {ve}")
+        raise HTTPException(400, detail=str(ve))
+    except Exception as e:
+        raise_for_upstream_error(e)
+        print(f"Chat Session Error: {e}")
+        raise HTTPException(500, detail=f"处理聊天请求时发生错误: {str(e)}")
+
+    if not response.choices or not response.choices[0].message.content:
+        raise HTTPException(500, detail="AI未能生成有效回复")
+    ai_response = response.choices[0].message.content.strip()
+    await asyncio.to_thread(chat_session_store.add_turn, session, request_data.user_query, ai_response)
+    schedule_compaction(session, client)
+    return ChatSessionReply(ai_response=ai_response, sources=sources, session_id=session.session_id,
+                            turn_count=session.turn_count)
+
+
+@app.post("/api/chat/sessions/{session_id}/messages/stream")
+async def send_chat_session_message_stream(
+        session_id: str,
+        request_data: ChatSessionMessageRequest,
+        x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")
+):
+    """流式版本的会话提问 (SSE)；回答完整结束后才写入会话历史"""
+    session = await resolve_chat_session(session_id)
+    messages, sources = await prepare_session_messages(session, request_data)
+    try:
+        client = AsyncDeepSeekClient(api_key=x_user_api_key, priority=Priority.CHAT)
+
+        async def on_finish(content: str, usage: Optional[dict], finish_reason: Optional[str]) -> None:
+            if content.strip():
+                await asyncio.to_thread(chat_session_store.add_turn, session, request_data.user_query,
+                                        content.strip())
+                schedule_compaction(session, client)
+
+        return await open_completion_stream(
+            client, messages,
+            on_complete=lambda content: {
+                "ai_response": content.strip(),
+                "sources": [source.model_dump() for source in sources],
+                "session_id": session.session_id,
+                "turn_count": session.turn_count + 1,
+            },
+            on_finish=on_finish,
+            model=CHAT_MODEL
+        )
+    except ValueError as ve:
+        print(f"API Key or Client Initialization Error for Chat: {ve}")
+        raise HTTPException(400, detail=str(ve))
+    except Exception as e:
+        raise_for_upstream_error(e)
+        print(f"Chat Session Stream Error: {e}")
+        raise HTTPException(500, detail=f"处理聊天请求时发生错误: {str(e)}")
+
+
 @app.post("/api/pdf/generate_mindmap", response_model=MindmapResponse)
 async def generate_document_mindmap(
         request_data: MindmapRequest,
         x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")  # 新增 API Key Header
 ):
+    document = await resolve_document(request_data.document_text, request_data.doc_id)
     try:
-        client = DeepSeekClient(api_key=x_user_api_key)
-
-        if request_data.output_format.lower() == "mermaid":
-            system_prompt = "你是一位顶级的AI助手，专门从复杂的学术文献中提取深层结构和核心信息，并将其精准地转化为结构清晰、内容详尽、语法绝对正确的Mermaid思维导图。你的输出必须直接是Mermaid代码，不能包含任何额外的解释、标记或非Mermaid代码内容。"
-            user_prompt_template = """
-            请仔细阅读并深度理解以下提供的完整学术文档。基于此文档，你需要生成一个全面且详尽的Mermaid语法的思维导图（mindmap）。
-
-            **任务要求与指导：**
-
-            1.  **内容详尽性与深度**：
-                * **全面覆盖**：确保思维导图充分展现文档的**主要章节/部分**（如：引言、背景、文献综述、研究方法、实验设计、数据收集与分析、结果、讨论、局限性、结论、未来工作等）。
-                * **核心要素**：深入挖掘并清晰呈现文档的**核心论点、子论点、关键概念及其定义、重要假设、关键数据/证据、研究发现、理论贡献、实践意义**等。
-                * **逻辑关系**：明确展示不同概念、论点、章节和发现之间的**层级关系与相互联系**。
-                * **多层级结构**：鼓励使用至少3-5个层级（甚至更多，如果文献内容复杂且支持）来详细展开各个分支，避免过于概括性的节点。叶子节点应尽可能具体。
-                * **中文为主**：鼓励使用中文作为节点内的文本，但是专业名词和特殊用语可以保留原文。
-
-            2.  **Mermaid语法与格式**：
-                * **严格的Mermaid Mindmap语法**：输出**必须**严格遵守Mermaid的 `mindmap` 图表类型语法。代码必须以 `mindmap` 关键字开始。
-                * **节点文本规范（至关重要！请严格遵守！）：**
-                    * **简洁明了**：每个节点的文本应简洁、高度概括，但要包含足够的信息。如果概念复杂，请拆分为子节点。
-                    * **首选的节点定义方式**：对于思维导图中的**所有子节点**（即非根节点），为了确保最大的兼容性和避免解析错误，请**优先采用 `("你的节点文本内容")` 的格式来定义节点**。这意味着节点文本本身应该被双引号 `"` 包裹，然后这整个带引号的字符串再被一对圆括号 `()` 包裹。
-                        * **即使节点文本不包含任何特殊字符，也推荐使用 `("...")` 格式以保持一致性和稳健性。**
-                    * **特殊字符处理**：如果（并且按照上述规则，总是）使用了 `("...")` 格式，那么节点文本内部的特殊字符（例如 `( ) [ ] {{ }} < > " : ; = . % + * & | / \\ _` 等）就自然地被包含在双引号内部了。这是处理特殊字符的推荐方式。
-                    * **正确示例**：
-                        ```mermaid
-                        mindmap
-                            ParentNode
-                                ("子节点文本，包含(括号)和符号&")
-                                ("另一个子节点，可能是版本2.0")
-                                ("简单的子节点") 
-                        ```
-                    * **避免的格式（当文本复杂或含特殊字符时）**：避免直接使用 ` "包含(括号)的文本" ` 作为子节点行，因为这可能导致解析问题，如你所发现。
-
-                * **根节点处理**：对于根节点，通常使用 `root((文本))` 或 `root(("文本"))` 的形式。如果根节点文本包含特殊字符，确保文本部分被双引号包裹，例如 `root(("带有(括号)和符号&的根节点标题"))`。
-
-                * **层级清晰**：通过正确的缩进（通常是2个或4个空格，从父节点的第一个字符开始对齐子节点的定义，例如 `("...")` 的起始圆括号）来表示清晰的父子关系和层级结构。
-                * **仅输出代码**：你的最终输出**只能是纯粹的Mermaid代码块**。**严禁**在代码块之前或之后添加任何Markdown标记（如 ```mermaid ... ``` 或 ```）、任何解释性文字、标题、介绍、总结、或其他非Mermaid代码的字符。输出的文本应该可以直接被Mermaid渲染引擎解析。
-
-            **示例输出的结构（你需要根据实际文档内容填充）：**
-            ```text
-            mindmap
-              root((文档核心主题/标题))
-                (引言)
-                  (研究背景与重要性)
-                  (研究问题/目标)
-                  (论文结构)
-                (文献综述)
-                  (相关理论A)
-                    (理论A的核心观点1)
-                    (理论A的代表学者/文献)
-                  (相关研究B)
-                (研究方法)
-                  (研究范式/设计)
-                  (数据收集方法与工具)
-                    (样本描述)
-                  (数据分析技术)
-                (结果与发现)
-                  (主要发现一)
-                    (具体数据/图表支撑1)
-                    (对发现一的初步解读)
-                  (主要发现二)
-                (讨论)
-                  (对结果的深入分析与解释)
-                  (与先前研究的比较/联系)
-                  (理论贡献与实践启示)
-                  (研究的局限性)
-                (结论与未来展望)
-                  (核心结论总结)
-                  (对未来研究的建议)
-              现在，请处理以下文档：
-
-              文档全文:{document_text}
-
-            Mermaid 思维导图代码 (请直接从下一行开始输出纯代码):      
-            """
-        elif request_data.output_format.lower() == "json":
-            system_prompt = "你是一个擅长从学术文献中提取核心内容并将其组织成结构化数据的AI助手。"
-            user_prompt_template = "请仔细阅读以下提供的文档全文，并生成一个表示其主要结构、核心论点、关键概念和相互关系的 JSON 对象。JSON 对象应该有一个根节点，每个节点包含 'text' (节点显示的文本) 和一个可选的 'children' (子节点对象数组) 属性。例如：{ \"text\": \"根主题\", \"children\": [ { \"text\": \"分支1\", \"children\": [ { \"text\": \"叶子1.1\" } ] }, { \"text\": \"分支2\" } ] }。请直接输出 JSON 对象字符串，不要包含其他解释性文字。\n\n文档全文:\n{document_text}\n\nJSON 输出:\n"
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported output_format. Choose 'mermaid' or 'json'.")
-
-        full_user_prompt = user_prompt_template.format(document_text=request_data.document_text)
-        messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": full_user_prompt}]
-
-        ai_response = client.get_chat_completion(messages=messages)  # 默认模型 "deepseek-reasoner"
-
-        mindmap_data_str = ""
-        if ai_response.choices and ai_response.choices[0].message and ai_response.choices[0].message.content:
-            mindmap_data_str = ai_response.choices[0].message.content.strip()
-            if request_data.output_format.lower() == "mermaid":
-                mindmap_data_str = mindmap_data_str.replace("```mermaid", "").replace("```", "").strip()
-            if request_data.output_format.lower() == "json":
-                try:
-                    json.loads(mindmap_data_str)
-                except json.JSONDecodeError:
-                    print(f"Warning: LLM did not return valid JSON for mindmap: {mindmap_data_str}")
-                    pass
-        else:
-            print("----------- LLM Response did not contain expected content -----------")
-            if ai_response.choices and ai_response.choices[0].finish_reason:
-                print(f"LLM Finish Reason: {ai_response.choices[0].finish_reason}")
-            raise HTTPException(status_code=500, detail="AI未能生成思维导图数据")
-
-        return MindmapResponse(mindmap_data=mindmap_data_str, format_used=request_data.output_format.lower())
+        client = AsyncDeepSeekClient(api_key=x_user_api_key, priority=Priority.MINDMAP)
+        return await generate_mindmap(client, document, request_data.output_format.lower(),
+                                      request_data.bypass_cache, request_data.mode)
 
     except ValueError as ve:
         print(f"API Key or Client Initialization Error for Mindmap: {ve}")
         raise HTTPException(400, detail=str(ve))
     except Exception as e:
+        raise_for_upstream_error(e)
         print(f"Error generating mindmap: {e}")
         # from openai import AuthenticationError
         # if isinstance(e, AuthenticationError):
@@ -380,6 +1242,210 @@ async def generate_document_mindmap(
         raise HTTPException(status_code=500, detail=f"生成思维导图时发生错误: {str(e)}")
 
 
+@app.post("/api/pdf/generate_mindmap/stream")
+async def generate_document_mindmap_stream(
+        request_data: MindmapRequest,
+        x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")
+):
+    """
+    流式生成思维导图 (SSE)，done 事件中携带清理后的 mindmap_data。
+    sections 模式下不输出 delta，而是每完成一个章节推送一次 progress 事件。
+    """
+    document = await resolve_document(request_data.document_text, request_data.doc_id)
+    output_format = request_data.output_format.lower()
+    messages = build_mindmap_messages(document.text, output_format, doc_key=document.doc_id)
+    cache_key = mindmap_cache_key(document, output_format)
+    try:
+        client = AsyncDeepSeekClient(api_key=x_user_api_key, priority=Priority.MINDMAP)
+        if request_data.mode == "sections":
+            cache_key = sectioned_mindmap_cache_key(document, output_format)
+            cached = await lookup_cached_response(cache_key, request_data.bypass_cache)
+            if cached is None:
+                return StreamingResponse(
+                    sectioned_mindmap_events(
+                        client, document, output_format,
+                        on_finish=functools.partial(store_cached_response, cache_key, SECTIONED_MINDMAP_KIND,
+                                                    MINDMAP_SECTION_MODEL)
+                    ),
+                    media_type="text/event-stream",
+                    headers=SSE_HEADERS,
+                )
+            return await open_completion_stream(
+                client, messages,
+                on_complete=lambda content: {"mindmap_data": content, "format_used": output_format},
+                cached=cached
+            )
+        return await open_completion_stream(
+            client, messages,
+            on_complete=lambda content: {
+                "mindmap_data": clean_mindmap_output(content, output_format),
+                "format_used": output_format,
+            },
+            on_finish=functools.partial(store_cached_response, cache_key, "mindmap", MINDMAP_MODEL),
+            cached=await lookup_cached_response(cache_key, request_data.bypass_cache),
+            model=MINDMAP_MODEL
+        )
+    except ValueError as ve:
+        print(f"API Key or Client Initialization Error for Mindmap: {ve}")
+        raise HTTPException(400, detail=str(ve))
+    except Exception as e:
+        raise_for_upstream_error(e)
+        print(f"Error generating mindmap stream: {e}")
+        raise HTTPException(status_code=500, detail=f"生成思维导图时发生错误: {str(e)}")
+
+
+@app.post("/api/batch/jobs")
+async def create_batch_job(
+        files: list[UploadFile] = File(...),
+        summarize: bool = Form(False),
+        mindmap: bool = Form(False),
+        mindmap_format: str = Form("json"),
+        mindmap_mode: str = Form("single"),
+        summary_mode: str = Form("auto"),
+        x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")
+):
+    """
+    批量上传 PDF 并创建后台任务：文件先保存到数据目录 (任务中断后可继续)，随后立即返回 job_id，
+    进度通过 GET /api/batch/jobs/{job_id} 轮询或 GET /api/batch/jobs/{job_id}/events (SSE) 获取。
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(400, detail=f"Too many files (max {BATCH_MAX_FILES}).")
+    job_id = new_job_id()
+    upload_dir = job_upload_dir(job_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    items = []
+    try:
+        for index, file in enumerate(files):
+            if file.content_type != "application/pdf":
+                raise HTTPException(400, detail=f"Invalid file type for {file.filename}. Only PDF files are accepted.")
+            pdf_path, _ = await spool_upload(file)
+            saved_path = os.path.join(upload_dir, f"{index}.pdf")
+            await asyncio.to_thread(shutil.move, pdf_path, saved_path)
+            items.append((file.filename or f"{index}.pdf", saved_path, True))
+    except BaseException:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise
+    finally:
+        for file in files:
+            await file.close()
+
+    options = {"summarize": summarize, "mindmap": mindmap,
+               "mindmap_format": mindmap_format.lower(), "mindmap_mode": mindmap_mode, "summary_mode": summary_mode}
+    return await batch_job_manager.submit(items, options, api_key=x_user_api_key, source="upload", job_id=job_id)
+
+
+def is_loopback_client(request: Request) -> bool:
+    host = request.client.host if request.client is not None else ""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+@app.post("/api/batch/jobs/directory")
+async def create_batch_job_from_directory(
+        request: Request,
+        request_data: BatchDirectoryRequest,
+        x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")
+):
+    """
+    处理本机目录中的所有 PDF (桌面版)；文件原地读取，不复制。
+    提取的文本可以通过文档接口读回，因此只接受本机 (loopback) 客户端，且目录必须位于 BATCH_DIRECTORY_ROOTS 之下。
+    """
+    if not is_loopback_client(request):
+        raise HTTPException(403, detail="Directory import is only available to local clients.")
+    try:
+        paths = await asyncio.to_thread(list_pdf_files, request_data.directory, request_data.recursive,
+                                        BATCH_DIRECTORY_ROOTS)
+    except PermissionError as e:
+        raise HTTPException(403, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(400, detail=str(e))
+    if not paths:
+        raise HTTPException(400, detail="No PDF files found in the directory.")
+    if len(paths) > BATCH_MAX_FILES:
+        raise HTTPException(400, detail=f"Too many files (max {BATCH_MAX_FILES}).")
+    options = request_data.model_dump(exclude={"directory", "recursive"})
+    options["mindmap_format"] = options["mindmap_format"].lower()
+    directory = os.path.realpath(os.path.expanduser(request_data.directory))
+    items = [(os.path.relpath(path, directory), path, False) for path in paths]
+    return await batch_job_manager.submit(items, options, api_key=x_user_api_key, source=request_data.directory)
+
+
+@app.get("/api/batch/jobs")
+async def list_batch_jobs():
+    return {"jobs": await asyncio.to_thread(batch_job_manager.store.list_jobs)}
+
+
+@app.get("/api/batch/jobs/{job_id}")
+async def get_batch_job(job_id: str, include_items: bool = Query(True)):
+    job = await batch_job_manager.get(job_id, include_items=include_items)
+    if job is None:
+        raise HTTPException(404, detail="Batch job not found.")
+    return job
+
+
+@app.get("/api/batch/jobs/{job_id}/events")
+async def batch_job_events(job_id: str):
+    """
+    批量任务进度 (SSE)：先推送一次 progress 快照，之后每个文件状态变化推送 item 事件 (附带任务计数)，
+    任务结束 (完成/取消/暂停) 时推送 done 事件。
+    """
+    queue = batch_job_manager.subscribe(job_id)  # 先订阅再读取快照，避免漏掉两者之间的变化
+    job = await batch_job_manager.get(job_id)
+    if job is None:
+        batch_job_manager.unsubscribe(job_id, queue)
+        raise HTTPException(404, detail="Batch job not found.")
+
+    async def event_generator():
+        try:
+            yield sse_event("progress", {"job": job})
+            current = job
+            while current is not None and current["status"] == "running":
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                current = event["job"]
+                if event["item"] is not None:
+                    yield sse_event("item", event)
+            yield sse_event("done", {"job": current})
+        finally:
+            batch_job_manager.unsubscribe(job_id, queue)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/api/batch/jobs/{job_id}/resume")
+async def resume_batch_job(
+        job_id: str,
+        retry_failed: bool = Query(True, description="同时重试失败的文件"),
+        x_user_api_key: Optional[str] = Header(None, alias="X-User-API-Key")
+):
+    """继续已暂停/取消的任务 (重启后使用用户 API Key 的任务需要重新提供 Key)"""
+    job = await batch_job_manager.resume(job_id, api_key=x_user_api_key, retry_failed=retry_failed)
+    if job is None:
+        raise HTTPException(404, detail="Batch job not found.")
+    return job
+
+
+@app.post("/api/batch/jobs/{job_id}/cancel")
+async def cancel_batch_job(job_id: str):
+    job = await batch_job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(404, detail="Batch job not found.")
+    return job
+
+
+@app.delete("/api/batch/jobs/{job_id}")
+async def delete_batch_job(job_id: str):
+    """删除任务记录与已上传的文件 (已登记的文档不受影响)"""
+    if not await batch_job_manager.delete(job_id):
+        raise HTTPException(404, detail="Batch job not found.")
+    return {"job_id": job_id, "deleted": True}
+
+
 LOGGING_CONFIG_NO_COLORS = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -430,14 +1496,29 @@ LOGGING_CONFIG_NO_COLORS = {
 
 
 if __name__ == "__main__":
+    # PyInstaller 打包后使用进程池需要 freeze_support，否则子进程会重新执行整个程序
+    multiprocessing.freeze_support()
+    import argparse
     import uvicorn
     # 端口号应与前端 api.ts 中配置的一致
     # 以及 Electron main.js 中配置的一致
     PORT = 8008 # 确保这个端口统一
 
-    uvicorn.run(
-        app,
-        host="127.0.0.1",
-        port=PORT,
-        log_config=LOGGING_CONFIG_NO_COLORS # <--- 在这里应用自定义日志配置
-    )
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="DeepRead AI backend")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("DEEPREAD_WORKERS", "1")),
+                        help="worker 进程数；大于 1 时文档、会话与批量任务通过共享 SQLite 在 worker 之间同步")
+    parser.add_argument("--host", default=os.getenv("DEEPREAD_HOST", "127.0.0.1"))
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # worker 子进程重新导入本模块，各模块在导入时据此开启共享存储并按 worker 数分配进程池与限流
+        os.environ["DEEPREAD_WORKERS"] = str(args.workers)
+        uvicorn.run("main:app", host=args.host, port=PORT, workers=args.workers,
+                    log_config=LOGGING_CONFIG_NO_COLORS)
+    else:
+        uvicorn.run(
+            app,
+            host=args.host,
+            port=PORT,
+            log_config=LOGGING_CONFIG_NO_COLORS # <--- 在这里应用自定义日志配置
+        )
\ No newline at end of file
@@ -0,0 +1,339 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+# --- 指标与耗时追踪配置 (均可通过环境变量覆盖) ---
+METRICS_ENABLED = os.getenv("DEEPREAD_METRICS", "1") != "0"
+TRACE_LOG_ENABLED = os.getenv("DEEPREAD_TRACE_LOG", "0") == "1"  # 为 1 时每个请求结束后打印一行 JSON 耗时明细
+TRACE_LOG_MIN_SECONDS = float(os.getenv("DEEPREAD_TRACE_LOG_MIN_SECONDS", "0"))  # 只打印总耗时超过该值的请求
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+COUNT_BUCKETS = (10, 100, 1e3, 5e3, 1e4, 5e4, 1e5, 5e5, 1e6)
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+def _label_key(label_names: tuple[str, ...], labels: dict) -> tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+
+def _format_labels(label_names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.label_names, labels), 0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, key)} {value:g}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple[str, ...], list] = {}  # 键 -> [各桶计数..., 总和, 总数]
+
+    def observe(self, value: float, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.label_names, labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                bound_label = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, bound_label)} {cumulative}")
+            inf_label = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, inf_label)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """极简的 Prometheus 指标注册表 (无需 prometheus_client)，以文本格式导出"""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self.collectors = []  # 导出时调用的函数，返回额外的文本行 (如各缓存的当前状态)
+
+    def counter(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                print(f"Warning: metrics collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+def gauge_lines(name: str, documentation: str, value: float, **labels) -> list[str]:
+    """供 collector 使用：生成一个 gauge 的文本行"""
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} gauge",
+            f"{name}{_format_labels(labels.keys(), labels.values())} {value:g}"]
+
+
+def labeled_gauge_lines(name: str, documentation: str, label: str, values: dict) -> list[str]:
+    """供 collector 使用：生成一组按单个标签区分的 gauge (HELP/TYPE 只输出一次)"""
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"] + [
+        f"{name}{_format_labels((label,), (key,))} {value:g}" for key, value in values.items()
+    ]
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter(
+    "deepread_http_requests_total", "HTTP requests by endpoint and status", ("endpoint", "method", "status"))
+HTTP_DURATION = registry.histogram(
+    "deepread_http_request_duration_seconds", "End-to-end HTTP request duration (including streamed bodies)",
+    ("endpoint", "method"))
+STAGE_DURATION = registry.histogram(
+    "deepread_stage_duration_seconds", "Duration of individual request stages", ("endpoint", "stage"))
+UPLOAD_BYTES = registry.histogram(
+    "deepread_upload_bytes", "Size of uploaded PDF files", ("endpoint",), SIZE_BUCKETS)
+PDF_PAGES = registry.counter("deepread_pdf_pages_total", "PDF pages extracted", ("cache",))
+PDF_PAGES_PER_SECOND = registry.histogram(
+    "deepread_pdf_pages_per_second", "PDF extraction throughput per document", (), RATE_BUCKETS)
+PROMPT_CHARS = registry.histogram(
+    "deepread_prompt_chars", "Characters sent to the model per request", ("endpoint", "model"), COUNT_BUCKETS)
+PROMPT_TOKENS = registry.histogram(
+    "deepread_prompt_tokens", "Prompt tokens per request as reported by the model", ("endpoint", "model"),
+    COUNT_BUCKETS)
+UPSTREAM_LATENCY = registry.histogram(
+    "deepread_upstream_latency_seconds", "Upstream completion latency (until the last token)", ("endpoint", "model"))
+UPSTREAM_TTFT = registry.histogram(
+    "deepread_upstream_ttft_seconds", "Upstream time to first token for streamed completions", ("endpoint", "model"))
+UPSTREAM_QUEUE = registry.histogram(
+    "deepread_upstream_queue_seconds", "Time spent waiting in the request scheduler", ("endpoint", "priority"))
+COMPLETION_TOKENS_PER_SECOND = registry.histogram(
+    "deepread_completion_tokens_per_second", "Completion tokens per second of generation", ("endpoint", "model"),
+    RATE_BUCKETS)
+LLM_TOKENS = registry.counter(
+    "deepread_llm_tokens_total", "Token usage reported by the model", ("endpoint", "model", "type"))
+LLM_REQUESTS = registry.counter(
+    "deepread_llm_requests_total", "Upstream completion requests", ("endpoint", "model", "outcome"))
+REQUESTS_ABORTED = registry.counter(
+    "deepread_requests_aborted_total", "Requests cancelled on client disconnect or deadline", ("endpoint", "reason"))
+
+# CancellationMiddleware 中止请求时在 scope 中写入原因，客户端断开的请求按 499 (Client Closed Request) 记录
+ABORTED_SCOPE_KEY = "deepread.aborted"
+
+
+# --------------------------
+# 请求级耗时追踪
+# --------------------------
+@dataclass
+class RequestTrace:
+    scope: dict = field(default_factory=dict, repr=False)
+    method: str = "GET"
+    started: float = field(default_factory=time.perf_counter)
+    spans: list[tuple[str, float, float]] = field(default_factory=list)  # (阶段, 相对开始的秒数, 耗时)
+    attributes: dict = field(default_factory=dict)
+
+    @property
+    def endpoint(self) -> str:
+        """
+        指标的 endpoint 标签：取路由模板 (如 /api/documents/{doc_id})，路由匹配后才写入 scope，因此每次用到时再读取；
+        未匹配到路由时使用固定的 unmatched，不使用原始路径，避免每个会话/文档产生一个新的时间序列。
+        """
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+    def add_span(self, stage: str, start: float, duration: float) -> None:
+        self.spans.append((stage, round(start - self.started, 6), duration))
+        STAGE_DURATION.observe(duration, endpoint=self.endpoint, stage=stage)
+
+    def server_timing(self) -> str:
+        """HTTP Server-Timing 头，浏览器开发者工具可以直接显示各阶段耗时"""
+        return ", ".join(f"{stage};dur={duration * 1000:.1f}" for stage, _, duration in self.spans)
+
+    def to_dict(self, total: float, status: Optional[int]) -> dict:
+        return {
+            "endpoint": self.endpoint,
+            "path": self.scope.get("path", ""),
+            "method": self.method,
+            "status": status,
+            "total_ms": round(total * 1000, 2),
+            "spans": [{"stage": stage, "start_ms": round(start * 1000, 2), "duration_ms": round(duration * 1000, 2)}
+                      for stage, start, duration in self.spans],
+            **self.attributes,
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("deepread_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def current_endpoint() -> str:
+    trace = _current_trace.get()
+    return trace.endpoint if trace is not None else "background"
+
+
+def record_stage(stage: str, start: float, duration: Optional[float] = None) -> None:
+    """记录一个阶段 (start 为 time.perf_counter() 的值)；不在请求上下文中时只更新指标"""
+    if duration is None:
+        duration = time.perf_counter() - start
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(stage, start, duration)
+    else:
+        STAGE_DURATION.observe(duration, endpoint="background", stage=stage)
+
+
+@contextmanager
+def span(stage: str):
+    """with span("extract"): ... 记录代码块的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, start)
+
+
+def set_attribute(key: str, value) -> None:
+    """给当前请求的追踪记录附加属性 (如上传大小、页数)，写入 JSON 日志"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes[key] = value
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件：为每个 HTTP 请求建立追踪上下文，统计请求数与端到端耗时 (流式响应计到最后一个字节)，
+    并在响应头中附带 Server-Timing。endpoint 标签使用路由模板 (如 /api/documents/{doc_id})，避免标签爆炸。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope=scope, method=scope.get("method", "GET"))
+        token = _current_trace.set(trace)
+        status_holder = {"status": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+                if trace.spans:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            total = time.perf_counter() - trace.started
+            endpoint = trace.endpoint
+            status = status_holder["status"] or (499 if scope.get(ABORTED_SCOPE_KEY) == "client_disconnect" else 500)
+            HTTP_REQUESTS.inc(endpoint=endpoint, method=trace.method, status=status)
+            HTTP_DURATION.observe(total, endpoint=endpoint, method=trace.method)
+            if TRACE_LOG_ENABLED and total >= TRACE_LOG_MIN_SECONDS:
+                print(json.dumps({"trace": trace.to_dict(total, status)}, ensure_ascii=False))
+
+
+def observe_completion(model: str, latency: float, ttft: Optional[float], usage, outcome: str = "ok") -> None:
+    """记录一次上游调用：延迟、首 token 延迟、生成速度与 usage 中的 token 数"""
+    endpoint = current_endpoint()
+    LLM_REQUESTS.inc(endpoint=endpoint, model=model, outcome=outcome)
+    if outcome != "ok":
+        return
+    UPSTREAM_LATENCY.observe(latency, endpoint=endpoint, model=model)
+    if ttft is not None:
+        UPSTREAM_TTFT.observe(ttft, endpoint=endpoint, model=model)
+    if usage is None:
+        return
+    values = usage if isinstance(usage, dict) else usage.model_dump(exclude_none=True)
+    if isinstance(values.get("prompt_tokens"), int):
+        PROMPT_TOKENS.observe(values["prompt_tokens"], endpoint=endpoint, model=model)
+    for usage_key, token_type in (("prompt_tokens", "prompt"), ("completion_tokens", "completion"),
+                                  ("prompt_cache_hit_tokens", "cache_hit"),
+                                  ("prompt_cache_miss_tokens", "cache_miss")):
+        value = values.get(usage_key)
+        if isinstance(value, int):
+            LLM_TOKENS.inc(value, endpoint=endpoint, model=model, type=token_type)
+    completion_tokens = values.get("completion_tokens")
+    generation_time = latency - (ttft or 0)
+    if isinstance(completion_tokens, int) and completion_tokens and generation_time > 0:
+        COMPLETION_TOKENS_PER_SECOND.observe(completion_tokens / generation_time, endpoint=endpoint, model=model)
@@ -0,0 +1,300 @@
+import asyncio
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+from cancellation import gather_or_cancel
+from deepseek_client import accumulate_usage
+from document_sections import Section, detect_sections, split_into_parts
+
+# --- 分章节思维导图配置 (均可通过环境变量覆盖) ---
+MINDMAP_SECTION_MODEL = os.getenv("MINDMAP_SECTION_MODEL", "deepseek-chat")  # 单个章节的子树不需要推理模型
+MINDMAP_SECTION_MAX_TOKENS = int(os.getenv("MINDMAP_SECTION_MAX_TOKENS", "6000"))  # 每次请求的章节文本 token 上限
+MINDMAP_SECTION_CONCURRENCY = int(os.getenv("MINDMAP_SECTION_CONCURRENCY", "4"))
+MINDMAP_SECTION_RETRIES = int(os.getenv("MINDMAP_SECTION_RETRIES", "2"))  # 子树无法解析时重新请求的次数
+
+SECTION_SYSTEM_PROMPT = (
+    "你是一个擅长把学术文献的单个章节整理为思维导图子树的AI助手。"
+    "你的输出只能是所要求格式的内容，不能包含任何解释、标题或 Markdown 代码块标记。"
+)
+SECTION_FORMAT_INSTRUCTIONS = {
+    "mermaid": (
+        "输出 Mermaid mindmap 语法：第一行为 mindmap，第二行为根节点 (即本章节的标题)，"
+        "其余每个节点单独一行，写成 (\"节点文本\") 的形式，子节点比父节点多缩进 2 个空格。"
+        "节点文本内不要使用双引号。"
+    ),
+    "json": (
+        "输出一个 JSON 对象：{\"text\": \"本章节的标题\", \"children\": [{\"text\": \"...\", \"children\": [...]}]}，"
+        "每个节点包含 text 与可选的 children。"
+    ),
+}
+# 参考文献及其后的内容不生成子树
+TRAILING_SECTION_RE = re.compile(r"^(references|bibliography|acknowledge?ments?|参考文献|致\s*谢)\b", re.IGNORECASE)
+
+ProgressCallback = Callable[[dict], Awaitable[None]]
+
+
+class MindmapFormatError(ValueError):
+    """模型输出无法解析为思维导图"""
+
+
+@dataclass
+class MindmapNode:
+    text: str
+    children: list["MindmapNode"] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        if not self.children:
+            return {"text": self.text}
+        return {"text": self.text, "children": [child.to_dict() for child in self.children]}
+
+
+# --------------------------
+# Mermaid 解析、修复与输出
+# --------------------------
+# Mermaid mindmap 的节点形状：(( )) 圆形、( ) 圆角、[ ] 方形、{{ }} 六边形、)) (( 爆炸形、) ( 云形
+_SHAPE_PAIRS = [("((", "))"), ("))", "(("), ("{{", "}}"), ("(-", "-)"), ("(", ")"), ("[", "]"), (")", "(")]
+_SHAPE_START_RE = re.compile(r"^([^\s()\[\]{}\"]*?)(\(\(|\)\)|\{\{|\(-|\(|\[|\))")
+_SKIPPED_LINE_RE = re.compile(r"^(%%|::icon\(|:::|```|mindmap\s*$)")
+
+
+def _clean_text(text: str) -> str:
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "\"`":
+        text = text[1:-1].strip()
+    elif text[:1] in ("\"", "`") and text.count(text[0]) % 2:
+        text = text[1:]  # 缺少结尾引号
+    elif text[-1:] in ("\"", "`") and text.count(text[-1]) % 2:
+        text = text[:-1]  # 缺少开头引号
+    return re.sub(r"\s+", " ", text.replace('"', "'")).strip()
+
+
+def _mermaid_node_text(line: str) -> str:
+    """
+    取出一行节点定义中的文本：兼容带 id 前缀的写法 (root((文本)))、各种形状与带引号的文本；
+    括号不配对 (常见的语法错误) 时去掉开头的形状符号与末尾残留的括号。
+    """
+    match = _SHAPE_START_RE.match(line)
+    if match is None:
+        return _clean_text(line)
+    opener = match.group(2)
+    closer = dict(_SHAPE_PAIRS)[opener]
+    inner = line[match.end():]
+    if inner.endswith(closer):
+        inner = inner[:-len(closer)]
+    else:
+        inner = inner.rstrip(")]}(")
+    return _clean_text(inner) or _clean_text(match.group(1))
+
+
+def parse_mermaid_mindmap(content: str) -> MindmapNode:
+    """
+    把 Mermaid mindmap 文本解析为节点树，同时修复常见问题：代码块标记、mindmap 之前的说明文字、
+    Tab 与不一致的缩进、括号/引号不配对、多个根节点 (后出现的根节点挂到第一个根节点下)。
+    无法得到任何子节点时抛出 MindmapFormatError。
+    """
+    lines = content.replace("\r\n", "\n").expandtabs(4).split("\n")
+    header = next((i for i, line in enumerate(lines) if line.strip().lower() == "mindmap"), None)
+    if header is not None:
+        lines = lines[header + 1:]
+
+    root: Optional[MindmapNode] = None
+    stack: list[tuple[int, MindmapNode]] = []
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or _SKIPPED_LINE_RE.match(stripped):
+            continue
+        text = _mermaid_node_text(stripped)
+        if not text:
+            continue
+        node = MindmapNode(text)
+        indent = len(line) - len(line.lstrip())
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        if stack:
+            stack[-1][1].children.append(node)
+        elif root is None:
+            root = node
+        else:
+            root.children.append(node)
+        stack.append((indent, node))
+
+    if root is None or not root.children:
+        raise MindmapFormatError("Mermaid mindmap has no child nodes")
+    return root
+
+
+def _quote(text: str) -> str:
+    return '"' + text.replace('"', "'").replace("\n", " ") + '"'
+
+
+def render_mermaid(root: MindmapNode, indent: int = 2) -> str:
+    """输出统一格式的 Mermaid：根节点 root(("...")), 其余节点 ("...")，每层缩进 indent 个空格"""
+    lines = ["mindmap", " " * indent + f"root(({_quote(root.text)}))"]
+
+    def walk(node: MindmapNode, depth: int) -> None:
+        for child in node.children:
+            lines.append(" " * (indent * depth) + f"({_quote(child.text)})")
+            walk(child, depth + 1)
+
+    walk(root, 2)
+    return "\n".join(lines)
+
+
+# --------------------------
+# JSON 解析与修复
+# --------------------------
+_TEXT_KEYS = ("text", "name", "title", "label", "topic")
+_CHILDREN_KEYS = ("children", "nodes", "subtopics", "items")
+
+
+def _json_node(value) -> MindmapNode:
+    if isinstance(value, str):
+        return MindmapNode(_clean_text(value))
+    if not isinstance(value, dict):
+        raise MindmapFormatError(f"Unexpected mindmap node: {value!r:.80}")
+    text = next((value[key] for key in _TEXT_KEYS if isinstance(value.get(key), str)), None)
+    if not text:
+        raise MindmapFormatError("Mindmap node has no text")
+    children = next((value[key] for key in _CHILDREN_KEYS if isinstance(value.get(key), list)), [])
+    return MindmapNode(_clean_text(text), [_json_node(child) for child in children])
+
+
+def parse_json_mindmap(content: str) -> MindmapNode:
+    """解析 JSON 思维导图，容忍代码块标记、前后说明文字与 name/title 等别名字段"""
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end <= start:
+        raise MindmapFormatError("No JSON object found")
+    try:
+        data = json.loads(content[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise MindmapFormatError(f"Invalid JSON: {e}") from e
+    return _json_node(data)
+
+
+def parse_mindmap(content: str, output_format: str) -> MindmapNode:
+    if output_format == "mermaid":
+        return parse_mermaid_mindmap(content)
+    return parse_json_mindmap(content)
+
+
+def render_mindmap(root: MindmapNode, output_format: str) -> str:
+    if output_format == "mermaid":
+        return render_mermaid(root)
+    return json.dumps(root.to_dict(), ensure_ascii=False, indent=2)
+
+
+def repair_mindmap(content: str, output_format: str) -> Optional[str]:
+    """本地校验并修复思维导图输出，返回统一格式的文本；无法修复时返回 None"""
+    try:
+        return render_mindmap(parse_mindmap(content, output_format), output_format)
+    except MindmapFormatError:
+        return None
+
+
+# --------------------------
+# 分章节并发生成
+# --------------------------
+def section_config() -> dict:
+    """影响分章节思维导图结果的配置，作为缓存键的一部分：修改切分参数后不会命中按旧参数合并的思维导图"""
+    return {
+        "section_max_tokens": MINDMAP_SECTION_MAX_TOKENS,
+        "section_retries": MINDMAP_SECTION_RETRIES,
+    }
+
+
+def document_title(text: str, fallback: str = "文档") -> str:
+    """取首个非空行作为根节点标题 (通常是论文标题)"""
+    for line in text.splitlines():
+        line = line.strip()
+        if line:
+            return line[:80]
+    return fallback
+
+
+def mindmap_body_end(text: str, page_offsets: Optional[list[int]] = None) -> int:
+    """正文的结束位置：第一个参考文献/致谢章节的起点 (没有时为全文末尾)"""
+    for section in detect_sections(text, page_offsets):
+        if section.start > 0 and TRAILING_SECTION_RE.match(section.title):
+            return section.start
+    return len(text)
+
+
+def build_section_messages(part_text: str, part: Section, index: int, total: int, title: str,
+                           output_format: str) -> list[dict]:
+    location = f"章节：{part.title}"
+    if part.pages:
+        location += f"，第 {part.pages[0]}-{part.pages[-1]} 页"
+    return [
+        {"role": "system", "content": SECTION_SYSTEM_PROMPT},
+        {"role": "user", "content": (
+            f"下面是文档《{title}》的第 {index + 1}/{total} 部分 ({location})。"
+            f"请为这一部分生成思维导图子树：根节点为本部分的章节标题，其下用 2-4 层展开核心论点、关键概念、"
+            f"方法、重要数据与结论，节点文本简洁，以中文为主，专业名词可保留原文。\n"
+            f"{SECTION_FORMAT_INSTRUCTIONS[output_format]}\n\n章节内容:\n{part_text}"
+        )},
+    ]
+
+
+class SectionMindmapBuilder:
+    """
+    分章节生成思维导图：按章节切分文档 (复用 document_sections)，为每个章节并发请求一棵子树，
+    在本地校验、修复并合并为一棵完整的树。只有无法解析的子树会被重新请求；
+    重试后仍失败的章节以只有标题的节点占位，并记录在 failed_sections 中。
+    """
+
+    def __init__(self, client, model: str = MINDMAP_SECTION_MODEL, concurrency: int = MINDMAP_SECTION_CONCURRENCY,
+                 max_retries: int = MINDMAP_SECTION_RETRIES):
+        self.client = client
+        self.model = model
+        self.max_retries = max(0, max_retries)
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.usage: dict = {}
+        self.retries = 0
+        self.failed_sections: list[str] = []
+
+    async def _section_subtree(self, messages: list[dict], output_format: str, fallback_title: str) -> MindmapNode:
+        for attempt in range(self.max_retries + 1):
+            async with self.semaphore:
+                response = await self.client.get_chat_completion(messages=messages, model=self.model)
+            accumulate_usage(self.usage, response)
+            content = response.choices[0].message.content if response.choices else None
+            try:
+                return parse_mindmap(content or "", output_format)
+            except MindmapFormatError as e:
+                if attempt == self.max_retries:
+                    break
+                self.retries += 1
+                print(f"Mindmap subtree for '{fallback_title}' is invalid ({e}), requesting again")
+                messages = messages + [
+                    {"role": "assistant", "content": content or ""},
+                    {"role": "user", "content": f"上面的输出无法解析 ({e})。请严格按要求的格式重新输出完整的子树。"},
+                ]
+        self.failed_sections.append(fallback_title)
+        return MindmapNode(fallback_title)
+
+    async def build(self, text: str, page_offsets: Optional[list[int]], output_format: str,
+                    title: Optional[str] = None, on_progress: Optional[ProgressCallback] = None) -> MindmapNode:
+        title = title or document_title(text)
+        body = text[:mindmap_body_end(text, page_offsets)]
+        parts = split_into_parts(body, page_offsets, max_tokens=MINDMAP_SECTION_MAX_TOKENS)
+        total = len(parts)
+        if on_progress:
+            await on_progress({"stage": "sections", "completed": 0, "total": total})
+
+        completed = 0
+
+        async def build_part(index: int, part: Section) -> MindmapNode:
+            nonlocal completed
+            messages = build_section_messages(part.text_of(text), part, index, total, title, output_format)
+            subtree = await self._section_subtree(messages, output_format, part.title)
+            completed += 1
+            if on_progress:
+                await on_progress({"stage": "sections", "completed": completed, "total": total, "part": index + 1,
+                                   "title": part.title, "pages": part.pages})
+            return subtree
+
+        subtrees = await gather_or_cancel(*(build_part(i, part) for i, part in enumerate(parts)))
+        return MindmapNode(title, subtrees)
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+from fastapi import UploadFile
+
+# --- PDF 提取配置 (均可通过环境变量覆盖) ---
+# 多 worker 部署时各 worker 都有自己的进程池，默认按 worker 数平分 CPU (DEEPREAD_WORKERS 见 shared_state)
+_SERVER_WORKERS = max(1, int(os.getenv("DEEPREAD_WORKERS", "1")))
+PDF_EXTRACT_WORKERS = int(os.getenv(
+    "PDF_EXTRACT_WORKERS", str(max(1, min(8, ((os.cpu_count() or 2) - 1) // _SERVER_WORKERS)))
+))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))  # 少于该页数时在线程中串行提取，避免进程池开销
+PDF_MIN_PAGES_PER_TASK = int(os.getenv("PDF_MIN_PAGES_PER_TASK", "8"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 上传文件落盘时每次读取 1MB
+
+PAGE_SEPARATOR = "\n"
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+@dataclass
+class ExtractionResult:
+    text: str
+    page_count: int
+    page_offsets: list[int] = field(default_factory=list)  # 每一页在 text 中的起始字符偏移
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """懒加载的进程池，只有遇到大文档时才会创建"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS)
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+async def spool_upload(file: UploadFile) -> tuple[str, str]:
+    """
+    将上传的 PDF 分块写入临时文件，避免整份文件常驻内存；调用方负责删除。
+    返回 (临时文件路径, 文件内容的 SHA-256)，哈希在写入时顺带计算，无需再读一遍文件。
+    """
+    fd, path = tempfile.mkstemp(suffix=".pdf", prefix="deepread_")
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as spooled:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                spooled.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
+
+
+def _open_reader(pdf_path: str):
+    """通过 mmap 打开 PDF，由操作系统按需换页，多个进程共享同一份页缓存"""
+    from pypdf import PdfReader  # 首次提取时才导入，缩短后端启动时间
+
+    with open(pdf_path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return PdfReader(mapped), mapped
+
+
+def count_pages(pdf_path: str) -> int:
+    reader, mapped = _open_reader(pdf_path)
+    try:
+        return len(reader.pages)
+    finally:
+        mapped.close()
+
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> list[str]:
+    """提取 [start, end) 范围内各页的文本 (在工作进程中执行，必须是模块级函数)"""
+    reader, mapped = _open_reader(pdf_path)
+    try:
+        return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+    finally:
+        mapped.close()
+
+
+def split_page_ranges(page_count: int, workers: int = PDF_EXTRACT_WORKERS) -> list[tuple[int, int]]:
+    """把页码切分为若干连续区间，区间数约为进程数的 4 倍以平衡负载"""
+    if page_count <= 0:
+        return []
+    pages_per_task = max(PDF_MIN_PAGES_PER_TASK, -(-page_count // (workers * 4)))
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+
+async def iter_pdf_pages(pdf_path: str) -> AsyncIterator[tuple[int, int, str]]:
+    """
+    按页码顺序逐页产出 (页码下标, 总页数, 页文本)。
+    大文档的各页区间在进程池中并行提取，先完成的区间会等待前面的区间，从而保证输出顺序。
+    """
+    page_count = await asyncio.to_thread(count_pages, pdf_path)
+    ranges = split_page_ranges(page_count)
+
+    if page_count < PDF_PARALLEL_MIN_PAGES:
+        for start, end in ranges:
+            texts = await asyncio.to_thread(extract_page_range, pdf_path, start, end)
+            for offset, text in enumerate(texts):
+                yield start + offset, page_count, text
+        return
+
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    futures = [loop.run_in_executor(pool, extract_page_range, pdf_path, start, end) for start, end in ranges]
+    try:
+        for (start, _), future in zip(ranges, futures):
+            texts = await future
+            for offset, text in enumerate(texts):
+                yield start + offset, page_count, text
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def join_pages(pages: list[str]) -> ExtractionResult:
+    """一次性拼接所有页文本并记录每页的起始偏移 (偏移已按去除首部空白后的文本修正)"""
+    offsets = []
+    position = 0
+    for page_text in pages:
+        offsets.append(position)
+        position += len(page_text) + len(PAGE_SEPARATOR)
+
+    text = PAGE_SEPARATOR.join(pages)
+    leading = len(text) - len(text.lstrip())
+    text = text.strip()
+    offsets = [min(max(0, offset - leading), len(text)) for offset in offsets]
+    return ExtractionResult(text=text, page_count=len(pages), page_offsets=offsets)
+
+
+async def extract_pdf_file(pdf_path: str) -> ExtractionResult:
+    """提取整个 PDF 文件的文本"""
+    pages = [text async for _, _, text in iter_pdf_pages(pdf_path)]
+    return join_pages(pages)
+
+
+def page_text(text: str, page_offsets: list[int], page_index: int) -> str:
+    """根据页偏移取出某一页 (从 0 开始) 的文本"""
+    start = page_offsets[page_index]
+    end = page_offsets[page_index + 1] if page_index + 1 < len(page_offsets) else len(text)
+    return text[start:end].strip()
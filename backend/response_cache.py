@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+from extraction_cache import DEEPREAD_DATA_DIR
+from shared_state import connect_sqlite
+
+# --- LLM 响应缓存配置 (均可通过环境变量覆盖) ---
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(DEEPREAD_DATA_DIR, "response_cache.sqlite3"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))  # 默认 30 天
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+@dataclass
+class CachedResponse:
+    content: str
+    usage: Optional[dict]
+    created_at: float
+
+
+def normalize_messages(messages: list[dict]) -> list[dict]:
+    """统一换行符并去除首尾空白，使仅有空白差异的提示词得到同一个缓存键"""
+    return [
+        {"role": message["role"], "content": message["content"].replace("\r\n", "\n").strip()}
+        for message in messages
+    ]
+
+
+def make_cache_key(kind: str, model: str, messages: list[dict], output_format: Optional[str] = None,
+                   options: Optional[dict] = None, doc_id: Optional[str] = None) -> str:
+    """
+    options 为影响结果的其他配置 (如分层摘要的分块参数)，配置变化后旧结果不再命中。
+    针对整篇文档的请求传入 doc_id (即全文的 SHA-256)，messages 则只传不含正文的提示词模板：
+    不必在事件循环中把数 MB 的全文再序列化、哈希一遍，提示词修改后旧结果同样不再命中。
+    """
+    fields = {"kind": kind, "model": model, "format": output_format, "messages": normalize_messages(messages)}
+    if options:
+        fields["options"] = options  # 不带 options 时键与之前相同，已有缓存继续有效
+    if doc_id is not None:
+        fields["doc_id"] = doc_id
+    payload = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    基于 SQLite 的 LLM 响应缓存，用于摘要、思维导图这类对同一输入期望同一输出的请求。
+    正文以 zlib 压缩存储；条目超过 TTL 即失效，总大小超过上限时按最近访问时间淘汰。
+    数据库使用 WAL 模式，多个 worker 进程共享同一份缓存。
+    所有方法都是阻塞 IO，异步代码中请用 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, db_path: str = RESPONSE_CACHE_PATH, ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS,
+                 max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = connect_sqlite(self.db_path)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " model TEXT NOT NULL,"
+                " content BLOB NOT NULL,"
+                " usage TEXT,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT content, usage, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[2] > self.ttl_seconds:
+                if row is not None:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    conn.commit()
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+        content, usage, created_at = row
+        return CachedResponse(
+            content=zlib.decompress(content).decode("utf-8"),
+            usage=json.loads(usage) if usage else None,
+            created_at=created_at,
+        )
+
+    def put(self, key: str, kind: str, model: str, content: str, usage: Optional[dict] = None) -> None:
+        compressed = zlib.compress(content.encode("utf-8"), 6)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, kind, model, content, usage, size, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, model, compressed, json.dumps(usage) if usage else None, len(compressed), now, now),
+            )
+            self._evict_locked(conn, now)
+            conn.commit()
+
+    def _evict_locked(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        self.evictions += max(expired, 0)
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def purge(self) -> int:
+        with self._lock:
+            conn = self._connection()
+            removed = conn.execute("DELETE FROM responses").rowcount
+            conn.commit()
+            return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connection()
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "db_path": self.db_path,
+                "entries": entries,
+                "total_bytes": total,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+# 进程级共享的响应缓存
+response_cache = ResponseCache()
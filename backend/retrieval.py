@@ -0,0 +1,223 @@
+import bisect
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+# --- 检索配置 (均可通过环境变量覆盖) ---
+RETRIEVAL_CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "1200"))  # 每个片段的目标字符数
+RETRIEVAL_CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "200"))  # 相邻片段的重叠字符数
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "6000"))  # 发送给模型的文档片段 token 上限
+RETRIEVAL_INDEX_CACHE_SIZE = int(os.getenv("RETRIEVAL_INDEX_CACHE_SIZE", "32"))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_LATIN_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+_CJK_RUN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_CJK_CHAR_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]")
+
+# 英文高频虚词，不参与打分
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were which with "
+    "we our these those their can not no into than then there also such".split()
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：CJK 字符约 0.6 token/字，其余约 4 字符/token"""
+    if not text:
+        return 0
+    cjk_chars = len(_CJK_CHAR_RE.findall(text))
+    return int(cjk_chars * 0.6 + (len(text) - cjk_chars) / 4) + 1
+
+
+def tokenize(text: str) -> list[str]:
+    """英文按单词切分 (去除停用词)，中文按相邻二字切分，无需分词词典"""
+    lowered = text.lower()
+    terms = [term for term in _LATIN_TOKEN_RE.findall(lowered) if term not in _STOPWORDS and len(term) > 1]
+    for run in _CJK_RUN_RE.findall(lowered):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+@dataclass
+class Chunk:
+    chunk_id: int
+    text: str
+    start: int  # 在全文中的起始字符偏移
+    end: int
+    pages: list[int] = field(default_factory=list)  # 片段覆盖的页码 (从 1 开始)，页信息未知时为空
+    token_estimate: int = 0
+
+    @property
+    def page_label(self) -> str:
+        if not self.pages:
+            return ""
+        if len(self.pages) == 1:
+            return f"第{self.pages[0]}页"
+        return f"第{self.pages[0]}-{self.pages[-1]}页"
+
+
+def _find_break(text: str, start: int, target_end: int) -> int:
+    """在 target_end 附近寻找段落/句子/空白边界，避免把句子切成两半"""
+    if target_end >= len(text):
+        return len(text)
+    window_start = start + (target_end - start) // 2
+    for separator in ("\n\n", "\n", "。", ". ", "！", "？", "; ", " "):
+        position = text.rfind(separator, window_start, target_end)
+        if position != -1:
+            return position + len(separator)
+    return target_end
+
+
+def pages_for_span(page_offsets: list[int], start: int, end: int) -> list[int]:
+    if not page_offsets:
+        return []
+    first = bisect.bisect_right(page_offsets, start) - 1
+    last = bisect.bisect_right(page_offsets, max(start, end - 1)) - 1
+    return list(range(max(first, 0) + 1, max(last, 0) + 2))
+
+
+def chunk_document(text: str, page_offsets: Optional[list[int]] = None,
+                   chunk_chars: int = RETRIEVAL_CHUNK_CHARS, overlap: int = RETRIEVAL_CHUNK_OVERLAP) -> list[Chunk]:
+    """把全文切分为有重叠的片段，并根据页偏移标注每个片段所在的页码"""
+    chunks = []
+    overlap = min(overlap, chunk_chars // 2)
+    start = 0
+    while start < len(text):
+        end = _find_break(text, start, start + chunk_chars)
+        chunk_text = text[start:end].strip()
+        if chunk_text:
+            chunks.append(Chunk(
+                chunk_id=len(chunks),
+                text=chunk_text,
+                start=start,
+                end=end,
+                pages=pages_for_span(page_offsets or [], start, end),
+                token_estimate=estimate_tokens(chunk_text),
+            ))
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+class BM25Index:
+    """单个文档的 BM25 词法索引 (倒排表)，纯本地计算，不依赖网络"""
+
+    def __init__(self, chunks: list[Chunk]):
+        self.chunks = chunks
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        lengths = []
+        for chunk in chunks:
+            term_counts = Counter(tokenize(chunk.text))
+            lengths.append(sum(term_counts.values()))
+            for term, count in term_counts.items():
+                chunk_ids, counts = postings.setdefault(term, ([], []))
+                chunk_ids.append(chunk.chunk_id)
+                counts.append(count)
+
+        average_length = (sum(lengths) / len(lengths)) if lengths else 1.0
+        # 片段长度归一化因子 k1 * (1 - b + b * dl / avgdl)
+        norms = [BM25_K1 * (1 - BM25_B + BM25_B * length / (average_length or 1.0)) for length in lengths]
+        total = len(chunks)
+        # 文档不变，每个 (词, 片段) 的 BM25 权重 idf * tf * (k1 + 1) / (tf + norm) 在建索引时一次算好，
+        # 查询时只需按倒排表累加，不再逐项计算 (纯 Python 实现，不引入 NumPy 依赖)
+        self._postings: dict[str, tuple[list[int], list[float]]] = {}
+        for term, (chunk_ids, counts) in postings.items():
+            idf = math.log(1 + (total - len(chunk_ids) + 0.5) / (len(chunk_ids) + 0.5))
+            self._postings[term] = (chunk_ids, [
+                idf * tf * (BM25_K1 + 1) / (tf + norms[chunk_id]) for chunk_id, tf in zip(chunk_ids, counts)
+            ])
+
+    def score(self, query: str) -> list[float]:
+        scores = [0.0] * len(self.chunks)
+        for term, query_count in Counter(tokenize(query)).items():
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            chunk_ids, weights = postings
+            if query_count == 1:
+                for chunk_id, weight in zip(chunk_ids, weights):
+                    scores[chunk_id] += weight
+            else:
+                for chunk_id, weight in zip(chunk_ids, weights):
+                    scores[chunk_id] += query_count * weight
+        return scores
+
+    def search(self, query: str, top_k: int = RETRIEVAL_TOP_K,
+               token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> list[tuple[Chunk, float]]:
+        """
+        返回按原文顺序排列的 (片段, 分数) 列表：
+        - 第一个片段 (通常是标题与摘要) 总是包含在内，为模型提供全局背景；
+        - 其余按 BM25 分数从高到低选取，直到达到 top_k 或 token 预算；
+        - 查询与文档没有任何词重叠时 (如中文提问英文论文)，按原文顺序从头选取。
+        """
+        if not self.chunks:
+            return []
+        scores = self.score(query)
+        # 只对有分数的片段排序 (sorted 是稳定排序，同分时保持原文顺序)，其余按原文顺序排在后面
+        ranked = sorted((i for i, value in enumerate(scores) if value > 0), key=scores.__getitem__, reverse=True)
+        ranked += [i for i, value in enumerate(scores) if value <= 0]
+        if 0 in ranked:
+            ranked.remove(0)
+        ranked.insert(0, 0)
+
+        selected = []
+        used_tokens = 0
+        for chunk_id in ranked:
+            if len(selected) >= max(top_k, 1):
+                break
+            chunk = self.chunks[chunk_id]
+            if selected and used_tokens + chunk.token_estimate > token_budget:
+                continue
+            selected.append(chunk_id)
+            used_tokens += chunk.token_estimate
+        return [(self.chunks[i], scores[i]) for i in sorted(selected)]
+
+
+class RetrievalIndexCache:
+    """按 doc_id 缓存已构建的索引 (LRU)，同一文档的多轮问答无需重复切分与建索引"""
+
+    def __init__(self, max_size: int = RETRIEVAL_INDEX_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, doc_id: str, text: str, page_offsets: Optional[list[int]] = None) -> BM25Index:
+        with self._lock:
+            index = self._indexes.get(doc_id)
+            if index is not None:
+                self._indexes.move_to_end(doc_id)
+                return index
+        index = BM25Index(chunk_document(text, page_offsets))
+        with self._lock:
+            self._indexes[doc_id] = index
+            while len(self._indexes) > self.max_size:
+                self._indexes.popitem(last=False)
+        return index
+
+    def discard(self, doc_id: str) -> None:
+        with self._lock:
+            self._indexes.pop(doc_id, None)
+
+
+def format_passages(results: list[tuple[Chunk, float]]) -> str:
+    """把检索到的片段格式化为带编号和页码标注的上下文文本"""
+    blocks = []
+    for chunk, _ in results:
+        label = f"[片段{chunk.chunk_id + 1}" + (f" | {chunk.page_label}]" if chunk.pages else "]")
+        blocks.append(f"{label}\n{chunk.text}")
+    return "\n\n".join(blocks)
+
+
+# 进程级共享的索引缓存
+retrieval_index_cache = RetrievalIndexCache()
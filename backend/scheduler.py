@@ -0,0 +1,246 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from enum import IntEnum
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import metrics
+from cancellation import DeadlineExceeded, check_deadline, remaining_time
+from shared_state import DEEPREAD_WORKERS
+
+# --- 上游请求调度配置 (均可通过环境变量覆盖) ---
+# 限流状态在每个 worker 进程内独立维护，多 worker 部署时默认值按 worker 数平分，使总量与单进程一致
+LLM_RATE_PER_SECOND = float(os.getenv("LLM_RATE_PER_SECOND", str(5 / DEEPREAD_WORKERS)))  # 每个 API Key 每秒可发起的请求数 (令牌桶补充速率)
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", str(max(1, 10 // DEEPREAD_WORKERS))))  # 令牌桶容量，允许的突发请求数
+LLM_MAX_CONCURRENT_PER_KEY = int(os.getenv("LLM_MAX_CONCURRENT_PER_KEY", str(max(1, 8 // DEEPREAD_WORKERS))))  # 每个 API Key 同时进行的请求数
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))  # 排队超过该秒数则放弃并返回 503
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))  # 瞬时错误 (429 / 5xx / 网络错误) 的最大重试次数
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+
+
+class Priority(IntEnum):
+    """数值越小越先调度：交互式问答 > 摘要 > 思维导图 > 后台任务"""
+    CHAT = 0
+    SUMMARY = 1
+    MINDMAP = 2
+    BACKGROUND = 3
+
+
+# 每个优先级在单个 API Key 下最多排队的请求数，超过时直接拒绝 (503 + Retry-After)
+QUEUE_LIMITS = {
+    Priority.CHAT: int(os.getenv("LLM_QUEUE_LIMIT_CHAT", "32")),
+    Priority.SUMMARY: int(os.getenv("LLM_QUEUE_LIMIT_SUMMARY", "16")),
+    Priority.MINDMAP: int(os.getenv("LLM_QUEUE_LIMIT_MINDMAP", "8")),
+    Priority.BACKGROUND: int(os.getenv("LLM_QUEUE_LIMIT_BACKGROUND", "8")),
+}
+
+T = TypeVar("T")
+
+
+class SchedulerOverloaded(Exception):
+    """队列已满或排队超时；retry_after 为建议客户端等待的秒数"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """429、5xx 与网络/超时错误可以重试，其余 (如 400/401) 重试也不会成功"""
+    import openai  # 能走到这里说明客户端已创建，openai 已经导入
+
+    if isinstance(error, openai.APIConnectionError):  # 包括 APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def retry_after_hint(error: BaseException) -> Optional[float]:
+    """读取上游响应中的 Retry-After 头 (秒)"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt: int, base: float = LLM_RETRY_BASE_DELAY, cap: float = LLM_RETRY_MAX_DELAY) -> float:
+    """指数退避 + 完全抖动 (full jitter)：在 [0, min(cap, base * 2^attempt)] 中均匀取值"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class _KeyState:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.active = 0
+        self.waiting: list[tuple[int, int, asyncio.Future]] = []  # (优先级, 序号, future) 最小堆
+        self.queued = dict.fromkeys(Priority, 0)
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def idle(self) -> bool:
+        """没有进行中或排队的请求且令牌桶已补满：与新建的状态等价，可以丢弃"""
+        self.refill()
+        return self.active == 0 and not self.waiting and not any(self.queued.values()) and self.tokens >= self.burst
+
+
+class RequestScheduler:
+    """
+    按 API Key 调度上游请求：
+    - 令牌桶限制每个 Key 的请求速率，另有并发上限；
+    - 需要等待时按优先级排队 (同优先级先到先得)，保证长时间的思维导图任务不会饿死交互式问答；
+    - 各优先级的队列有界，满了立即抛出 SchedulerOverloaded，由接口转换为 503 + Retry-After；
+    - 瞬时错误按指数退避加抖动重试，每次重试都重新经过限流。
+    """
+
+    def __init__(self, rate: float = LLM_RATE_PER_SECOND, burst: int = LLM_RATE_BURST,
+                 max_concurrent: int = LLM_MAX_CONCURRENT_PER_KEY, queue_timeout: float = LLM_QUEUE_TIMEOUT):
+        self.rate = max(rate, 0.01)
+        self.burst = max(1, burst)
+        self.max_concurrent = max(1, max_concurrent)
+        self.queue_timeout = queue_timeout
+        self._keys: dict[str, _KeyState] = {}
+        self._sequence = itertools.count()
+        self.rejected = 0
+        self.retries = 0
+
+    def _state(self, key: str) -> _KeyState:
+        state = self._keys.get(key)
+        if state is None:
+            self._evict_idle()
+            state = self._keys[key] = _KeyState(self.rate, self.burst)
+        return state
+
+    def _evict_idle(self) -> None:
+        """
+        新 Key 加入时移除所有空闲 Key 的状态：用户各自携带 API Key，不清理会在进程生命周期内无限增长。
+        空闲状态与新建状态等价，之后再次出现的 Key 重新创建即可，不影响限流。
+        """
+        for key in [key for key, state in self._keys.items() if state.idle()]:
+            del self._keys[key]
+
+    def _estimate_wait(self, state: _KeyState) -> float:
+        return (len(state.waiting) + 1) / self.rate
+
+    async def acquire(self, key: str, priority: Priority) -> None:
+        """取得一个执行名额 (令牌 + 并发槽)，用完后必须调用 release；排队时间不超过请求的截止时间"""
+        remaining = check_deadline()
+        state = self._state(key)
+        state.refill()
+        if not state.waiting and state.active < self.max_concurrent and state.tokens >= 1:
+            state.tokens -= 1
+            state.active += 1
+            return
+        if state.queued[priority] >= QUEUE_LIMITS[priority]:
+            self.rejected += 1
+            raise SchedulerOverloaded(f"Too many queued {priority.name.lower()} requests",
+                                      self._estimate_wait(state))
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(state.waiting, (int(priority), next(self._sequence), future))
+        state.queued[priority] += 1
+        self._dispatch(state)
+        wait_timeout = self.queue_timeout if remaining is None else min(self.queue_timeout, remaining)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), wait_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                self.release(key)  # 名额已分配但调用方已放弃，归还名额
+            else:
+                future.cancel()
+                state.waiting = [entry for entry in state.waiting if entry[2] is not future]
+                heapq.heapify(state.waiting)
+            if isinstance(e, asyncio.TimeoutError):
+                if wait_timeout < self.queue_timeout:
+                    raise DeadlineExceeded("Request deadline exceeded while waiting for an upstream slot")
+                self.rejected += 1
+                raise SchedulerOverloaded("Timed out waiting for an upstream slot", self._estimate_wait(state))
+            raise
+        finally:
+            state.queued[priority] -= 1
+
+    def release(self, key: str) -> None:
+        state = self._state(key)
+        state.active = max(0, state.active - 1)
+        self._dispatch(state)
+
+    def _dispatch(self, state: _KeyState) -> None:
+        """把名额按优先级分配给排队的请求；令牌不足时在补满一个令牌的时刻再次调度"""
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+        state.refill()
+        while state.waiting and state.active < self.max_concurrent:
+            if state.tokens < 1:
+                state.timer = asyncio.get_running_loop().call_later(
+                    (1 - state.tokens) / self.rate, self._dispatch, state
+                )
+                return
+            _, _, future = heapq.heappop(state.waiting)
+            if future.done():
+                continue
+            state.tokens -= 1
+            state.active += 1
+            future.set_result(None)
+
+    async def run(self, key: str, priority: Priority, call: Callable[[], Awaitable[T]],
+                  hold: bool = False) -> T:
+        """
+        在调度下执行 call，瞬时错误自动重试。
+        hold 为 True 时 (流式请求) 成功后不释放并发槽，由调用方在流结束时 release。
+        """
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            await self.acquire(key, priority)
+            queue_seconds = time.perf_counter() - queued_at
+            metrics.UPSTREAM_QUEUE.observe(queue_seconds, endpoint=metrics.current_endpoint(),
+                                           priority=priority.name.lower())
+            metrics.record_stage("queue", queued_at, queue_seconds)
+            try:
+                result = await call()
+            except BaseException as e:
+                self.release(key)
+                if not is_transient_error(e) or attempt >= LLM_RETRY_ATTEMPTS:
+                    raise
+                delay = max(backoff_delay(attempt), retry_after_hint(e) or 0)
+                remaining = remaining_time()
+                if remaining is not None and remaining <= delay:
+                    raise  # 等不到下一次重试就会超过截止时间
+                attempt += 1
+                self.retries += 1
+                print(f"Transient upstream error ({e.__class__.__name__}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            if not hold:
+                self.release(key)
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._keys),
+            "active": sum(state.active for state in self._keys.values()),
+            "queued": {
+                priority.name.lower(): sum(state.queued[priority] for state in self._keys.values())
+                for priority in Priority
+            },
+            "rejected": self.rejected,
+            "retries": self.retries,
+        }
+
+
+# 进程级共享的调度器
+request_scheduler = RequestScheduler()
@@ -0,0 +1,26 @@
+import os
+import sqlite3
+
+from extraction_cache import DEEPREAD_DATA_DIR
+
+# --- 多进程部署配置 (均可通过环境变量覆盖) ---
+# uvicorn/gunicorn 的 worker 进程数；python main.py --workers N 会自动设置该变量
+DEEPREAD_WORKERS = max(1, int(os.getenv("DEEPREAD_WORKERS", "1")))
+# 文档与会话是否保存在多个 worker 共享的 SQLite 中 (多 worker 时默认开启；用 gunicorn 部署时请设置 DEEPREAD_WORKERS 或本变量)
+SHARED_STATE_ENABLED = os.getenv("DEEPREAD_SHARED_STATE", "1" if DEEPREAD_WORKERS > 1 else "0") == "1"
+SHARED_STATE_DB_PATH = os.getenv("SHARED_STATE_DB_PATH", os.path.join(DEEPREAD_DATA_DIR, "shared_state.sqlite3"))
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.getenv("SQLITE_BUSY_TIMEOUT_SECONDS", "10"))  # 其他进程持有写锁时的最长等待
+
+
+def connect_sqlite(db_path: str, row_factory=None) -> sqlite3.Connection:
+    """
+    打开可被多个 worker 进程同时使用的 SQLite 连接：WAL 模式下读不阻塞写、写不阻塞读，
+    写入之间由 busy timeout 排队；synchronous=NORMAL 在 WAL 下仍保证崩溃后数据库一致。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+    if row_factory is not None:
+        conn.row_factory = row_factory
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+
+def make_flight_key(*parts: Any) -> str:
+    """把请求的各个组成部分 (API Key、模型、消息、参数) 序列化后取哈希作为合并键"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # 以下字段仅用于流式请求
+        self.opened: Optional[asyncio.Future] = None  # 上游连接建立 (或失败) 时完成
+        self.chunks: list = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+
+
+class _Subscription:
+    """
+    stream() 返回的订阅，逐个产出 chunk。迭代结束、被 aclose()，或从未被迭代就被丢弃时注销等待者 (只注销一次)，
+    否则一个没人读取的订阅会让合并的上游流一直运行下去。
+    """
+
+    def __init__(self, owner: "SingleFlight", key: str, flight: _Flight):
+        self._owner = owner
+        self._key = key
+        self._flight = flight
+        self._chunks = None  # 第一次迭代时才创建内部生成器
+        self._left = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._chunks is None:
+            if self._left:
+                raise StopAsyncIteration
+            self._chunks = self._owner._subscribe(self._flight, self._leave)
+        return await self._chunks.__anext__()
+
+    async def aclose(self) -> None:
+        if self._chunks is not None:
+            await self._chunks.aclose()  # 由内部生成器的 finally 注销
+        else:
+            self._leave()
+
+    def __del__(self):
+        # 已开始迭代的内部生成器由事件循环的异步生成器钩子负责关闭
+        if self._chunks is None:
+            try:
+                self._leave()
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    def _leave(self) -> None:
+        if self._left:
+            return
+        self._left = True
+        self._owner._release(self._key, self._flight, self._flight.done)
+
+
+class SingleFlight:
+    """
+    合并完全相同的并发请求：同一个键同时只有一个上游调用，其结果分发给所有等待者。
+    - 非流式：等待者共享同一个结果 (或异常)；
+    - 流式：上游 chunk 被缓存并广播，后加入的等待者会先补发已收到的 chunk，再与其他人同步接收。
+    所有等待者都放弃 (如客户端断开) 时才取消上游调用；调用结束后立即移除，之后的请求会重新发起。
+    """
+
+    def __init__(self):
+        self._flights: dict[str, _Flight] = {}
+        self.calls = 0  # 实际发起的上游调用数
+        self.coalesced = 0  # 被合并、因而省下的调用数
+        self.stream_calls = 0
+        self.stream_coalesced = 0
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def _release(self, key: str, flight: _Flight, finished: bool) -> None:
+        flight.waiters -= 1
+        if flight.waiters <= 0 and not finished and flight.task is not None:
+            flight.task.cancel()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 (或加入) 一个非流式调用"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.get_running_loop().create_task(call())
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self._flights[key] = flight
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            self._release(key, flight, flight.task.done())
+
+    async def stream(self, key: str, open_stream: Callable[[], Awaitable[AsyncIterator]]) -> AsyncIterator:
+        """
+        执行 (或加入) 一个流式调用。连接阶段的错误在这里直接抛出，
+        返回的异步生成器逐个产出与上游相同的 chunk。
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.opened = asyncio.get_running_loop().create_future()
+            flight.task = asyncio.get_running_loop().create_task(self._pump(key, flight, open_stream))
+            self._flights[key] = flight
+            self.stream_calls += 1
+        else:
+            self.stream_coalesced += 1
+        flight.waiters += 1
+        try:
+            await asyncio.shield(flight.opened)
+        except BaseException:
+            self._release(key, flight, flight.done)
+            raise
+        return _Subscription(self, key, flight)
+
+    async def _pump(self, key: str, flight: _Flight, open_stream) -> None:
+        upstream = None
+        try:
+            upstream = await open_stream()
+            flight.opened.set_result(None)
+            async for chunk in upstream:
+                async with flight.changed:
+                    flight.chunks.append(chunk)
+                    flight.changed.notify_all()
+        except asyncio.CancelledError as e:
+            flight.opened.cancel()
+            flight.error = e
+            raise
+        except Exception as e:
+            if not flight.opened.done():
+                flight.opened.set_exception(e)
+                flight.opened.exception()  # 标记异常已被读取，避免无人等待时的告警
+            flight.error = e
+        finally:
+            if upstream is not None and hasattr(upstream, "aclose"):
+                await upstream.aclose()  # 被取消时立即关闭上游连接并归还并发槽
+            self._forget(key, flight)
+            flight.done = True
+            async with flight.changed:
+                flight.changed.notify_all()
+
+    async def _subscribe(self, flight: _Flight, leave: Callable[[], None]):
+        position = 0
+        try:
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: position < len(flight.chunks) or flight.done)
+                    pending = flight.chunks[position:]
+                    finished = flight.done
+                position += len(pending)
+                for chunk in pending:
+                    yield chunk
+                if finished and position >= len(flight.chunks):
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            leave()
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight(),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "stream_calls": self.stream_calls,
+            "stream_coalesced": self.stream_coalesced,
+            "saved_calls": self.coalesced + self.stream_coalesced,
+        }
@@ -0,0 +1,105 @@
+import importlib
+import os
+import time
+from typing import Optional
+
+# main 第一个导入本模块，因此这里近似为后端开始导入的时刻
+IMPORT_STARTED = time.perf_counter()
+IMPORT_STARTED_WALL = time.time()
+
+# --- 启动配置 (均可通过环境变量覆盖) ---
+DOTENV_PATH = os.path.join(os.path.dirname(__file__), ".env")
+# 启动完成后在后台线程预先导入的重型依赖，使第一次提取/LLM 请求不再承担导入耗时 (设为空字符串可关闭)
+PREWARM_MODULES = [name for name in os.getenv("DEEPREAD_PREWARM_MODULES", "openai,pypdf").split(",") if name.strip()]
+
+
+def load_env_file(path: str = DOTENV_PATH) -> bool:
+    """
+    加载 .env。必须在导入其他后端模块之前调用，因为各模块在导入时就读取环境变量配置；
+    python-dotenv 只在文件存在时才导入。
+    """
+    if not os.path.exists(path):
+        print("Warning: .env file not found at expected location. API Key might not be loaded.")
+        return False
+    from dotenv import load_dotenv
+
+    load_dotenv(path)
+    return True
+
+
+class StartupTimer:
+    """
+    记录后端启动各阶段相对于开始导入的耗时 (秒)：imports 模块导入完成，ready 开始接受请求，
+    first_request 第一个 (非 /healthz) 请求处理完毕。
+    Electron 通过环境变量 DEEPREAD_LAUNCH_EPOCH_MS 传入启动子进程的时刻，用于计算包括
+    PyInstaller 解包与解释器启动在内的总耗时。
+    """
+
+    def __init__(self):
+        self.phases: dict[str, float] = {}
+        launch_ms = os.getenv("DEEPREAD_LAUNCH_EPOCH_MS")
+        self.launch_offset: Optional[float] = None  # 进程被拉起到开始导入之间的秒数
+        if launch_ms:
+            try:
+                self.launch_offset = max(0.0, IMPORT_STARTED_WALL - int(launch_ms) / 1000)
+            except ValueError:
+                pass
+
+    def mark(self, phase: str) -> float:
+        """记录阶段完成时刻 (同一阶段只记录第一次)"""
+        if phase not in self.phases:
+            self.phases[phase] = time.perf_counter() - IMPORT_STARTED
+        return self.phases[phase]
+
+    def snapshot(self) -> dict:
+        snapshot = {"phases": {phase: round(seconds, 4) for phase, seconds in self.phases.items()}}
+        if self.launch_offset is not None:
+            snapshot["launch_to_import"] = round(self.launch_offset, 4)
+            snapshot["since_launch"] = {
+                phase: round(self.launch_offset + seconds, 4) for phase, seconds in self.phases.items()
+            }
+        return snapshot
+
+    def report(self, phase: str) -> None:
+        seconds = self.mark(phase)
+        line = f"Startup: {phase} after {seconds:.3f}s"
+        if self.launch_offset is not None:
+            line += f" ({self.launch_offset + seconds:.3f}s since launch)"
+        print(line)
+
+
+class StartupTimingMiddleware:
+    """记录第一个请求的完成时刻；之后每个请求只多一次布尔判断"""
+
+    def __init__(self, app, timer: StartupTimer, ignored_paths: tuple[str, ...] = ("/healthz",)):
+        self.app = app
+        self.timer = timer
+        self.ignored_paths = ignored_paths
+        self.done = False
+
+    async def __call__(self, scope, receive, send):
+        if self.done or scope["type"] != "http" or scope["path"] in self.ignored_paths:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if not self.done:
+                self.done = True
+                self.timer.report("first_request")
+
+
+def prewarm_imports(modules: list[str] = PREWARM_MODULES) -> None:
+    """在后台线程中导入重型依赖 (由 lifespan 在就绪后调度)"""
+    started = time.perf_counter()
+    for name in modules:
+        try:
+            importlib.import_module(name.strip())
+        except ImportError as e:
+            print(f"Warning: failed to prewarm module {name}: {e}")
+    startup_timer.mark("prewarm")
+    print(f"Startup: prewarmed {', '.join(modules)} in {time.perf_counter() - started:.3f}s")
+
+
+# 进程级共享的启动计时
+startup_timer = StartupTimer()
@@ -0,0 +1,173 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Optional
+
+from cancellation import gather_or_cancel
+from deepseek_client import accumulate_usage
+from document_sections import Section, split_into_parts
+from retrieval import estimate_tokens
+
+# --- 分层 (map-reduce) 摘要配置 (均可通过环境变量覆盖) ---
+SUMMARY_SINGLE_PASS_MAX_TOKENS = int(os.getenv("SUMMARY_SINGLE_PASS_MAX_TOKENS", "24000"))  # auto 模式下超过此值才分层
+SUMMARY_PART_MAX_TOKENS = int(os.getenv("SUMMARY_PART_MAX_TOKENS", "6000"))  # 每个 map 分块的 token 上限
+SUMMARY_PART_OVERLAP_CHARS = int(os.getenv("SUMMARY_PART_OVERLAP_CHARS", "0"))  # 超长章节切分时相邻分块的重叠字符数
+SUMMARY_REDUCE_MAX_TOKENS = int(os.getenv("SUMMARY_REDUCE_MAX_TOKENS", "12000"))  # 单次 reduce 输入的 token 上限
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4"))
+SUMMARY_MAP_MODEL = os.getenv("SUMMARY_MAP_MODEL", "deepseek-chat")  # 分块摘要对推理要求低，默认用更快的模型
+SUMMARY_MAX_REDUCE_ROUNDS = 4
+
+MAP_SYSTEM_PROMPT = (
+    "You are an assistant skilled in summarizing texts accurately and concisely. "
+    "You are summarizing one part of a longer document; another step will merge the partial summaries. "
+    "Keep key claims, definitions, methods, numbers and findings. Use compact Markdown bullet points."
+)
+REDUCE_SYSTEM_PROMPT = (
+    "You are an assistant skilled in merging partial summaries of consecutive parts of one document. "
+    "Combine them into one concise, non-redundant summary that keeps the key facts in document order. "
+    "Use compact Markdown bullet points."
+)
+
+ProgressCallback = Callable[[dict], Awaitable[None]]
+
+
+def should_use_map_reduce(text: str, mode: str) -> bool:
+    """mode 为 'single' / 'map_reduce' / 'auto'，auto 时按文本长度决定"""
+    if mode == "map_reduce":
+        return True
+    if mode == "single":
+        return False
+    return estimate_tokens(text) > SUMMARY_SINGLE_PASS_MAX_TOKENS
+
+
+def build_map_messages(part_text: str, part: Section, index: int, total: int) -> list[dict]:
+    location = f"section: {part.title}"
+    if part.pages:
+        location += f", pages {part.pages[0]}-{part.pages[-1]}"
+    return [
+        {"role": "system", "content": MAP_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Part {index + 1} of {total} ({location}). Summarize this part:\n\n{part_text}"},
+    ]
+
+
+def build_reduce_messages(partial_summaries: list[str]) -> list[dict]:
+    joined = "\n\n".join(f"[Part {i + 1}]\n{summary}" for i, summary in enumerate(partial_summaries))
+    return [
+        {"role": "system", "content": REDUCE_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Merge the following partial summaries:\n\n{joined}"},
+    ]
+
+
+def map_reduce_config() -> dict:
+    """影响分层摘要结果的配置，作为缓存键的一部分：修改分块参数后不会命中按旧参数生成的摘要"""
+    return {
+        "part_max_tokens": SUMMARY_PART_MAX_TOKENS,
+        "part_overlap_chars": SUMMARY_PART_OVERLAP_CHARS,
+        "reduce_max_tokens": SUMMARY_REDUCE_MAX_TOKENS,
+        "max_reduce_rounds": SUMMARY_MAX_REDUCE_ROUNDS,
+        "map_model": SUMMARY_MAP_MODEL,
+    }
+
+
+def truncate_to_budget(summaries: list[str], max_tokens: int) -> list[str]:
+    """把每个部分摘要截短到平均份额以内，使总 token 不超过 max_tokens；保留各部分的开头，文档每一部分都有体现"""
+    share = max(1, max_tokens // max(len(summaries), 1) - 2)  # 为省略号与估算的取整留出余量
+    truncated = []
+    for summary in summaries:
+        tokens = estimate_tokens(summary)
+        if tokens > share:
+            summary = summary[:int(len(summary) * share / tokens)].rstrip() + " …"
+        truncated.append(summary)
+    return truncated
+
+
+def group_by_token_budget(summaries: list[str], max_tokens: int) -> list[list[str]]:
+    """把相邻的部分摘要分组，每组总 token 不超过 max_tokens (单个超长摘要独占一组)"""
+    groups: list[list[str]] = []
+    current: list[str] = []
+    current_tokens = 0
+    for summary in summaries:
+        tokens = estimate_tokens(summary)
+        if current and current_tokens + tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(summary)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+class HierarchicalSummarizer:
+    """
+    分层摘要：把长文档按章节/token 切块并发摘要 (map)，再把部分摘要逐轮合并 (reduce)，
+    直到合并后的输入能放进一次最终摘要请求。总耗时取决于最长的分块而不是文档总长度。
+    最终摘要请求由调用方发起 (以便选择流式或非流式)，这里只返回其输入的部分摘要列表。
+    """
+
+    def __init__(self, client, map_model: str = SUMMARY_MAP_MODEL, reduce_model: Optional[str] = None,
+                 concurrency: int = SUMMARY_MAP_CONCURRENCY):
+        self.client = client
+        self.map_model = map_model
+        self.reduce_model = reduce_model or map_model
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.usage: dict = {}  # 所有中间请求的 usage 累计
+
+    async def _complete(self, messages: list[dict], model: str) -> str:
+        async with self.semaphore:
+            response = await self.client.get_chat_completion(messages=messages, model=model)
+        accumulate_usage(self.usage, response)
+        if not response.choices or not response.choices[0].message.content:
+            raise RuntimeError("AI returned an empty partial summary")
+        return response.choices[0].message.content.strip()
+
+    async def summarize_parts(self, text: str, page_offsets: Optional[list[int]] = None,
+                              on_progress: Optional[ProgressCallback] = None) -> list[str]:
+        """执行 map 与中间 reduce 轮次，返回可以放进最终摘要请求的部分摘要列表"""
+
+        async def report(event: dict) -> None:
+            if on_progress:
+                await on_progress(event)
+
+        parts = split_into_parts(text, page_offsets, max_tokens=SUMMARY_PART_MAX_TOKENS,
+                                 overlap_chars=SUMMARY_PART_OVERLAP_CHARS)
+        total = len(parts)
+        await report({"stage": "map", "completed": 0, "total": total})
+
+        completed = 0
+
+        async def summarize_part(index: int, part: Section) -> str:
+            nonlocal completed
+            summary = await self._complete(
+                build_map_messages(part.text_of(text), part, index, total), self.map_model
+            )
+            completed += 1
+            await report({"stage": "map", "completed": completed, "total": total, "part": index + 1,
+                          "title": part.title, "pages": part.pages, "summary": summary})
+            return summary
+
+        summaries = await gather_or_cancel(*(summarize_part(i, part) for i, part in enumerate(parts)))
+
+        for round_number in range(1, SUMMARY_MAX_REDUCE_ROUNDS + 1):
+            groups = group_by_token_budget(summaries, SUMMARY_REDUCE_MAX_TOKENS)
+            if len(groups) == 1:
+                break
+            await report({"stage": "reduce", "round": round_number, "groups": len(groups)})
+            summaries = await gather_or_cancel(*(
+                self._complete(build_reduce_messages(group), self.reduce_model) if len(group) > 1
+                else asyncio.sleep(0, result=group[0])
+                for group in groups
+            ))
+
+        total_tokens = sum(estimate_tokens(summary) for summary in summaries)
+        if total_tokens > SUMMARY_REDUCE_MAX_TOKENS:
+            # 达到合并轮数上限仍超出预算：截短后再交给最终摘要，避免超出模型上下文
+            print(f"Warning: partial summaries still have ~{total_tokens} tokens after "
+                  f"{SUMMARY_MAX_REDUCE_ROUNDS} reduce rounds, truncating to {SUMMARY_REDUCE_MAX_TOKENS}")
+            summaries = truncate_to_budget(summaries, SUMMARY_REDUCE_MAX_TOKENS)
+        await report({"stage": "final", "inputs": len(summaries)})
+        return summaries
+
+
+def join_partial_summaries(summaries: list[str]) -> str:
+    """最终摘要请求的输入文本"""
+    return "\n\n".join(summaries)
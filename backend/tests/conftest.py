@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# 后端模块以扁平方式互相导入 (from scheduler import ...)，测试时把 backend 目录加入搜索路径；
+# 数据目录指向临时目录，避免导入 main 时读写用户的 ~/.deepread_ai
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("DEEPREAD_DATA_DIR", tempfile.mkdtemp(prefix="deepread-tests-"))
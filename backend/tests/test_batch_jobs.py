@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from batch_jobs import list_pdf_files, resolve_batch_directory
+
+
+@pytest.fixture
+def library(tmp_path):
+    tmp_path = tmp_path.resolve()  # 根目录按真实路径配置 (与 BATCH_DIRECTORY_ROOTS 一致)
+    root = tmp_path / "papers"
+    (root / "sub").mkdir(parents=True)
+    (tmp_path / "private").mkdir()
+    for path in (root / "a.pdf", root / "sub" / "b.PDF", root / "notes.txt", tmp_path / "private" / "secret.pdf"):
+        path.write_bytes(b"%PDF-1.4")
+    return tmp_path, str(root)
+
+
+def test_lists_pdfs_under_allowed_root(library):
+    _, root = library
+    assert list_pdf_files(root, False, [root]) == [os.path.join(root, "a.pdf")]
+    assert list_pdf_files(root, True, [root]) == [os.path.join(root, "a.pdf"), os.path.join(root, "sub", "b.PDF")]
+
+
+@pytest.mark.parametrize("directory", ["{root}/../private", "{tmp}", "/"])
+def test_directories_outside_the_roots_are_rejected(library, directory):
+    tmp, root = library
+    with pytest.raises(PermissionError):
+        list_pdf_files(directory.format(root=root, tmp=tmp), True, [root])
+
+
+def test_directory_import_is_disabled_without_roots(library):
+    _, root = library
+    with pytest.raises(PermissionError):
+        resolve_batch_directory(root, [])
+
+
+@pytest.mark.skipif(not hasattr(os, "symlink") or os.name == "nt", reason="需要符号链接")
+def test_symlinks_leaving_the_root_are_skipped(library):
+    tmp, root = library
+    os.symlink(tmp / "private" / "secret.pdf", os.path.join(root, "link.pdf"))
+    os.symlink(tmp / "private", os.path.join(root, "linked-dir"))
+    assert list_pdf_files(root, True, [root]) == [os.path.join(root, "a.pdf"), os.path.join(root, "sub", "b.PDF")]
+    with pytest.raises(PermissionError):
+        list_pdf_files(os.path.join(root, "linked-dir"), False, [root])
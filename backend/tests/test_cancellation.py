@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from cancellation import gather_or_cancel
+
+
+def test_results_keep_argument_order():
+    async def value(result, delay):
+        await asyncio.sleep(delay)
+        return result
+
+    assert asyncio.run(gather_or_cancel(value("a", 0.02), value("b", 0), value("c", 0.01))) == ["a", "b", "c"]
+    assert asyncio.run(gather_or_cancel()) == []
+
+
+def test_first_failure_cancels_the_rest():
+    cancelled = []
+
+    async def slow(name):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(name)
+            raise
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("upstream failed")
+
+    async def run():
+        with pytest.raises(ValueError, match="upstream failed"):
+            await asyncio.wait_for(gather_or_cancel(slow("a"), fail(), slow("b")), 1)
+        assert sorted(cancelled) == ["a", "b"]
+
+    asyncio.run(run())
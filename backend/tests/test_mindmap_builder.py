@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from mindmap_builder import MindmapFormatError, SectionMindmapBuilder, parse_mermaid_mindmap, repair_mindmap
+
+
+def _outline(node, depth=0):
+    lines = ["  " * depth + node.text]
+    for child in node.children:
+        lines.extend(_outline(child, depth + 1))
+    return lines
+
+
+def test_well_formed_mindmap():
+    root = parse_mermaid_mindmap('mindmap\n  root(("标题"))\n    ("方法")\n      ("实验")\n    ("结论")')
+    assert _outline(root) == ["标题", "  方法", "    实验", "  结论"]
+
+
+def test_code_fence_and_leading_explanation_are_skipped():
+    content = '以下是思维导图：\n```mermaid\nmindmap\n  root((标题))\n    (方法)\n```\n'
+    assert _outline(parse_mermaid_mindmap(content)) == ["标题", "  方法"]
+
+
+def test_tabs_and_inconsistent_indentation():
+    content = "mindmap\n\troot((标题))\n\t\t(方法)\n\t\t   (细节)\n\t\t (实验)"
+    assert _outline(parse_mermaid_mindmap(content)) == ["标题", "  方法", "    细节", "    实验"]
+
+
+@pytest.mark.parametrize("line, text", [
+    ('("未闭合的括号"', "未闭合的括号"),
+    ('("缺少结尾引号)', "缺少结尾引号"),
+    ('(缺少开头引号")', "缺少开头引号"),
+    ('["方形节点"]', "方形节点"),
+    ('{{"六边形"}}', "六边形"),
+    ('id1("带 id 前缀")', "带 id 前缀"),
+    ('("文本里有 "引号" 的节点")', "文本里有 '引号' 的节点"),
+    ("纯文本节点", "纯文本节点"),
+])
+def test_node_shape_and_quote_repairs(line, text):
+    root = parse_mermaid_mindmap(f"mindmap\n  root((标题))\n    {line}")
+    assert root.children[0].text == text
+
+
+def test_extra_roots_are_attached_to_the_first_root():
+    content = "mindmap\nroot((标题))\n  (方法)\n另一个根\n  (结论)"
+    assert _outline(parse_mermaid_mindmap(content)) == ["标题", "  方法", "  另一个根", "    结论"]
+
+
+def test_directives_and_comments_are_ignored():
+    content = "mindmap\n  root((标题))\n    %% 注释\n    (方法)\n    ::icon(fa fa-book)\n    :::urgent"
+    assert _outline(parse_mermaid_mindmap(content)) == ["标题", "  方法"]
+
+
+def test_mindmap_without_children_is_rejected():
+    with pytest.raises(MindmapFormatError):
+        parse_mermaid_mindmap("mindmap\n  root((只有根节点))")
+    assert repair_mindmap("不是思维导图", "mermaid") is None
+
+
+def test_repair_renders_canonical_mermaid():
+    repaired = repair_mindmap('```\nmindmap\n\troot(标题)\n\t\t["方法"\n', "mermaid")
+    assert repaired == 'mindmap\n  root(("标题"))\n    ("方法")'
+
+
+class _SectionClient:
+    """按调用顺序返回预设的输出，并附带 usage"""
+
+    def __init__(self, outputs: list[str]):
+        self.outputs = outputs
+
+    async def get_chat_completion(self, messages, model):
+        content = self.outputs.pop(0)
+        usage = SimpleNamespace(model_dump=lambda exclude_none: {"prompt_tokens": 100, "completion_tokens": 10})
+        return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def test_invalid_subtree_is_requested_again_and_usage_is_summed():
+    client = _SectionClient(["抱歉，无法生成", 'mindmap\n  root((方法))\n    ("实验设计")'])
+    builder = SectionMindmapBuilder(client, max_retries=1)
+    tree = asyncio.run(builder.build("论文标题\n\n这是正文。", None, "mermaid"))
+    assert _outline(tree) == ["论文标题", "  方法", "    实验设计"]
+    assert builder.retries == 1
+    assert builder.failed_sections == []
+    assert builder.usage == {"prompt_tokens": 200, "completion_tokens": 20}
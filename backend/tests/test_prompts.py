@@ -0,0 +1,22 @@
+from prompts import PromptPrefixCache
+
+
+def test_cache_is_bounded_by_total_chars():
+    cache = PromptPrefixCache(max_entries=10, max_chars=250)
+    for doc in "abc":
+        cache.get_or_build("summary", doc, lambda: doc * 100)
+    assert cache.total_chars == 200
+    built = []
+    assert cache.get_or_build("summary", "b", lambda: built.append("b") or "b" * 100) == "b" * 100
+    assert built == []  # 命中缓存，且刷新为最近使用
+    assert cache.get_or_build("summary", "a", lambda: built.append("a") or "a" * 100) == "a" * 100
+    assert built == ["a"]  # "a" 已因总字符数超限被淘汰
+
+
+def test_oversized_prefix_is_not_cached():
+    cache = PromptPrefixCache(max_entries=10, max_chars=50)
+    cache.get_or_build("chat", "small", lambda: "s" * 10)
+    assert cache.get_or_build("chat", "large", lambda: "x" * 100) == "x" * 100
+    assert cache.total_chars == 10
+    cache.discard_document("small")
+    assert cache.total_chars == 0
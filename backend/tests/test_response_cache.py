@@ -0,0 +1,19 @@
+from response_cache import make_cache_key
+
+TEMPLATE = [{"role": "system", "content": "Summarize:\n\n"}, {"role": "user", "content": "Please summarize."}]
+
+
+def test_document_keys_depend_on_doc_id_prompt_and_options():
+    key = make_cache_key("summary", "model", TEMPLATE, doc_id="a" * 64)
+    assert key == make_cache_key("summary", "model", TEMPLATE, doc_id="a" * 64)
+    assert key != make_cache_key("summary", "model", TEMPLATE, doc_id="b" * 64)
+    assert key != make_cache_key("summary", "other-model", TEMPLATE, doc_id="a" * 64)
+    assert key != make_cache_key("summary", "model", TEMPLATE, options={"part_max_tokens": 1}, doc_id="a" * 64)
+    changed_prompt = [dict(TEMPLATE[0], content="Summarize briefly:\n\n"), TEMPLATE[1]]
+    assert key != make_cache_key("summary", "model", changed_prompt, doc_id="a" * 64)
+
+
+def test_keys_without_options_or_doc_id_are_unchanged():
+    messages = [{"role": "user", "content": " hello \r\n"}]
+    assert make_cache_key("translation", "model", messages, "zh") == \
+        make_cache_key("translation", "model", [{"role": "user", "content": "hello"}], "zh", options={})
@@ -0,0 +1,34 @@
+import math
+
+import pytest
+
+from retrieval import BM25_B, BM25_K1, BM25Index, Chunk
+
+
+def _index(*texts: str) -> BM25Index:
+    return BM25Index([Chunk(chunk_id=i, text=text, start=0, end=len(text), token_estimate=10)
+                      for i, text in enumerate(texts)])
+
+
+def test_scores_match_the_bm25_formula():
+    index = _index("transformer attention", "attention attention pooling", "convolution kernels")
+    lengths = [2, 3, 2]
+    average = sum(lengths) / len(lengths)
+    idf = math.log(1 + (3 - 2 + 0.5) / (2 + 0.5))
+    expected = [
+        idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average))
+        for tf, length in ((1, 2), (2, 3))
+    ] + [0.0]
+    assert index.score("attention") == pytest.approx(expected)
+    assert index.score("attention attention") == pytest.approx([2 * value for value in expected])
+
+
+def test_search_keeps_first_chunk_and_returns_document_order():
+    index = _index("title and abstract", "unrelated text", "gradient descent", "more gradient descent steps")
+    results = index.search("gradient descent", top_k=3)
+    assert [chunk.chunk_id for chunk, _ in results] == [0, 2, 3]
+
+
+def test_search_without_overlap_falls_back_to_document_order():
+    index = _index("alpha", "beta", "gamma")
+    assert [chunk.chunk_id for chunk, _ in index.search("检索增强", top_k=2)] == [0, 1]
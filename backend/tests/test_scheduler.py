@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+
+import cancellation
+import scheduler
+from cancellation import DeadlineExceeded
+from scheduler import Priority, RequestScheduler, SchedulerOverloaded
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    async def run():
+        sched = RequestScheduler(rate=1000, burst=1000, max_concurrent=1)
+        await sched.acquire("key", Priority.CHAT)  # 占住唯一的并发槽，后面的请求全部排队
+        order = []
+
+        async def request(name: str, priority: Priority):
+            await sched.acquire("key", priority)
+            order.append(name)
+            sched.release("key")
+
+        tasks = []
+        for name, priority in [("background", Priority.BACKGROUND), ("mindmap", Priority.MINDMAP),
+                               ("summary-1", Priority.SUMMARY), ("chat", Priority.CHAT),
+                               ("summary-2", Priority.SUMMARY)]:
+            tasks.append(asyncio.create_task(request(name, priority)))
+            await asyncio.sleep(0)  # 保证按列表顺序入队
+        sched.release("key")
+        await asyncio.gather(*tasks)
+        return order, sched.stats()
+
+    order, stats = asyncio.run(run())
+    assert order == ["chat", "summary-1", "summary-2", "mindmap", "background"]
+    assert stats["active"] == 0
+    assert all(count == 0 for count in stats["queued"].values())
+
+
+def test_full_queue_is_rejected(monkeypatch):
+    monkeypatch.setitem(scheduler.QUEUE_LIMITS, Priority.CHAT, 1)
+
+    async def run():
+        sched = RequestScheduler(rate=1000, burst=1000, max_concurrent=1)
+        await sched.acquire("key", Priority.CHAT)
+        queued = asyncio.create_task(sched.acquire("key", Priority.CHAT))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerOverloaded) as excinfo:
+            await sched.acquire("key", Priority.CHAT)
+        # 其他优先级的队列不受影响
+        other = asyncio.create_task(sched.acquire("key", Priority.SUMMARY))
+        await asyncio.sleep(0)
+        assert sched.stats()["queued"]["summary"] == 1
+        sched.release("key")
+        await queued
+        sched.release("key")
+        await other
+        sched.release("key")
+        return excinfo.value, sched.stats()
+
+    error, stats = asyncio.run(run())
+    assert error.retry_after >= 1
+    assert stats["rejected"] == 1
+    assert stats["active"] == 0
+
+
+def test_overloaded_maps_to_503_with_retry_after():
+    from fastapi import HTTPException
+
+    import main
+
+    with pytest.raises(HTTPException) as excinfo:
+        main.raise_for_upstream_error(SchedulerOverloaded("Too many queued chat requests", 2.5))
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.headers["Retry-After"] == "3"
+
+
+def test_queue_wait_is_capped_by_request_deadline():
+    async def run():
+        sched = RequestScheduler(rate=1000, burst=1000, max_concurrent=1, queue_timeout=30)
+        await sched.acquire("key", Priority.CHAT)
+        cancellation._deadline.set(time.monotonic() + 0.1)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await sched.acquire("key", Priority.CHAT)
+        elapsed = time.monotonic() - started
+        # 截止时间已过：不再排队，直接失败
+        with pytest.raises(DeadlineExceeded):
+            await sched.acquire("key", Priority.CHAT)
+        return elapsed, sched.stats()
+
+    elapsed, stats = asyncio.run(run())
+    assert elapsed < 5
+    assert stats["queued"]["chat"] == 0
+    assert stats["rejected"] == 0  # 超过截止时间不算过载
+    assert stats["active"] == 1
+
+
+def test_idle_keys_are_evicted_when_new_keys_arrive():
+    async def run():
+        sched = RequestScheduler(rate=1000, burst=2, max_concurrent=2)
+        await sched.acquire("busy", Priority.CHAT)  # 仍在进行中的请求
+        for i in range(100):
+            await sched.acquire(f"user-{i}", Priority.CHAT)
+            sched.release(f"user-{i}")
+            await asyncio.sleep(0.003)  # 令牌桶在下一个 Key 到来前补满
+        keys = set(sched._keys)
+        sched.release("busy")
+        return keys
+
+    keys = asyncio.run(run())
+    assert "busy" in keys
+    assert len(keys) <= 3
@@ -0,0 +1,124 @@
+import asyncio
+import gc
+
+from single_flight import SingleFlight
+
+
+class _Upstream:
+    """产出 chunk 后一直挂起的上游流，记录是否被关闭"""
+
+    def __init__(self, chunks: list):
+        self.chunks = chunks
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            yield chunk
+        await asyncio.Event().wait()
+
+    async def aclose(self) -> None:
+        self.closed = True
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    async def run():
+        flights = SingleFlight()
+        calls = 0
+
+        async def call():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flights.do("key", call) for _ in range(3)))
+        return results, calls, flights.stats()
+
+    results, calls, stats = asyncio.run(run())
+    assert results == ["result"] * 3
+    assert calls == 1
+    assert stats["coalesced"] == 2
+    assert stats["in_flight"] == 0
+
+
+def test_call_is_cancelled_only_when_last_waiter_leaves():
+    async def run():
+        flights = SingleFlight()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def call():
+            started.set()
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = asyncio.create_task(flights.do("key", call))
+        second = asyncio.create_task(flights.do("key", call))
+        await started.wait()
+
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        await asyncio.sleep(0)
+        still_running = not cancelled.is_set() and flights.in_flight() == 1
+
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        return still_running, flights.in_flight()
+
+    still_running, in_flight = asyncio.run(run())
+    assert still_running
+    assert in_flight == 0
+
+
+def test_stream_is_closed_when_last_subscriber_leaves():
+    async def run():
+        flights = SingleFlight()
+        upstream = _Upstream(["a", "b"])
+
+        async def open_stream():
+            return upstream
+
+        first = await flights.stream("key", open_stream)
+        second = await flights.stream("key", open_stream)
+        assert [await first.__anext__(), await first.__anext__()] == ["a", "b"]
+
+        await first.aclose()
+        await asyncio.sleep(0)
+        still_open = not upstream.closed and flights.in_flight() == 1
+
+        await second.aclose()  # 从未迭代过的订阅也要注销
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return still_open, upstream.closed, flights.in_flight()
+
+    still_open, closed, in_flight = asyncio.run(run())
+    assert still_open
+    assert closed
+    assert in_flight == 0
+
+
+def test_dropped_subscription_releases_the_flight():
+    async def run():
+        flights = SingleFlight()
+        upstream = _Upstream(["a"])
+
+        async def open_stream():
+            return upstream
+
+        subscription = await flights.stream("key", open_stream)
+        del subscription
+        gc.collect()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return upstream.closed, flights.in_flight()
+
+    closed, in_flight = asyncio.run(run())
+    assert closed
+    assert in_flight == 0
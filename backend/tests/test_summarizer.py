@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from retrieval import estimate_tokens
+from summarizer import HierarchicalSummarizer, truncate_to_budget
+
+
+class _FailingClient:
+    """第一个分块的请求立即失败，其余请求一直挂起直到被取消"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+
+    async def get_chat_completion(self, messages, model):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("upstream failed")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content="summary"))])
+
+
+def test_failed_map_call_cancels_the_other_parts():
+    client = _FailingClient()
+    text = "\n\n".join(f"Paragraph {i}. " + "word " * 2000 for i in range(4))
+
+    async def run():
+        summarizer = HierarchicalSummarizer(client, concurrency=4)
+        with pytest.raises(RuntimeError, match="upstream failed"):
+            await asyncio.wait_for(summarizer.summarize_parts(text), 5)
+        # 异常抛出时其余分块已经被取消，而不是等到事件循环关闭
+        assert client.calls > 1
+        assert client.cancelled == client.calls - 1
+
+    asyncio.run(run())
+
+
+def test_truncate_to_budget_fits_the_budget():
+    summaries = ["word " * 3000 for _ in range(5)]
+    truncated = truncate_to_budget(summaries, 1000)
+    assert len(truncated) == 5
+    assert sum(estimate_tokens(summary) for summary in truncated) <= 1000
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from translation import Translator, parse_batch_translations
+
+
+@pytest.mark.parametrize("content", [
+    '{"translations": ["你好", "世界"]}',
+    '["你好", "世界"]',
+    '```json\n{"translations": ["你好", "世界"]}\n```',
+    '```\n["你好", "世界"]\n```',
+    '  {"translations": [" 你好 ", "世界\\n"]}  ',
+])
+def test_valid_batch_output(content):
+    assert parse_batch_translations(content, 2) == ["你好", "世界"]
+
+
+@pytest.mark.parametrize("content", [
+    '{"translations": ["你好"]}',  # 条数不一致
+    '{"translations": ["你好", "世界", "多余"]}',
+    '{"translations": ["你好", 2]}',  # 元素不是字符串
+    '{"result": ["你好", "世界"]}',  # 缺少 translations 字段
+    '{"translations": "你好 世界"}',
+    '{"translations": ["你好", "世界"]',  # JSON 被截断
+    "你好\n世界",
+    "",
+])
+def test_invalid_batch_output(content):
+    assert parse_batch_translations(content, 2) is None
+
+
+class _FailingClient:
+    """第一个请求立即失败，其余请求一直挂起直到被取消"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+
+    async def get_chat_completion(self, messages, model, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("upstream failed")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+def test_failed_request_cancels_the_other_batches():
+    client = _FailingClient()
+    texts = [f"paragraph {i} " + "word " * 1500 for i in range(4)]  # 每段单独成组
+
+    async def run():
+        translator = Translator(client)
+        with pytest.raises(RuntimeError, match="upstream failed"):
+            await asyncio.wait_for(translator.translate(texts, bypass_cache=True), 5)
+        assert client.calls > 1
+        assert client.cancelled == client.calls - 1
+
+    asyncio.run(run())
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+from typing import Optional
+
+from cancellation import gather_or_cancel
+from response_cache import make_cache_key, response_cache
+from retrieval import estimate_tokens
+
+# --- 划词翻译配置 (均可通过环境变量覆盖) ---
+TRANSLATE_MODEL = os.getenv("TRANSLATE_MODEL", "deepseek-chat")
+TRANSLATE_DEFAULT_LANG = os.getenv("TRANSLATE_DEFAULT_LANG", "简体中文")
+TRANSLATE_BATCH_MAX_TOKENS = int(os.getenv("TRANSLATE_BATCH_MAX_TOKENS", "2000"))  # 合并为一次请求的原文 token 上限
+TRANSLATE_BATCH_MAX_ITEMS = int(os.getenv("TRANSLATE_BATCH_MAX_ITEMS", "20"))  # 合并为一次请求的最大片段数
+TRANSLATE_MAX_CHARS = int(os.getenv("TRANSLATE_MAX_CHARS", "20000"))  # 单次请求的原文总字符数上限 (整篇文档请用摘要)
+TRANSLATE_CONCURRENCY = int(os.getenv("TRANSLATE_CONCURRENCY", "4"))
+TRANSLATION_CACHE_KIND = "translation"
+
+# 翻译只需要原文，不带文档全文与聊天用的 Markdown 格式规则
+TRANSLATE_SYSTEM_PROMPT = (
+    "你是专业翻译。把用户给出的文本翻译成{target_lang}，译文准确、通顺、易懂；"
+    "专业术语可在译文后用括号保留原文。只输出译文，不要解释，不要使用 Markdown。"
+)
+TRANSLATE_BATCH_SYSTEM_PROMPT = (
+    "你是专业翻译。用户会给出一个 JSON 字符串数组，请把每个元素分别翻译成{target_lang}，译文准确、通顺、易懂。"
+    "只输出 JSON 对象 {{\"translations\": [...]}}，数组长度和顺序与输入完全一致，不要输出其他内容。"
+)
+
+
+def build_translate_messages(text: str, target_lang: str) -> list[dict]:
+    return [
+        {"role": "system", "content": TRANSLATE_SYSTEM_PROMPT.format(target_lang=target_lang)},
+        {"role": "user", "content": text},
+    ]
+
+
+def build_batch_translate_messages(texts: list[str], target_lang: str) -> list[dict]:
+    return [
+        {"role": "system", "content": TRANSLATE_BATCH_SYSTEM_PROMPT.format(target_lang=target_lang)},
+        {"role": "user", "content": json.dumps(texts, ensure_ascii=False)},
+    ]
+
+
+def translation_cache_key(text: str, target_lang: str, model: str = TRANSLATE_MODEL) -> str:
+    """缓存键只取决于 (原文, 目标语言, 模型)，与单独翻译还是合并翻译无关"""
+    return make_cache_key(TRANSLATION_CACHE_KIND, model, [{"role": "user", "content": text}],
+                          output_format=target_lang.strip().lower())
+
+
+def group_into_batches(texts: list[str], max_tokens: int = TRANSLATE_BATCH_MAX_TOKENS,
+                       max_items: int = TRANSLATE_BATCH_MAX_ITEMS) -> list[list[str]]:
+    """按 token 预算与片段数把待翻译文本分组 (单个超长文本独占一组)"""
+    batches: list[list[str]] = []
+    current: list[str] = []
+    current_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch_translations(content: str, expected: int) -> Optional[list[str]]:
+    """解析合并翻译的 JSON 输出；格式不对或条数不一致时返回 None"""
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.strip("`").removeprefix("json").strip()
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return None
+    translations = data.get("translations") if isinstance(data, dict) else data
+    if not isinstance(translations, list) or len(translations) != expected:
+        return None
+    if not all(isinstance(item, str) for item in translations):
+        return None
+    return [item.strip() for item in translations]
+
+
+class Translator:
+    """
+    划词翻译：先按 (原文, 目标语言) 查持久化缓存，未命中的片段按 token 预算合并成尽量少的请求，
+    每个片段的译文单独写入缓存，之后无论单独还是与其他片段一起翻译都能直接命中。
+    合并翻译的输出无法解析时，该组退回逐条翻译。
+    """
+
+    def __init__(self, client, model: str = TRANSLATE_MODEL, concurrency: int = TRANSLATE_CONCURRENCY):
+        self.client = client
+        self.model = model
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.requests = 0  # 本次实际发出的上游请求数
+
+    async def translate(self, texts: list[str], target_lang: str = TRANSLATE_DEFAULT_LANG,
+                        bypass_cache: bool = False) -> tuple[list[str], list[bool]]:
+        """返回与 texts 一一对应的 (译文列表, 是否命中缓存列表)；重复的原文只翻译一次"""
+        unique = list(dict.fromkeys(text.strip() for text in texts))
+        keys = {text: translation_cache_key(text, target_lang, self.model) for text in unique}
+        cached = {} if bypass_cache else await self._lookup(keys)
+
+        pending = [text for text in unique if text and text not in cached]
+        translated: dict[str, str] = {}
+        if pending:
+            results = await gather_or_cancel(*(
+                self._translate_batch(batch, target_lang) for batch in group_into_batches(pending)
+            ))
+            cacheable = {}
+            for result in results:
+                for text, (translation, complete) in result.items():
+                    translated[text] = translation
+                    if complete:
+                        cacheable[keys[text]] = translation
+            await self._store(cacheable)
+
+        translations, hits = [], []
+        for text in texts:
+            text = text.strip()
+            translations.append(cached.get(text, translated.get(text, "")))
+            hits.append(text in cached)
+        return translations, hits
+
+    async def _complete(self, messages: list[dict], **kwargs) -> tuple[str, Optional[str]]:
+        async with self.semaphore:
+            response = await self.client.get_chat_completion(messages=messages, model=self.model, **kwargs)
+        self.requests += 1
+        if not response.choices or not response.choices[0].message.content:
+            raise RuntimeError("AI returned an empty translation")
+        choice = response.choices[0]
+        return choice.message.content.strip(), choice.finish_reason
+
+    async def _translate_batch(self, batch: list[str], target_lang: str) -> dict[str, tuple[str, bool]]:
+        """返回 {原文: (译文, 是否可缓存)}；被截断的译文 (finish_reason 不是 stop) 仍然返回，但不写入缓存"""
+        if len(batch) > 1:
+            content, finish_reason = await self._complete(
+                build_batch_translate_messages(batch, target_lang), response_format={"type": "json_object"}
+            )
+            translations = parse_batch_translations(content, len(batch)) if finish_reason == "stop" else None
+            if translations is not None:
+                return {text: (translation, True) for text, translation in zip(batch, translations)}
+            print(f"Warning: batch translation output could not be parsed, translating {len(batch)} texts one by one")
+        results = await gather_or_cancel(*(
+            self._complete(build_translate_messages(text, target_lang)) for text in batch
+        ))
+        return {text: (content, finish_reason == "stop") for text, (content, finish_reason) in zip(batch, results)}
+
+    async def _lookup(self, keys: dict[str, str]) -> dict[str, str]:
+        def lookup() -> dict[str, str]:
+            found = {}
+            for text, key in keys.items():
+                entry = response_cache.get(key)
+                if entry is not None:
+                    found[text] = entry.content
+            return found
+
+        try:
+            return await asyncio.to_thread(lookup)
+        except Exception as e:  # 缓存故障不影响翻译本身
+            print(f"Warning: translation cache lookup failed: {e}")
+            return {}
+
+    async def _store(self, entries: dict[str, str]) -> None:
+        def store() -> None:
+            for key, content in entries.items():
+                response_cache.put(key, TRANSLATION_CACHE_KIND, self.model, content)
+
+        try:
+            await asyncio.to_thread(store)
+        except Exception as e:
+            print(f"Warning: translation cache write failed: {e}")
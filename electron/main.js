@@ -2,6 +2,7 @@
 const { app, BrowserWindow, dialog } = require('electron');
 const path = require('path');
 const { spawn } = require('child_process');
+const http = require('http');
 const fixPath = require('fix-path');
 const fs = require('fs');
 
@@ -11,6 +12,21 @@ let mainWindow;
 let backendProcess = null;
 const FASTAPI_PORT = 8008;
 const FASTAPI_HOST = '127.0.0.1';
+const HEALTHZ_URL = `http://${FASTAPI_HOST}:${FASTAPI_PORT}/healthz`;
+const HEALTHZ_POLL_INTERVAL_MS = 100;
+const BACKEND_STARTUP_TIMEOUT_MS = 30000; // 冷启动 (PyInstaller 解包) 可能较慢，超时只作为兜底
+
+// 请求一次后端就绪探针，返回是否就绪 (连接被拒绝或超时均视为尚未就绪)
+function probeBackend() {
+  return new Promise((resolve) => {
+    const req = http.get(HEALTHZ_URL, { timeout: 1000 }, (res) => {
+      res.resume();
+      resolve(res.statusCode === 200);
+    });
+    req.on('timeout', () => req.destroy());
+    req.on('error', () => resolve(false));
+  });
+}
 
 function createMainWindow() {
   mainWindow = new BrowserWindow({
@@ -88,27 +104,27 @@ function startBackend() {
         return reject(new Error(errMessage));
     }
 
-    backendProcess = spawn(actualBackendExecutablePath, [], { cwd: actualBackendWorkingDir });
+    // 把启动时刻传给后端，后端据此报告包括进程启动在内的冷启动耗时 (/api/stats/startup)
+    const launchedAt = Date.now();
+    backendProcess = spawn(actualBackendExecutablePath, [], {
+      cwd: actualBackendWorkingDir,
+      env: { ...process.env, DEEPREAD_LAUNCH_EPOCH_MS: String(launchedAt) },
+    });
 
     let backendStarted = false;
+    let startupFinished = false;
     let accumulatedStdout = '';
     let accumulatedStderr = '';
-    const startupSuccessMessage = `Uvicorn running on http://${FASTAPI_HOST}:${FASTAPI_PORT}`;
-    const timeoutDuration = 15000;
     let startupTimeout;
+    let pollTimer;
 
     function cleanupAndFinish(action, value) {
+        startupFinished = true;
         if (startupTimeout) {
             clearTimeout(startupTimeout);
         }
-        if (backendProcess && !backendProcess.killed) { // 检查进程是否还存在且未被杀死
-            // 只有在 Promise 还没完成时才移除监听器，避免重复操作或操作已关闭的流
-            if (!backendStarted || (action === 'reject' && value instanceof Error && value.message.includes('Timeout'))) {
-                backendProcess.stdout.removeAllListeners('data');
-                backendProcess.stderr.removeAllListeners('data');
-                // backendProcess.removeListener('close', onClose); // 命名事件处理函数
-                // backendProcess.removeListener('error', onError);   // 命名事件处理函数
-            }
+        if (pollTimer) {
+            clearTimeout(pollTimer);
         }
         if (action === 'resolve') {
             if (!resolve.__calledOnce) { resolve(value); resolve.__calledOnce = true; if(reject.__calledOnce) console.warn("[Main.js] Resolve called after reject");}
@@ -128,28 +144,39 @@ function startBackend() {
             dialog.showErrorBox('Backend Timeout', errMessage);
             cleanupAndFinish('reject', new Error(errMessage));
         }
-    }, timeoutDuration);
+    }, BACKEND_STARTUP_TIMEOUT_MS);
 
-    function checkForStartupMessage(dataChunk) {
-        if (!backendStarted && dataChunk.includes(startupSuccessMessage)) {
-            backendStarted = true;
-            console.log('[Main.js] Backend started successfully (detected in output).');
-            cleanupAndFinish('resolve');
+    // 轮询 /healthz 判断后端是否就绪，而不是依赖 Uvicorn 的日志文本
+    async function pollHealthz() {
+        if (startupFinished) {
+            return;
         }
+        if (await probeBackend()) {
+            if (!startupFinished) {
+                backendStarted = true;
+                console.log(`[Main.js] Backend ready after ${Date.now() - launchedAt} ms (healthz).`);
+                cleanupAndFinish('resolve');
+            }
+            return;
+        }
+        pollTimer = setTimeout(pollHealthz, HEALTHZ_POLL_INTERVAL_MS);
     }
+    pollHealthz();
 
     backendProcess.stdout.on('data', (data) => {
       const output = data.toString();
-      accumulatedStdout += output;
+      if (!backendStarted) {
+        accumulatedStdout += output;
+      }
       console.log(`Backend STDOUT: ${output}`);
-      checkForStartupMessage(output);
     });
 
     backendProcess.stderr.on('data', (data) => {
       const errorOutput = data.toString();
-      accumulatedStderr += errorOutput;
+      if (!backendStarted) {
+        accumulatedStderr += errorOutput;
+      }
       console.error(`Backend STDERR: ${errorOutput}`);
-      checkForStartupMessage(errorOutput);
     });
 
     const onClose = (code) => {
@@ -21,7 +21,9 @@ apiClient.interceptors.request.use(
     const requiresApiKeyPaths = [
       "/llm/summarize",
       "/llm/chat_with_context",
+      "/llm/translate",
       "/pdf/generate_mindmap", // 假设这个也需要LLM
+      "/chat/sessions",
     ];
 
     // 检查当前请求的 URL 是否需要 API Key
@@ -43,9 +45,16 @@ apiClient.interceptors.request.use(
 );
 
 // 定义 API 函数
+// 后端将提取结果登记为 doc_id，后续请求只需携带 doc_id，无需回传全文
 export const uploadPdfAndExtractText = async (
   file: File
-): Promise<{ filename: string; extracted_text: string; message?: string }> => {
+): Promise<{
+  filename: string;
+  doc_id?: string;
+  char_count?: number;
+  extracted_text: string | null;
+  message?: string;
+}> => {
   const formData = new FormData();
   formData.append("file", file);
 
@@ -54,6 +63,7 @@ export const uploadPdfAndExtractText = async (
       headers: {
         "Content-Type": "multipart/form-data",
       },
+      params: { include_text: false },
     });
     return response.data;
   } catch (error) {
@@ -68,10 +78,14 @@ export const uploadPdfAndExtractText = async (
 };
 
 export const summarizeText = async (
-  text: string
-): Promise<{ summary: string }> => {
+  docId: string,
+  bypassCache = false // 为 true 时忽略后端缓存的结果并重新生成
+): Promise<{ summary: string; cached?: boolean }> => {
   try {
-    const response = await apiClient.post("/llm/summarize", { text });
+    const response = await apiClient.post("/llm/summarize", {
+      doc_id: docId,
+      bypass_cache: bypassCache,
+    });
     return response.data;
   } catch (error) {
     console.error("Error summarizing text:", error);
@@ -82,14 +96,21 @@ export const summarizeText = async (
   }
 };
 
+// 后端按问题检索出的文档片段 (页码从 1 开始)
+export interface SourcePassage {
+  chunk_id: number;
+  pages: number[];
+  score: number;
+}
+
 export const chatWithContext = async (
   userQuery: string,
-  documentContext: string
-): Promise<{ ai_response: string }> => {
+  docId: string
+): Promise<{ ai_response: string; sources?: SourcePassage[] }> => {
   try {
     const response = await apiClient.post("/llm/chat_with_context", {
       user_query: userQuery,
-      document_context: documentContext,
+      doc_id: docId,
     });
     return response.data;
   } catch (error) {
@@ -107,13 +128,15 @@ export const chatWithContext = async (
 };
 
 export const generateMindmap = async (
-  documentText: string,
-  outputFormat: "mermaid" | "json" = "mermaid"
-): Promise<{ mindmap_data: string; format_used: string }> => {
+  docId: string,
+  outputFormat: "mermaid" | "json" = "mermaid",
+  bypassCache = false
+): Promise<{ mindmap_data: string; format_used: string; cached?: boolean }> => {
   try {
     const response = await apiClient.post("/pdf/generate_mindmap", {
-      document_text: documentText,
+      doc_id: docId,
       output_format: outputFormat,
+      bypass_cache: bypassCache,
     });
     return response.data;
   } catch (error) {
@@ -126,3 +149,267 @@ export const generateMindmap = async (
     throw new Error("An unexpected error occurred while generating mindmap.");
   }
 };
+
+// 已登记文档的全文与分页文本。后端返回 ETag + Cache-Control: no-cache，
+// 浏览器 (含 Electron) 的 HTTP 缓存会自动带上 If-None-Match 重新验证，未变化时只传输 304
+export interface DocumentText {
+  doc_id: string;
+  filename?: string | null;
+  char_count: number;
+  page_count: number;
+  text: string;
+}
+
+export interface DocumentPageText {
+  doc_id: string;
+  page_number: number; // 从 1 开始
+  page_count: number;
+  text: string;
+}
+
+export const getDocument = async (docId: string): Promise<DocumentText> => {
+  try {
+    const response = await apiClient.get(`/documents/${docId}`);
+    return response.data;
+  } catch (error) {
+    console.error("Error fetching document:", error);
+    if (axios.isAxiosError(error) && error.response) {
+      throw new Error(error.response.data.detail || "Failed to fetch document");
+    }
+    throw new Error("An unexpected error occurred while fetching document.");
+  }
+};
+
+export const getDocumentPage = async (
+  docId: string,
+  pageNumber: number
+): Promise<DocumentPageText> => {
+  try {
+    const response = await apiClient.get(
+      `/documents/${docId}/pages/${pageNumber}`
+    );
+    return response.data;
+  } catch (error) {
+    console.error("Error fetching document page:", error);
+    if (axios.isAxiosError(error) && error.response) {
+      throw new Error(
+        error.response.data.detail || "Failed to fetch document page"
+      );
+    }
+    throw new Error("An unexpected error occurred while fetching document page.");
+  }
+};
+
+// 划词翻译：只发送选中的文本，多段文本可一次提交；译文在后端按 (原文, 目标语言) 缓存
+export const translateTexts = async (
+  texts: string[],
+  targetLang = "简体中文"
+): Promise<{ translations: string[]; target_lang: string; cached?: boolean[] }> => {
+  try {
+    const response = await apiClient.post("/llm/translate", {
+      texts,
+      target_lang: targetLang,
+    });
+    return response.data;
+  } catch (error) {
+    console.error("Error translating text:", error);
+    if (axios.isAxiosError(error) && error.response) {
+      throw new Error(error.response.data.detail || "Failed to translate text");
+    }
+    throw new Error("An unexpected error occurred while translating text.");
+  }
+};
+
+// --- 流式接口 (Server-Sent Events) ---
+// 后端事件: reasoning / delta 为增量文本，done 携带 usage 与完整结果，error 表示流中途出错
+export interface StreamUsage {
+  prompt_tokens?: number;
+  completion_tokens?: number;
+  total_tokens?: number;
+  prompt_cache_hit_tokens?: number;
+  prompt_cache_miss_tokens?: number;
+  [key: string]: unknown;
+}
+
+export interface StreamDonePayload {
+  usage: StreamUsage | null;
+  finish_reason: string | null;
+  cached?: boolean;
+  [key: string]: unknown;
+}
+
+export interface StreamHandlers {
+  onDelta?: (delta: string) => void;
+  onReasoning?: (delta: string) => void;
+  signal?: AbortSignal;
+  bypassCache?: boolean; // 仅对摘要与思维导图有效
+}
+
+const parseSseBlock = (block: string): { event: string; data: string } => {
+  let event = "message";
+  const dataLines: string[] = [];
+  for (const line of block.split("\n")) {
+    if (line.startsWith("event:")) {
+      event = line.slice(6).trim();
+    } else if (line.startsWith("data:")) {
+      dataLines.push(line.slice(5).trimStart());
+    }
+  }
+  return { event, data: dataLines.join("\n") };
+};
+
+// 携带 HTTP 状态码的错误，调用方据此区分会话过期 (404/410) 等情况，而不是匹配错误文本
+export class ApiError extends Error {
+  status: number;
+
+  constructor(message: string, status: number) {
+    super(message);
+    this.name = "ApiError";
+    this.status = status;
+  }
+}
+
+// EventSource 只支持 GET，这里用 fetch + ReadableStream 解析 POST 返回的 SSE
+const postEventStream = async <T extends StreamDonePayload>(
+  path: string,
+  body: Record<string, unknown>,
+  handlers: StreamHandlers = {}
+): Promise<T> => {
+  const headers: Record<string, string> = {
+    "Content-Type": "application/json",
+    Accept: "text/event-stream",
+  };
+  const userApiKey = localStorage.getItem(LS_API_KEY_NAME);
+  if (userApiKey) {
+    headers["X-User-API-Key"] = userApiKey;
+  }
+
+  const response = await fetch(`${API_BASE_URL}${path}`, {
+    method: "POST",
+    headers,
+    body: JSON.stringify(body),
+    signal: handlers.signal,
+  });
+  if (!response.ok || !response.body) {
+    let detail = `Request failed with status ${response.status}`;
+    try {
+      detail = (await response.json()).detail || detail;
+    } catch {
+      // 响应体不是 JSON，保留默认错误信息
+    }
+    throw new ApiError(detail, response.status);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true }).replace(/\r\n/g, "\n");
+
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const { event, data } = parseSseBlock(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf("\n\n");
+      if (!data) continue;
+
+      const payload = JSON.parse(data);
+      if (event === "delta") {
+        handlers.onDelta?.(payload.delta);
+      } else if (event === "reasoning") {
+        handlers.onReasoning?.(payload.delta);
+      } else if (event === "error") {
+        throw new Error(payload.detail || "Stream interrupted");
+      } else if (event === "done") {
+        return payload as T;
+      }
+    }
+  }
+  throw new Error("Stream ended before completion.");
+};
+
+export const summarizeTextStream = (
+  docId: string,
+  handlers: StreamHandlers = {}
+): Promise<StreamDonePayload & { summary: string }> =>
+  postEventStream(
+    "/llm/summarize/stream",
+    { doc_id: docId, bypass_cache: !!handlers.bypassCache },
+    handlers
+  );
+
+export const chatWithContextStream = (
+  userQuery: string,
+  docId: string,
+  handlers: StreamHandlers = {}
+): Promise<
+  StreamDonePayload & { ai_response: string; sources?: SourcePassage[] }
+> =>
+  postEventStream(
+    "/llm/chat_with_context/stream",
+    { user_query: userQuery, doc_id: docId },
+    handlers
+  );
+
+// 多轮对话会话：历史保存在后端，每轮只发送新问题
+export interface ChatSessionInfo {
+  session_id: string;
+  doc_id: string;
+  turn_count: number;
+  history_turns: number;
+  history_tokens: number;
+  summary: string;
+  compactions: number;
+}
+
+export const createChatSession = async (
+  docId: string
+): Promise<ChatSessionInfo> => {
+  try {
+    const response = await apiClient.post("/chat/sessions", { doc_id: docId });
+    return response.data;
+  } catch (error) {
+    console.error("Error creating chat session:", error);
+    if (axios.isAxiosError(error) && error.response) {
+      throw new Error(
+        error.response.data.detail || "Failed to create chat session"
+      );
+    }
+    throw new Error("An unexpected error occurred while creating chat session.");
+  }
+};
+
+export const chatSessionMessageStream = (
+  sessionId: string,
+  userQuery: string,
+  handlers: StreamHandlers = {}
+): Promise<
+  StreamDonePayload & {
+    ai_response: string;
+    sources?: SourcePassage[];
+    session_id: string;
+    turn_count: number;
+  }
+> =>
+  postEventStream(
+    `/chat/sessions/${sessionId}/messages/stream`,
+    { user_query: userQuery },
+    handlers
+  );
+
+export const generateMindmapStream = (
+  docId: string,
+  outputFormat: "mermaid" | "json" = "mermaid",
+  handlers: StreamHandlers = {}
+): Promise<StreamDonePayload & { mindmap_data: string; format_used: string }> =>
+  postEventStream(
+    "/pdf/generate_mindmap/stream",
+    {
+      doc_id: docId,
+      output_format: outputFormat,
+      bypass_cache: !!handlers.bypassCache,
+    },
+    handlers
+  );